@@ -1,1264 +1,5515 @@
-import telebot
-from telebot import types
-import threading
-import os
-import json
-import time
-import requests
-import re
-import logging
-from datetime import datetime, timedelta
-from uuid import uuid4
-import sqlite3
-import shutil
-import hashlib
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log', encoding='utf-8')
-    ]
-)
-logger = logging.getLogger(__name__)
-
-# Загрузка токена из переменных окружения
-TOKEN = os.environ.get('BOT_TOKEN')
-if not TOKEN:
-    logger.error("BOT_TOKEN не установлен.")
-    raise ValueError("BOT_TOKEN is not set")
-
-bot = telebot.TeleBot(TOKEN)
-
-DB_FILE = 'inventory_bot.db'
-BACKUP_DIR = 'backups'
-
-# Создаем директорию для бэкапов
-os.makedirs(BACKUP_DIR, exist_ok=True)
-
-# Кэш для данных
-items_cache = {}
-events_cache = []
-admins_cache = []
-
-# Блокировка для thread-safe доступа
-db_lock = threading.Lock()
-
-# Словарь для месяцев
-MONTHS = {
-    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
-    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12
-}
-MONTHS_RU = {
-    1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля', 5: 'мая', 6: 'июня',
-    7: 'июля', 8: 'августа', 9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
-}
-
-# Сопоставление хранилищ
-STORAGE_IDS = {
-    'Гринбокс 11': 'gb11',
-    'Гринбокс 12': 'gb12'
-}
-REVERSE_STORAGE_IDS = {v: k for k, v in STORAGE_IDS.items()}
-
-# Режим админа
-SECRET_WORD = "админ123"
-
-# Функции резервного копирования
-def create_backup(reason="manual"):
-    """Создание резервной копии базы данных"""
-    try:
-        if not os.path.exists(DB_FILE):
-            logger.warning(f"Файл базы данных {DB_FILE} не существует для резервного копирования")
-            return None
-            
-        # Создаем имя файла с временной меткой
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"inventory_backup_{timestamp}_{reason}.db"
-        backup_path = os.path.join(BACKUP_DIR, backup_filename)
-        
-        # Копируем файл
-        shutil.copy2(DB_FILE, backup_path)
-        
-        # Проверяем, что файл создан
-        if os.path.exists(backup_path):
-            file_size = os.path.getsize(backup_path)
-            logger.info(f"Создана резервная копия: {backup_filename} ({file_size} bytes) - причина: {reason}")
-            
-            # Очистка старых бэкапов (оставляем последние 50)
-            cleanup_old_backups()
-            
-            return backup_path
-        else:
-            logger.error(f"Не удалось создать резервную копию: {backup_path}")
-            return None
-            
-    except Exception as e:
-        logger.error(f"Ошибка при создании резервной копии: {e}")
-        return None
-
-def cleanup_old_backups(max_backups=50):
-    """Очистка старых резервных копий"""
-    try:
-        if not os.path.exists(BACKUP_DIR):
-            return
-            
-        backups = []
-        for filename in os.listdir(BACKUP_DIR):
-            if filename.startswith("inventory_backup_") and filename.endswith(".db"):
-                file_path = os.path.join(BACKUP_DIR, filename)
-                if os.path.isfile(file_path):
-                    backups.append((file_path, os.path.getctime(file_path)))
-        
-        # Сортируем по дате создания (старые сначала)
-        backups.sort(key=lambda x: x[1])
-        
-        # Удаляем старые бэкапы, если превышен лимит
-        if len(backups) > max_backups:
-            for i in range(len(backups) - max_backups):
-                old_backup_path = backups[i][0]
-                try:
-                    os.remove(old_backup_path)
-                    logger.info(f"Удален старый бэкап: {os.path.basename(old_backup_path)}")
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении старого бэкапа {old_backup_path}: {e}")
-                    
-    except Exception as e:
-        logger.error(f"Ошибка при очистке старых бэкапов: {e}")
-
-# Нормализация текста
-def normalize_text(text):
-    return ' '.join(text.strip().split()).lower()
-
-# Функции для работы с базой данных
-def init_database():
-    """Инициализация базы данных и создание таблиц"""
-    with db_lock:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        cursor = conn.cursor()
-        # Таблица предметов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                item_name TEXT NOT NULL,
-                storage_id TEXT NOT NULL,
-                issued INTEGER DEFAULT 0,
-                owner TEXT DEFAULT '',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(item_name, storage_id)
-            )
-        ''')
-        # Таблица событий
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS events (
-                id TEXT PRIMARY KEY,
-                event_name TEXT NOT NULL,
-                event_date TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # Таблица администраторов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                is_main_admin INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
-    
-    # Создаем первоначальный бэкап при инициализации
-    create_backup("initial")
-    logger.info("База данных инициализирована")
-
-def get_db_connection():
-    """Получение соединения с базой данных"""
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# Инициализация базы данных при запуске
-init_database()
-
-# Функции для работы с администраторами
-def load_admins():
-    """Загрузка списка администраторов из базы данных"""
-    global admins_cache
-    if admins_cache:
-        return admins_cache
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT username, is_main_admin FROM admins')
-        admins_data = cursor.fetchall()
-        admins_cache = []
-        for row in admins_data:
-            admin_data = {
-                'username': row['username'],
-                'is_main_admin': bool(row['is_main_admin'])
-            }
-            admins_cache.append(admin_data)
-        logger.info(f"Загружено {len(admins_cache)} администраторов")
-        return admins_cache
-    except Exception as e:
-        logger.error(f"Ошибка загрузки администраторов: {e}")
-        return []
-    finally:
-        conn.close()
-
-def is_admin_by_username(username):
-    """Проверка, является ли пользователь администратором по username"""
-    if not username:
-        return False
-        
-    username = username.lstrip('@').lower()
-    
-    for admin in admins_cache:
-        if admin['username'].lower() == username:
-            return True
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT 1 FROM admins WHERE LOWER(username) = LOWER(?)', (username,))
-        result = cursor.fetchone()
-        return result is not None
-    except Exception as e:
-        logger.error(f"Ошибка проверки администратора по username: {e}")
-        return False
-    finally:
-        conn.close()
-
-def is_admin(chat_id, username=None):
-    """Проверка, является ли пользователь администратором"""
-    if username:
-        return is_admin_by_username(username)
-    return False
-
-def is_main_admin_by_username(username):
-    """Проверка, является ли пользователь главным администратором по username"""
-    if not username:
-        return False
-        
-    username = username.lstrip('@').lower()
-    
-    for admin in admins_cache:
-        if admin['username'].lower() == username and admin['is_main_admin']:
-            return True
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT 1 FROM admins WHERE LOWER(username) = LOWER(?) AND is_main_admin = 1', (username,))
-        result = cursor.fetchone()
-        return result is not None
-    except Exception as e:
-        logger.error(f"Ошибка проверки главного администратора: {e}")
-        return False
-    finally:
-        conn.close()
-
-def is_main_admin(chat_id, username=None):
-    """Проверка, является ли пользователь главным администратором"""
-    if username:
-        return is_main_admin_by_username(username)
-    return False
-
-def add_admin(username, is_main=False):
-    """Добавление нового администратора"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        username = username.lstrip('@')
-        
-        cursor.execute('SELECT 1 FROM admins WHERE username = ?', (username,))
-        if cursor.fetchone():
-            logger.warning(f"Администратор {username} уже существует")
-            return False
-            
-        cursor.execute(
-            'INSERT INTO admins (username, is_main_admin) VALUES (?, ?)',
-            (username, 1 if is_main else 0)
-        )
-        conn.commit()
-        
-        admin_data = {
-            'username': username,
-            'is_main_admin': is_main
-        }
-        admins_cache.append(admin_data)
-        
-        # Создаем бэкап после добавления админа
-        create_backup(f"add_admin_{username}")
-        
-        logger.info(f"Администратор {username} добавлен (main: {is_main})")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка добавления администратора {username}: {e}")
-        return False
-    finally:
-        conn.close()
-
-def remove_admin(username):
-    """Удаление администратора"""
-    # Главного админа нельзя удалить
-    main_admin = get_main_admin()
-    if main_admin and main_admin['username'] == username.lstrip('@'):
-        return False
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        username = username.lstrip('@')
-        cursor.execute('DELETE FROM admins WHERE username = ? AND is_main_admin = 0', (username,))
-        conn.commit()
-        
-        global admins_cache
-        admins_cache = [admin for admin in admins_cache if admin['username'] != username]
-        
-        # Создаем бэкап после удаления админа
-        create_backup(f"remove_admin_{username}")
-        
-        logger.info(f"Администратор {username} удален")
-        return cursor.rowcount > 0
-    except Exception as e:
-        logger.error(f"Ошибка удаления администратора {username}: {e}")
-        return False
-    finally:
-        conn.close()
-
-def get_main_admin():
-    """Получение главного администратора"""
-    for admin in admins_cache:
-        if admin['is_main_admin']:
-            return admin
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT username FROM admins WHERE is_main_admin = 1')
-        result = cursor.fetchone()
-        if result:
-            return {
-                'username': result['username'],
-                'is_main_admin': True
-            }
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка получения главного администратора: {e}")
-        return None
-    finally:
-        conn.close()
-
-def get_all_admins():
-    """Получение списка всех администраторов"""
-    return load_admins()
-
-# Функции для работы с предметами
-def load_items(storage):
-    storage_id = STORAGE_IDS.get(storage)
-    if storage_id in items_cache:
-        return items_cache[storage_id]
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT item_name, issued, owner FROM items WHERE storage_id = ?', (storage_id,))
-        items_data = cursor.fetchall()
-        items = []
-        for row in items_data:
-            items.append({
-                'id': row['item_name'],
-                'item_name': row['item_name'],
-                'issued': row['issued'],
-                'owner': row['owner']
-            })
-        items_cache[storage_id] = items
-        return items
-    except Exception as e:
-        logger.error(f"Ошибка загрузки предметов из БД для {storage}: {e}")
-        return []
-    finally:
-        conn.close()
-
-def get_inventory(storage):
-    try:
-        items = load_items(storage)
-        return [(item['id'], item['item_name'], item['issued'], item['owner']) for item in items]
-    except Exception as e:
-        logger.error(f"Ошибка получения инвентаря для {storage}: {e}")
-        return []
-
-def add_item(item_name, storage):
-    item_name = re.sub(r'[|\\]', '', item_name.strip())[:50]
-    if not item_name:
-        return None
-        
-    storage_id = STORAGE_IDS.get(storage)
-    if not storage_id:
-        return None
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        normalized_new = normalize_text(item_name)
-        cursor.execute('SELECT item_name FROM items WHERE storage_id = ?', (storage_id,))
-        existing_items = cursor.fetchall()
-        for existing_item in existing_items:
-            if normalize_text(existing_item['item_name']) == normalized_new:
-                return None
-                
-        cursor.execute(
-            'INSERT INTO items (item_name, storage_id, issued, owner) VALUES (?, ?, 0, "")',
-            (item_name, storage_id)
-        )
-        conn.commit()
-        
-        if storage_id in items_cache:
-            items_cache[storage_id].append({
-                'id': item_name,
-                'item_name': item_name,
-                'issued': 0,
-                'owner': ""
-            })
-            
-        # Создаем бэкап после добавления предмета
-        create_backup(f"add_item_{storage_id}")
-            
-        return item_name
-    except Exception as e:
-        logger.error(f"Ошибка добавления предмета {item_name} в {storage}: {e}")
-        return None
-    finally:
-        conn.close()
-
-def delete_items(item_names, storage):
-    storage_id = STORAGE_IDS.get(storage)
-    if not storage_id:
-        return []
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        deleted_names = []
-        for item_name in item_names:
-            cursor.execute('DELETE FROM items WHERE item_name = ? AND storage_id = ?', (item_name, storage_id))
-            if cursor.rowcount > 0:
-                deleted_names.append(item_name)
-        conn.commit()
-        
-        if storage_id in items_cache:
-            items_cache[storage_id] = [item for item in items_cache[storage_id] if item['item_name'] not in item_names]
-            
-        # Создаем бэкап после удаления предметов
-        if deleted_names:
-            create_backup(f"delete_items_{storage_id}")
-            
-        return deleted_names
-    except Exception as e:
-        logger.error(f"Ошибка удаления предметов из {storage}: {e}")
-        return []
-    finally:
-        conn.close()
-
-def update_items_owner(item_names, owner, storage):
-    storage_id = STORAGE_IDS.get(storage)
-    if not storage_id:
-        return []
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        updated_names = []
-        for item_name in item_names:
-            cursor.execute(
-                'UPDATE items SET issued = 1, owner = ? WHERE item_name = ? AND storage_id = ?',
-                (owner, item_name, storage_id)
-            )
-            if cursor.rowcount > 0:
-                updated_names.append(item_name)
-        conn.commit()
-        
-        if storage_id in items_cache:
-            for item in items_cache[storage_id]:
-                if item['item_name'] in item_names:
-                    item['issued'] = 1
-                    item['owner'] = owner
-                    
-        # Создаем бэкап после выдачи предметов
-        if updated_names:
-            create_backup(f"issue_items_{storage_id}")
-                    
-        return updated_names
-    except Exception as e:
-        logger.error(f"Ошибка обновления статуса предметов в {storage}: {e}")
-        return []
-    finally:
-        conn.close()
-
-def return_items(item_names, storage):
-    storage_id = STORAGE_IDS.get(storage)
-    if not storage_id:
-        return []
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        returned_names = []
-        for item_name in item_names:
-            cursor.execute(
-                'UPDATE items SET issued = 0, owner = "" WHERE item_name = ? AND storage_id = ? AND issued = 1',
-                (item_name, storage_id)
-            )
-            if cursor.rowcount > 0:
-                returned_names.append(item_name)
-        conn.commit()
-        
-        if storage_id in items_cache:
-            for item in items_cache[storage_id]:
-                if item['item_name'] in item_names:
-                    item['issued'] = 0
-                    item['owner'] = ""
-                    
-        # Создаем бэкап после возврата предметов
-        if returned_names:
-            create_backup(f"return_items_{storage_id}")
-                    
-        return returned_names
-    except Exception as e:
-        logger.error(f"Ошибка возврата предметов в {storage}: {e}")
-        return []
-    finally:
-        conn.close()
-
-# Функции для работы с событиями
-def load_events():
-    if events_cache:
-        return events_cache
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT id, event_name, event_date FROM events')
-        events_data = cursor.fetchall()
-        events = []
-        for row in events_data:
-            events.append({
-                'id': row['id'],
-                'event_name': row['event_name'],
-                'event_date': row['event_date']
-            })
-        events_cache[:] = events
-        return events
-    except Exception as e:
-        logger.error(f"Ошибка загрузки событий: {e}")
-        return []
-    finally:
-        conn.close()
-
-def add_event(event_name, event_date):
-    event_id = str(uuid4())
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'INSERT INTO events (id, event_name, event_date) VALUES (?, ?, ?)',
-            (event_id, event_name, event_date)
-        )
-        conn.commit()
-        
-        events_cache.append({
-            'id': event_id,
-            'event_name': event_name,
-            'event_date': event_date
-        })
-        
-        # Создаем бэкап после добавления события
-        create_backup("add_event")
-        
-        return event_id
-    except Exception as e:
-        logger.error(f"Ошибка добавления события {event_name}: {e}")
-        return None
-    finally:
-        conn.close()
-
-def get_events(period=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if period == 'week':
-            end_date = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
-            cursor.execute(
-                'SELECT id, event_name, event_date FROM events WHERE event_date BETWEEN date("now") AND ? ORDER BY event_date',
-                (end_date,)
-            )
-        elif period == 'month':
-            end_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            cursor.execute(
-                'SELECT id, event_name, event_date FROM events WHERE event_date BETWEEN date("now") AND ? ORDER BY event_date',
-                (end_date,)
-            )
-        else:
-            cursor.execute('SELECT id, event_name, event_date FROM events ORDER BY event_date')
-        events_data = cursor.fetchall()
-        events = [(row['id'], row['event_name'], row['event_date']) for row in events_data]
-        return events
-    except Exception as e:
-        logger.error(f"Ошибка получения событий: {e}")
-        return []
-    finally:
-        conn.close()
-
-def delete_event(event_ids):
-    if not event_ids:
-        return []
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        placeholders = ','.join(['?'] * len(event_ids))
-        cursor.execute(f'SELECT id, event_name, event_date FROM events WHERE id IN ({placeholders})', event_ids)
-        events_to_delete = cursor.fetchall()
-        
-        cursor.execute(f'DELETE FROM events WHERE id IN ({placeholders})', event_ids)
-        conn.commit()
-        
-        events_cache[:] = [ev for ev in events_cache if ev['id'] not in event_ids]
-        
-        # Создаем бэкап после удаления событий
-        create_backup("delete_events")
-        
-        deleted_events = []
-        for event in events_to_delete:
-            event_name = event['event_name']
-            event_date = event['event_date']
-            try:
-                date_obj = datetime.strptime(event_date, '%Y-%m-%d')
-                formatted_date = date_obj.strftime('%d %B %Y').replace(
-                    date_obj.strftime('%B'),
-                    MONTHS_RU[date_obj.month]
-                )
-                deleted_events.append(f"{event_name} ({formatted_date})")
-            except ValueError:
-                deleted_events.append(f"{event_name} ({event_date})")
-                
-        return deleted_events
-    except Exception as e:
-        logger.error(f"Ошибка удаления событий: {e}, event_ids: {event_ids}")
-        return []
-    finally:
-        conn.close()
-
-# UI / клавиатуры
-def create_main_menu_keyboard(chat_id, username=None):
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    buttons = [
-        types.KeyboardButton('📦 Кладовая'),
-        types.KeyboardButton('📅 События')
-    ]
-    # Добавляем кнопку управления админами только для главного админа
-    if username and is_main_admin_by_username(username):
-        buttons.append(types.KeyboardButton('👑 Админы'))
-    keyboard.add(*buttons)
-    return keyboard
-
-def create_storage_selection_keyboard(chat_id):
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    buttons = [
-        types.KeyboardButton('📍 Гринбокс 11'),
-        types.KeyboardButton('📍 Гринбокс 12'),
-        types.KeyboardButton('🔙 В главное меню')
-    ]
-    keyboard.add(*buttons)
-    return keyboard
-
-def create_storage_keyboard(chat_id, username=None):
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    buttons = []
-    if username and is_admin_by_username(username):
-        buttons.extend([
-            types.KeyboardButton('➕ Добавить предмет'),
-            types.KeyboardButton('➖ Удалить предмет'),
-            types.KeyboardButton('🎁 Выдать предмет'),
-            types.KeyboardButton('↩️ Вернуть предмет')
-        ])
-    buttons.append(types.KeyboardButton('🔙 Назад'))
-    keyboard.add(*buttons)
-    return keyboard
-
-def create_events_keyboard(chat_id, username=None):
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    buttons = []
-    if username and is_admin_by_username(username):
-        buttons.extend([
-            types.KeyboardButton('➕ Добавить событие'),
-            types.KeyboardButton('🗑️ Удалить событие')
-        ])
-    buttons.append(types.KeyboardButton('🔙 В главное меню'))
-    keyboard.add(*buttons)
-    return keyboard
-
-def create_admins_keyboard(chat_id):
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    buttons = [
-        types.KeyboardButton('➕ Добавить админа'),
-        types.KeyboardButton('➖ Удалить админа'),
-        types.KeyboardButton('📋 Список админов'),
-        types.KeyboardButton('🔙 В главное меню')
-    ]
-    keyboard.add(*buttons)
-    return keyboard
-
-def create_cancel_keyboard():
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
-    keyboard.add(types.KeyboardButton('❌ Отмена'))
-    return keyboard
-
-# Функции отображения
-def show_main_menu(chat_id, username=None):
-    admin_status = "👑 Режим админа активирован\n\n" if username and is_admin_by_username(username) else ""
-    text = f"{admin_status}📋 Главное меню\n\nВыберите раздел:"
-    bot.send_message(chat_id, text, reply_markup=create_main_menu_keyboard(chat_id, username))
-    user_states[chat_id] = 'main_menu'
-    user_selections.pop(chat_id, None)
-    user_item_lists.pop(chat_id, None)
-
-def show_storage_selection(chat_id):
-    text = "📦 Выберите кладовую:"
-    bot.send_message(chat_id, text, reply_markup=create_storage_selection_keyboard(chat_id))
-    user_states[chat_id] = 'storage_selection'
-    user_selections.pop(chat_id, None)
-    user_item_lists.pop(chat_id, None)
-
-def show_storage_menu(chat_id, storage, username=None, message_text=None):
-    if message_text:
-        bot.send_message(chat_id, message_text, reply_markup=create_storage_keyboard(chat_id, username))
-    else:
-        admin_status = " 👑" if username and is_admin_by_username(username) else ""
-        bot.send_message(chat_id, f"📦 Кладовая: {storage}{admin_status}\n\nВыберите действие:", reply_markup=create_storage_keyboard(chat_id, username))
-    user_states[chat_id] = ('storage', storage)
-    user_selections.pop(chat_id, None)
-    user_item_lists.pop(chat_id, None)
-
-def show_inventory(chat_id, storage, username=None):
-    if storage not in STORAGE_IDS:
-        bot.send_message(chat_id, "❌ Не удалось выбрать кладовую, попробуйте снова")
-        show_storage_selection(chat_id)
-        return
-        
-    inventory = get_inventory(storage)
-    text = f"📦 ИНВЕНТАРЬ ({storage}):\n\n"
-    if not inventory:
-        text += "📭 Пусто\n"
-    else:
-        available_count = 0
-        given_count = 0
-        for _, item_name, issued, owner in sorted(inventory, key=lambda x: x[1]):
-            if issued == 0:
-                text += f"✅ {item_name}\n"
-                available_count += 1
-            else:
-                text += f"🔸 {item_name} - выдано ({owner})\n"
-                given_count += 1
-        text += f"\n📊 Статистика: {available_count} доступно, {given_count} выдано"
-        
-    bot.send_message(chat_id, text, reply_markup=create_storage_keyboard(chat_id, username))
-    user_states[chat_id] = ('storage', storage)
-    user_selections.pop(chat_id, None)
-    user_item_lists.pop(chat_id, None)
-
-def show_events_menu(chat_id, username=None, message_text=None):
-    if message_text:
-        bot.send_message(chat_id, message_text, reply_markup=create_events_keyboard(chat_id, username))
-    else:
-        admin_status = " 👑" if username and is_admin_by_username(username) else ""
-        text = f"📅 Управление событиями{admin_status}\n\nВыберите действие:"
-        bot.send_message(chat_id, text, reply_markup=create_events_keyboard(chat_id, username))
-    user_states[chat_id] = 'events_menu'
-    user_selections.pop(chat_id, None)
-    user_item_lists.pop(chat_id, None)
-
-def show_events_list(chat_id, username=None):
-    events = get_events()
-    if not events:
-        bot.send_message(chat_id, "📅 Нет запланированных событий")
-        show_events_menu(chat_id, username)
-        return
-        
-    text = "📅 Все события:\n\n"
-    for _, event_name, event_date in sorted(events, key=lambda x: x[2]):
-        try:
-            date_obj = datetime.strptime(event_date, '%Y-%m-%d')
-            formatted_date = date_obj.strftime('%d %B %Y').replace(date_obj.strftime('%B'), MONTHS_RU[date_obj.month])
-            text += f"• {formatted_date} — {event_name}\n"
-        except ValueError:
-            text += f"• {event_date} — {event_name}\n"
-            
-    bot.send_message(chat_id, text, reply_markup=create_events_keyboard(chat_id, username))
-    user_states[chat_id] = 'events_menu'
-
-def show_admins_menu(chat_id, username=None, message_text=None):
-    """Показать меню управления администраторами"""
-    if not username or not is_main_admin_by_username(username):
-        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может управлять админами.")
-        show_main_menu(chat_id, username)
-        return
-        
-    if message_text:
-        bot.send_message(chat_id, message_text, reply_markup=create_admins_keyboard(chat_id))
-    else:
-        text = "👑 Управление администраторами\n\nВыберите действие:"
-        bot.send_message(chat_id, text, reply_markup=create_admins_keyboard(chat_id))
-    user_states[chat_id] = 'admins_menu'
-    user_selections.pop(chat_id, None)
-    user_item_lists.pop(chat_id, None)
-
-def show_admins_list(chat_id, username=None):
-    """Показать список администраторов"""
-    admins = get_all_admins()
-    if not admins:
-        bot.send_message(chat_id, "📭 Нет добавленных администраторов")
-        show_admins_menu(chat_id, username)
-        return
-        
-    text = "👑 Список администраторов:\n\n"
-    for i, admin in enumerate(admins, 1):
-        status = " (главный)" if admin['is_main_admin'] else ""
-        text += f"{i}. @{admin['username']}{status}\n"
-        
-    bot.send_message(chat_id, text, reply_markup=create_admins_keyboard(chat_id))
-
-# Обработчики сообщений
-@bot.message_handler(commands=['start'])
-def start(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    
-    welcome_text = "👋 Добро пожаловать в систему управления инвентарем и событиями!\n\n"
-    welcome_text += "📋 Доступные разделы:\n"
-    welcome_text += "• 📦 Кладовая - управление инвентарем\n"
-    welcome_text += "• 📅 События - управление мероприятиями\n\n"
-    
-    if username and is_admin_by_username(username):
-        welcome_text += "👑 Режим админа активирован\n"
-        if is_main_admin_by_username(username):
-            welcome_text += "• 👑 Админы - управление администраторами\n\n"
-    else:
-        welcome_text += "💡 Для доступа к функциям управления обратитесь к администратору"
-    welcome_text += "\nВыберите нужный раздел в меню ниже 👇"
-    
-    bot.send_message(chat_id, welcome_text, reply_markup=create_main_menu_keyboard(chat_id, username))
-    user_states[chat_id] = 'main_menu'
-    user_selections.pop(chat_id, None)
-    user_item_lists.pop(chat_id, None)
-
-# Обработчик секретного слова для главного админа
-@bot.message_handler(func=lambda message: normalize_text(message.text) == normalize_text(SECRET_WORD))
-def handle_secret_word(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    
-    # Проверяем, есть ли уже главный админ
-    main_admin = get_main_admin()
-    
-    if main_admin:
-        if username and main_admin['username'].lower() == username.lower():
-            bot.send_message(chat_id, "👑 Вы уже являетесь главным администратором.")
-        else:
-            bot.send_message(chat_id, "❌ Главный администратор уже назначен. Обратитесь к нему для получения прав.")
-        return
-    
-    # Если главного админа нет, создаем его
-    if not username:
-        bot.send_message(chat_id, "❌ У вас не установлен username в Telegram. Пожалуйста, установите username в настройках Telegram и попробуйте снова.")
-        return
-        
-    if add_admin(username, is_main=True):
-        bot.send_message(chat_id, "👑 Вы стали главным администратором! Теперь вам доступны все функции управления, включая управление администраторами.")
-        show_main_menu(chat_id, username)
-    else:
-        bot.send_message(chat_id, "❌ Ошибка при назначении главного администратора.")
-
-# Основные обработчики кнопок
-@bot.message_handler(func=lambda message: message.text == '🔙 В главное меню')
-def back_to_main_menu(message):
-    username = message.from_user.username
-    show_main_menu(message.chat.id, username)
-
-@bot.message_handler(func=lambda message: message.text == '📦 Кладовая')
-def handle_storage(message):
-    show_storage_selection(message.chat.id)
-
-@bot.message_handler(func=lambda message: message.text == '📅 События')
-def handle_events(message):
-    username = message.from_user.username
-    show_events_list(message.chat.id, username)
-
-@bot.message_handler(func=lambda message: message.text == '👑 Админы')
-def handle_admins(message):
-    username = message.from_user.username
-    show_admins_menu(message.chat.id, username)
-
-@bot.message_handler(func=lambda message: message.text == '🔙 Назад')
-def back_to_storage_selection(message):
-    show_storage_selection(message.chat.id)
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'storage_selection')
-def handle_storage_selection(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    storage = message.text.replace('📍 ', '').strip()
-    
-    if storage in STORAGE_IDS:
-        show_inventory(chat_id, storage, username)
-    elif message.text == '🔙 В главное меню':
-        show_main_menu(chat_id, username)
-    else:
-        bot.send_message(chat_id, "❌ Не удалось выбрать кладовую, используйте кнопки меню")
-        show_storage_selection(chat_id)
-
-@bot.message_handler(func=lambda message: isinstance(user_states.get(message.chat.id), tuple) and user_states.get(message.chat.id)[0] == 'storage')
-def handle_storage_actions(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    state_data = user_states[chat_id]
-    if len(state_data) >= 2:
-        storage = state_data[1]
-    else:
-        bot.send_message(chat_id, "❌ Ошибка состояния, выберите кладовую снова")
-        show_storage_selection(chat_id)
-        return
-        
-    if message.text == '➕ Добавить предмет':
-        if not username or not is_admin_by_username(username):
-            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут добавлять предметы.")
-            return
-        bot.send_message(chat_id, "📝 Введите названия предметов для добавления (каждый предмет с новой строки) или нажмите '❌ Отмена':", reply_markup=create_cancel_keyboard())
-        user_states[chat_id] = ('adding_item', storage)
-    elif message.text == '➖ Удалить предмет':
-        if not username or not is_admin_by_username(username):
-            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут удалять предметы.")
-            return
-        bot.send_message(chat_id, "🗑️ Введите названия предметов для удаления (каждый предмет с новой строки) или нажмите '❌ Отмена':", reply_markup=create_cancel_keyboard())
-        user_states[chat_id] = ('deleting_item', storage)
-    elif message.text == '🎁 Выдать предмет':
-        if not username or not is_admin_by_username(username):
-            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут выдавать предметы.")
-            return
-        bot.send_message(chat_id, "🎁 Введите названия предметов для выдачи (каждый предмет с новой строки) или нажмите '❌ Отмена':", reply_markup=create_cancel_keyboard())
-        user_states[chat_id] = ('issuing_item', storage)
-    elif message.text == '↩️ Вернуть предмет':
-        if not username or not is_admin_by_username(username):
-            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут возвращать предметы.")
-            return
-        bot.send_message(chat_id, "↩️ Введите названия предметов для возврата (каждый предмет с новой строки) или нажмите '❌ Отмена':", reply_markup=create_cancel_keyboard())
-        user_states[chat_id] = ('returning_item', storage)
-    elif message.text == '🔙 Назад':
-        show_storage_selection(chat_id)
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'events_menu')
-def handle_events_actions(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    if message.text == '➕ Добавить событие':
-        if not username or not is_admin_by_username(username):
-            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут добавлять события.")
-            return
-        bot.send_message(chat_id, "📝 Введите название события или '❌ Отмена':", reply_markup=create_cancel_keyboard())
-        user_states[chat_id] = 'adding_event_name'
-    elif message.text == '🗑️ Удалить событие':
-        if not username or not is_admin_by_username(username):
-            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут удалять события.")
-            return
-        show_events_list_for_deletion(chat_id, username)
-    elif message.text == '🔙 В главное меню':
-        show_main_menu(chat_id, username)
-
-def show_events_list_for_deletion(chat_id, username=None):
-    events = get_events()
-    if not events:
-        bot.send_message(chat_id, "📅 Нет событий для удаления")
-        show_events_menu(chat_id, username)
-        return
-        
-    text = "🗑️ Выберите события для удаления:\n\n"
-    event_dict = {}
-    for i, (event_id, event_name, event_date) in enumerate(events, 1):
-        try:
-            date_obj = datetime.strptime(event_date, '%Y-%m-%d')
-            formatted_date = date_obj.strftime('%d %B %Y').replace(date_obj.strftime('%B'), MONTHS_RU[date_obj.month])
-            text += f"{i}. {formatted_date} — {event_name}\n"
-            event_dict[str(i)] = event_id
-        except ValueError:
-            text += f"{i}. {event_date} — {event_name}\n"
-            event_dict[str(i)] = event_id
-            
-    text += "\nВведите номера событий для удаления через запятую (например: 1,3,5) или '❌ Отмена':"
-    
-    user_selections[chat_id] = event_dict
-    user_states[chat_id] = 'deleting_event'
-    bot.send_message(chat_id, text, reply_markup=create_cancel_keyboard())
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'admins_menu')
-def handle_admins_actions(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    if not username or not is_main_admin_by_username(username):
-        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может управлять админами.")
-        show_main_menu(chat_id, username)
-        return
-        
-    if message.text == '➕ Добавить админа':
-        bot.send_message(chat_id, "👤 Введите username нового администратора (например, @username или просто username):", reply_markup=create_cancel_keyboard())
-        user_states[chat_id] = 'adding_admin'
-    elif message.text == '➖ Удалить админа':
-        admins = get_all_admins()
-        if not admins:
-            bot.send_message(chat_id, "📭 Нет администраторов для удаления")
-            return
-            
-        text = "🗑️ Список администраторов для удаления:\n\n"
-        for i, admin in enumerate(admins, 1):
-            status = " (главный)" if admin['is_main_admin'] else ""
-            text += f"{i}. @{admin['username']}{status}\n"
-        text += "\nВведите username администратора для удаления (например, @username или просто username):"
-        bot.send_message(chat_id, text, reply_markup=create_cancel_keyboard())
-        user_states[chat_id] = 'removing_admin'
-    elif message.text == '📋 Список админов':
-        show_admins_list(chat_id, username)
-    elif message.text == '🔙 В главное меню':
-        show_main_menu(chat_id, username)
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'adding_admin')
-def handle_adding_admin(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    if not username or not is_main_admin_by_username(username):
-        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может добавлять админов.")
-        show_main_menu(chat_id, username)
-        return
-        
-    if message.text == '❌ Отмена':
-        bot.send_message(chat_id, "❌ Добавление администратора отменено")
-        show_admins_menu(chat_id, username)
-        return
-        
-    new_username = message.text.strip()
-    if not new_username:
-        bot.send_message(chat_id, "❌ Username не может быть пустым. Попробуйте еще раз:")
-        return
-        
-    if add_admin(new_username):
-        bot.send_message(chat_id, f"✅ Администратор @{new_username.lstrip('@')} добавлен. Теперь он имеет права администратора.")
-    else:
-        bot.send_message(chat_id, f"❌ Ошибка при добавлении администратора @{new_username.lstrip('@')}. Возможно, такой администратор уже существует.")
-    show_admins_menu(chat_id, username)
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'removing_admin')
-def handle_removing_admin(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    if not username or not is_main_admin_by_username(username):
-        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может удалять админов.")
-        show_main_menu(chat_id, username)
-        return
-        
-    if message.text == '❌ Отмена':
-        bot.send_message(chat_id, "❌ Удаление администратора отменено")
-        show_admins_menu(chat_id, username)
-        return
-        
-    remove_username = message.text.strip()
-    if not remove_username:
-        bot.send_message(chat_id, "❌ Username не может быть пустым. Попробуйте еще раз:")
-        return
-        
-    if remove_admin(remove_username):
-        bot.send_message(chat_id, f"✅ Администратор @{remove_username.lstrip('@')} удален")
-    else:
-        bot.send_message(chat_id, f"❌ Ошибка при удалении администратора @{remove_username.lstrip('@')} или администратор не найден (главного админа нельзя удалить)")
-    show_admins_menu(chat_id, username)
-
-# Обработчики состояний
-@bot.message_handler(func=lambda message: isinstance(user_states.get(message.chat.id), tuple) and user_states.get(message.chat.id)[0] == 'adding_item')
-def handle_adding_item(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    state_data = user_states[chat_id]
-    storage = state_data[1]
-    
-    if message.text == '❌ Отмена':
-        bot.send_message(chat_id, "❌ Добавление предметов отменено")
-        show_storage_menu(chat_id, storage, username)
-        return
-        
-    item_names = [name.strip() for name in message.text.split('\n') if name.strip()]
-    added_items = []
-    
-    for item_name in item_names:
-        result = add_item(item_name, storage)
-        if result:
-            added_items.append(result)
-            
-    if added_items:
-        text = f"✅ Добавлено предметов: {len(added_items)}\n\n"
-        text += "\n".join(f"• {item}" for item in added_items)
-    else:
-        text = "❌ Не удалось добавить предметы (возможно, они уже существуют)"
-        
-    show_storage_menu(chat_id, storage, username, text)
-
-@bot.message_handler(func=lambda message: isinstance(user_states.get(message.chat.id), tuple) and user_states.get(message.chat.id)[0] == 'deleting_item')
-def handle_deleting_item(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    state_data = user_states[chat_id]
-    storage = state_data[1]
-    
-    if message.text == '❌ Отмена':
-        bot.send_message(chat_id, "❌ Удаление предметов отменено")
-        show_storage_menu(chat_id, storage, username)
-        return
-        
-    item_names = [name.strip() for name in message.text.split('\n') if name.strip()]
-    deleted_items = delete_items(item_names, storage)
-    
-    if deleted_items:
-        text = f"✅ Удалено предметов: {len(deleted_items)}\n\n"
-        text += "\n".join(f"• {item}" for item in deleted_items)
-    else:
-        text = "❌ Не удалось удалить предметы (возможно, они не найдены)"
-        
-    show_storage_menu(chat_id, storage, username, text)
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'adding_event_name')
-def handle_adding_event_name(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    
-    if message.text == '❌ Отмена':
-        bot.send_message(chat_id, "❌ Добавление события отменено")
-        show_events_menu(chat_id, username)
-        return
-        
-    user_selections[chat_id] = {'event_name': message.text}
-    bot.send_message(chat_id, "📅 Введите дату события в формате ДД.ММ.ГГГГ (например, 25.12.2024) или '❌ Отмена':", reply_markup=create_cancel_keyboard())
-    user_states[chat_id] = 'adding_event_date'
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'adding_event_date')
-def handle_adding_event_date(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    
-    if message.text == '❌ Отмена':
-        bot.send_message(chat_id, "❌ Добавление события отменено")
-        show_events_menu(chat_id, username)
-        return
-        
-    try:
-        date_obj = datetime.strptime(message.text, '%d.%m.%Y')
-        event_date = date_obj.strftime('%Y-%m-%d')
-        event_name = user_selections[chat_id]['event_name']
-        
-        if add_event(event_name, event_date):
-            formatted_date = date_obj.strftime('%d %B %Y').replace(date_obj.strftime('%B'), MONTHS_RU[date_obj.month])
-            bot.send_message(chat_id, f"✅ Событие '{event_name}' на {formatted_date} добавлено")
-        else:
-            bot.send_message(chat_id, "❌ Ошибка при добавлении события")
-            
-    except ValueError:
-        bot.send_message(chat_id, "❌ Неверный формат даты. Используйте формат ДД.ММ.ГГГГ (например, 25.12.2024)")
-        return
-        
-    show_events_menu(chat_id, username)
-
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'deleting_event')
-def handle_deleting_event(message):
-    chat_id = message.chat.id
-    username = message.from_user.username
-    
-    if message.text == '❌ Отмена':
-        bot.send_message(chat_id, "❌ Удаление событий отменено")
-        show_events_menu(chat_id, username)
-        return
-        
-    event_dict = user_selections.get(chat_id, {})
-    numbers = [num.strip() for num in message.text.split(',')]
-    event_ids_to_delete = []
-    
-    for num in numbers:
-        if num in event_dict:
-            event_ids_to_delete.append(event_dict[num])
-            
-    if event_ids_to_delete:
-        deleted_events = delete_event(event_ids_to_delete)
-        if deleted_events:
-            text = f"✅ Удалено событий: {len(deleted_events)}\n\n"
-            text += "\n".join(f"• {event}" for event in deleted_events)
-        else:
-            text = "❌ Не удалось удалить события"
-    else:
-        text = "❌ Неверно указаны номера событий"
-        
-    show_events_menu(chat_id, username, text)
-
-user_states = {}
-user_selections = {}
-user_item_lists = {}
-
-load_admins()
-
-def keep_alive():
-    url = f"https://{os.environ.get('RENDER_EXTERNAL_HOSTNAME')}"
-    if not url or not url.startswith('https://'):
-        return
-
-    while True:
-        try:
-            response = requests.get(url, timeout=10)
-            logger.info(f"Keep-alive ping: {url} | Status: {response.status_code}")
-        except Exception as e:
-            logger.error(f"Keep-alive error: {e}")
-        time.sleep(300)  # Каждые 5 минут
-
-if os.environ.get('RENDER'):
-    threading.Thread(target=keep_alive, daemon=True).start()
-    logger.info("Keep-alive пинг запущен (каждые 5 минут)")
-
-from flask import Flask, request
-app = Flask(__name__)
-
-@app.route('/')
-def index():
-    return "Бот управления инвентарем работает!", 200
-
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    if request.headers.get('content-type') == 'application/json':
-        json_string = request.get_data().decode('utf-8')
-        update = telebot.types.Update.de_json(json_string)
-        bot.process_new_updates([update])
-        return ''
-    else:
-        return 'Invalid content type', 403
-
-if __name__ == '__main__':
-    if os.environ.get('RENDER'):
-        webhook_url = f"https://{os.environ.get('RENDER_EXTERNAL_HOSTNAME')}/webhook"
-        bot.remove_webhook()
-        time.sleep(1)
-        bot.set_webhook(url=webhook_url)
-        print(f"Webhook установлен: {webhook_url}")
-        
-        app.run(host='0.0.0.0', port=10000)
-    else:
-        print("Бот запущен в режиме polling...")
-        bot.remove_webhook()
-        bot.polling(none_stop=True)
-
+import telebot
+from telebot import types
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
+import threading
+import asyncio
+import signal
+import os
+import json
+import time
+import requests
+import re
+import itertools
+import random
+import heapq
+import bisect
+import calendar
+import logging
+from datetime import datetime, date, timedelta
+from contextlib import contextmanager
+from uuid import uuid4
+import sqlite3
+import hashlib
+import hmac
+import gzip
+import lzma
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler('bot.log', encoding='utf-8')
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Загрузка токена из переменных окружения
+TOKEN = os.environ.get('BOT_TOKEN')
+if not TOKEN:
+    logger.error("BOT_TOKEN не установлен.")
+    raise ValueError("BOT_TOKEN is not set")
+
+class InventoryBot(telebot.TeleBot):
+    """TeleBot с записью обновлений, полученных длинным опросом (см. UpdateRecorder)"""
+
+    def get_updates(self, *args, **kwargs):
+        updates = super().get_updates(*args, **kwargs)
+        # Запрос подтверждения при остановке не записываем - эти обновления получит следующий экземпляр
+        if update_recorder and not lifecycle.draining:
+            for update in updates:
+                update_recorder.record(update_to_dict(update))
+        return updates
+
+bot = InventoryBot(TOKEN, use_class_middlewares=True)
+
+# Адрес Bot API можно подменить, например локальным fake_bot_api.py для нагрузочного тестирования
+# (формат telebot: http://127.0.0.1:8081/bot{0}/{1})
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
+
+DB_FILE = 'inventory_bot.db'
+BACKUP_DIR = 'backups'
+BACKUP_COMPRESSION = os.environ.get('BACKUP_COMPRESSION', 'gz')
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_OPENERS = {
+    'gz': gzip.open,
+    'xz': lzma.open
+}
+BACKUP_SUFFIXES = ('.db',) + tuple(f'.db.{ext}' for ext in BACKUP_OPENERS)
+# Полный снимок не чаще раза в час или раз в 200 изменений, остальное восстанавливается из журнала
+BACKUP_MIN_INTERVAL = 3600
+BACKUP_EVERY_RECORDS = 200
+BACKUP_VERIFY_INTERVAL = 600
+
+# Журнал изменений для восстановления на момент времени
+JOURNAL_DIR = 'journal'
+JOURNAL_FLUSH_INTERVAL = 0.5
+JOURNAL_SEGMENT_BYTES = 4 * 1024 * 1024
+
+# Несколько команд в одном процессе: чаты сопоставляются тенантам с отдельными базами
+TENANTS_FILE = os.environ.get('TENANTS_FILE', 'tenants.json')
+TENANTS_DIR = 'tenants'
+DEFAULT_TENANT = 'default'
+TENANT_POOL_SIZE = 4
+# Общий бюджет кэшей всех тенантов (записей в памяти); выгружаются давно не использованные
+TENANT_CACHE_BUDGET = int(os.environ.get('TENANT_CACHE_BUDGET', 200000))
+TENANT_IDLE_SECONDS = 300
+TENANT_BUDGET_CHECK_INTERVAL = 10
+
+# Кэш готовых клавиатур (общий для тенантов, ключ включает набор кладовых)
+keyboard_cache = {}
+
+# Блокировка для thread-safe доступа
+db_lock = threading.Lock()
+
+# Словарь для месяцев
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12
+}
+MONTHS_RU = {
+    1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля', 5: 'мая', 6: 'июня',
+    7: 'июля', 8: 'августа', 9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
+}
+
+# Сопоставление хранилищ (по умолчанию, тенант может задать свои)
+STORAGE_IDS = {
+    'Гринбокс 11': 'gb11',
+    'Гринбокс 12': 'gb12'
+}
+
+# Режим админа (по умолчанию, тенант может задать свое)
+SECRET_WORD = "админ123"
+
+# Срок выдачи по умолчанию и время ежедневного отчета о просрочках
+LOAN_DAYS = 14
+OVERDUE_REPORT_HOUR = 10
+
+# Ограничение входящих сообщений (длинные списки предметов, пакеты команд): работа растет с числом строк,
+# длину текста уже ограничивает Telegram (4096 символов)
+INBOUND_MAX_LINES = 100
+
+# Выбор предметов инлайн-кнопками: код действия -> состояние пользователя
+PICKER_ACTIONS = {
+    'i': 'issuing_item',
+    'r': 'returning_item',
+    'd': 'deleting_item'
+}
+PICKER_STATES = {v: k for k, v in PICKER_ACTIONS.items()}
+PICKER_PAGE_SIZE = 8
+ID_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# Функции резервного копирования
+backup_executor = None
+# Процесс бэкапов запускается через spawn (fork из процесса с потоками бота может зависнуть) и заново
+# импортирует этот модуль ради write_backup_snapshot: в нем не открываются тенанты и не запускаются фоновые потоки
+BACKUP_PROCESS = __name__ == '__mp_main__' or multiprocessing.parent_process() is not None
+
+def get_backup_executor():
+    """Отдельный процесс для создания бэкапов (создается при первом бэкапе и после аварийного завершения).
+
+    Процесс выходит в свою группу: сигнал остановки группе процессов бота (Ctrl+C, timeout) его не завершает,
+    его останавливает бот после финального бэкапа.
+    """
+    global backup_executor
+    if backup_executor is None:
+        backup_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=os.setpgrp)
+    return backup_executor
+
+def write_backup_snapshot(db_file, backup_path, compression):
+    """Снимок базы данных со сжатием и проверкой контрольной суммы (выполняется в процессе бэкапов)"""
+    raw_path = backup_path + '.raw'
+    part_path = backup_path + '.part'
+    opener = BACKUP_OPENERS[compression]
+    try:
+        # Консистентный снимок через sqlite3 backup API
+        src = sqlite3.connect(db_file)
+        dst = sqlite3.connect(raw_path)
+        try:
+            src.backup(dst)
+            journal_seq = dst.execute('SELECT seq FROM journal_state WHERE id = 1').fetchone()[0]
+            quick_check = dst.execute('PRAGMA quick_check').fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+        
+        raw_hash = hashlib.sha256()
+        with open(raw_path, 'rb') as raw_file, opener(part_path, 'wb') as packed_file:
+            while True:
+                chunk = raw_file.read(BACKUP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                raw_hash.update(chunk)
+                packed_file.write(chunk)
+                
+        # Проверяем, что архив читается и совпадает со снимком
+        check_hash = hashlib.sha256()
+        with opener(part_path, 'rb') as packed_file:
+            while True:
+                chunk = packed_file.read(BACKUP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                check_hash.update(chunk)
+        if check_hash.hexdigest() != raw_hash.hexdigest():
+            raise ValueError(f"контрольная сумма не совпадает для {backup_path}")
+            
+        os.replace(part_path, backup_path)
+        return {
+            'path': backup_path,
+            'raw_size': os.path.getsize(raw_path),
+            'size': os.path.getsize(backup_path),
+            'sha256': raw_hash.hexdigest(),
+            'journal_seq': journal_seq,
+            'quick_check': quick_check
+        }
+    finally:
+        for path in (raw_path, part_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def unpack_backup(backup_path, raw_path):
+    """Распаковка бэкапа потоком с подсчетом контрольной суммы"""
+    opener = BACKUP_OPENERS.get(backup_path.rsplit('.', 1)[-1], open)
+    raw_hash = hashlib.sha256()
+    with opener(backup_path, 'rb') as packed_file, open(raw_path, 'wb') as raw_file:
+        while True:
+            chunk = packed_file.read(BACKUP_CHUNK_SIZE)
+            if not chunk:
+                break
+            raw_hash.update(chunk)
+            raw_file.write(chunk)
+    return raw_hash.hexdigest()
+
+def check_database_file(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        conn.close()
+
+def verify_backup_file(backup_path, expected_sha256):
+    """Проверка бэкапа: контрольная сумма и PRAGMA quick_check (выполняется в процессе бэкапов)"""
+    raw_path = backup_path + '.verify'
+    try:
+        sha256 = unpack_backup(backup_path, raw_path)
+        return {
+            'sha256_ok': sha256 == expected_sha256,
+            'quick_check': check_database_file(raw_path)
+        }
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+def on_backup_done(future, tenant, reason):
+    """Обработка результата фонового бэкапа"""
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.error(f"Ошибка при создании резервной копии ({tenant.name}, {reason}): {e}")
+        return
+    with use_tenant(tenant):
+        record_backup_result(result, reason)
+
+def record_backup_result(result, reason):
+    ratio = result['size'] / result['raw_size'] if result['raw_size'] else 0
+    logger.info(
+        f"Создана резервная копия: {os.path.basename(result['path'])} "
+        f"({result['raw_size']} -> {result['size']} bytes, {ratio:.0%}, sha256 {result['sha256'][:12]}) - причина: {reason}"
+    )
+    update_backup_manifest(os.path.basename(result['path']), {
+        'created_at': time.time(),
+        'reason': reason,
+        'raw_size': result['raw_size'],
+        'size': result['size'],
+        'sha256': result['sha256'],
+        'journal_seq': result['journal_seq'],
+        'quick_check': result['quick_check'],
+        'verified': result['quick_check'] == 'ok',
+        'verified_at': time.time()
+    })
+    if result['quick_check'] != 'ok':
+        logger.error(f"Бэкап {os.path.basename(result['path'])} не прошел quick_check: {result['quick_check']}")
+
+def create_backup(reason="manual", wait=False):
+    """Создание резервной копии базы данных (в фоновом процессе, wait=True - дождаться снимка)"""
+    global backup_executor
+    tenant = current_tenant()
+    try:
+        if not os.path.exists(tenant.db_file):
+            logger.warning(f"Файл базы данных {tenant.db_file} не существует для резервного копирования")
+            return None
+            
+        # Создаем имя файла с временной меткой
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_filename = f"inventory_backup_{timestamp}_{reason}.db.{BACKUP_COMPRESSION}"
+        backup_path = os.path.join(tenant.backup_dir, backup_filename)
+        
+        try:
+            future = get_backup_executor().submit(write_backup_snapshot, tenant.db_file, backup_path, BACKUP_COMPRESSION)
+        except BrokenProcessPool:
+            logger.error("Процесс бэкапов завершился аварийно, перезапускаем")
+            backup_executor = None
+            future = get_backup_executor().submit(write_backup_snapshot, tenant.db_file, backup_path, BACKUP_COMPRESSION)
+        future.add_done_callback(lambda done: on_backup_done(done, tenant, reason))
+        tenant.backup_state['at'] = time.time()
+        tenant.backup_state['seq'] = tenant.journal.seq if tenant.journal else 0
+        if wait:
+            future.result()
+        return backup_path
+            
+    except Exception as e:
+        logger.error(f"Ошибка при создании резервной копии: {e}")
+        return None
+
+def maybe_create_backup(reason):
+    """Бэкап после изменения, если с прошлого снимка прошло много времени или изменений (расписание тенанта)"""
+    tenant = current_tenant()
+    if (time.time() - tenant.backup_state['at'] >= tenant.backup_min_interval
+            or (tenant.journal and tenant.journal.seq - tenant.backup_state['seq'] >= tenant.backup_every_records)):
+        return create_backup(reason)
+    return None
+
+def load_backup_manifest():
+    """Сведения о бэкапах: контрольная сумма, размеры, позиция журнала"""
+    try:
+        with open(current_tenant().backup_manifest, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Ошибка чтения манифеста бэкапов: {e}")
+        return {}
+
+def save_backup_manifest(manifest):
+    manifest_path = current_tenant().backup_manifest
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def update_backup_manifest(filename, entry=None):
+    """Добавление (или удаление при entry=None) записи манифеста"""
+    try:
+        with current_tenant().manifest_lock:
+            manifest = load_backup_manifest()
+            if entry is None:
+                manifest.pop(filename, None)
+            else:
+                manifest[filename] = entry
+            save_backup_manifest(manifest)
+    except Exception as e:
+        logger.error(f"Ошибка обновления манифеста бэкапов: {e}")
+
+def mark_backup_verified(filename, fields):
+    """Обновление результатов проверки в записи манифеста"""
+    try:
+        with current_tenant().manifest_lock:
+            manifest = load_backup_manifest()
+            if filename in manifest:
+                manifest[filename].update(fields)
+                save_backup_manifest(manifest)
+    except Exception as e:
+        logger.error(f"Ошибка обновления манифеста бэкапов: {e}")
+
+def on_backup_verified(future, tenant, filename):
+    try:
+        result = future.result()
+    except Exception as e:
+        result = {'sha256_ok': False, 'quick_check': str(e)}
+    verified = result['sha256_ok'] and result['quick_check'] == 'ok'
+    with use_tenant(tenant):
+        mark_backup_verified(filename, {
+            'verified': verified,
+            'verified_at': time.time(),
+            'quick_check': result['quick_check']
+        })
+    if verified:
+        logger.info(f"Бэкап {filename} проверен")
+    else:
+        logger.error(f"Бэкап {filename} поврежден: sha256 {'ok' if result['sha256_ok'] else 'не совпадает'}, quick_check {result['quick_check']}")
+
+def verify_next_backup():
+    """Фоновая проверка бэкапа, который дольше всех не проверялся"""
+    tenant = current_tenant()
+    manifest = load_backup_manifest()
+    candidates = [
+        (entry.get('verified_at') or 0, filename)
+        for filename, entry in manifest.items()
+        if os.path.exists(os.path.join(tenant.backup_dir, filename))
+    ]
+    if not candidates:
+        return
+    _, filename = min(candidates)
+    future = get_backup_executor().submit(
+        verify_backup_file, os.path.join(tenant.backup_dir, filename), manifest[filename]['sha256']
+    )
+    future.add_done_callback(lambda done: on_backup_verified(done, tenant, filename))
+
+def backup_idle_changes():
+    """Бэкап изменений, после которых не было новых действий (maybe_create_backup срабатывает только при изменении)"""
+    tenant = current_tenant()
+    if (tenant.journal and tenant.journal.seq > tenant.backup_state['seq']
+            and time.time() - tenant.backup_state['at'] >= tenant.backup_min_interval):
+        create_backup("scheduled")
+
+def cleanup_old_backups(max_backups=50):
+    """Очистка старых резервных копий"""
+    tenant = current_tenant()
+    try:
+        if not os.path.exists(tenant.backup_dir):
+            return
+            
+        backups = []
+        for filename in os.listdir(tenant.backup_dir):
+            if filename.startswith("inventory_backup_") and filename.endswith(BACKUP_SUFFIXES):
+                file_path = os.path.join(tenant.backup_dir, filename)
+                if os.path.isfile(file_path):
+                    backups.append((file_path, os.path.getctime(file_path)))
+        
+        # Сортируем по дате создания (старые сначала)
+        backups.sort(key=lambda x: x[1])
+        
+        # Удаляем старые бэкапы, если превышен лимит
+        if len(backups) > max_backups:
+            for i in range(len(backups) - max_backups):
+                old_backup_path = backups[i][0]
+                try:
+                    os.remove(old_backup_path)
+                    update_backup_manifest(os.path.basename(old_backup_path))
+                    logger.info(f"Удален старый бэкап: {os.path.basename(old_backup_path)}")
+                except Exception as e:
+                    logger.error(f"Ошибка при удалении старого бэкапа {old_backup_path}: {e}")
+                    
+        # Сегменты журнала старше самого старого снимка больше не нужны
+        seqs = [entry['journal_seq'] for entry in load_backup_manifest().values() if entry.get('journal_seq') is not None]
+        if seqs and tenant.journal:
+            tenant.journal.cleanup(min(seqs))
+                    
+    except Exception as e:
+        logger.error(f"Ошибка при очистке старых бэкапов: {e}")
+
+# Нормализация текста
+def normalize_text(text):
+    return ' '.join(text.strip().split()).lower()
+
+# Функции для работы с базой данных
+def init_database():
+    """Инициализация базы данных и создание таблиц"""
+    with db_lock:
+        fresh = not os.path.exists(current_tenant().db_file)
+        conn = sqlite3.connect(current_tenant().db_file, check_same_thread=False)
+        cursor = conn.cursor()
+        # Таблица предметов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                item_name TEXT NOT NULL,
+                storage_id TEXT NOT NULL,
+                issued INTEGER DEFAULT 0,
+                owner TEXT DEFAULT '',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(item_name, storage_id)
+            )
+        ''')
+        # Таблица событий
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id TEXT PRIMARY KEY,
+                event_name TEXT NOT NULL,
+                event_date TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Таблица администраторов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS admins (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL UNIQUE,
+                is_main_admin INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Последняя запись журнала изменений, вошедшая в базу
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS journal_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                seq INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO journal_state (id, seq) VALUES (1, 0)')
+        # Дневная статистика использования по кладовым
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS item_stats_daily (
+                day TEXT NOT NULL,
+                storage_id TEXT NOT NULL,
+                added INTEGER DEFAULT 0,
+                deleted INTEGER DEFAULT 0,
+                issued INTEGER DEFAULT 0,
+                returned INTEGER DEFAULT 0,
+                PRIMARY KEY (day, storage_id)
+            )
+        ''')
+        # Повторяющиеся события: правило хранится один раз, повторения вычисляются
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS event_rules (
+                id TEXT PRIMARY KEY,
+                event_name TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                freq TEXT NOT NULL,
+                until TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Удаленные отдельные повторения
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS event_exceptions (
+                rule_id TEXT NOT NULL,
+                event_date TEXT NOT NULL,
+                PRIMARY KEY (rule_id, event_date)
+            )
+        ''')
+        # Таблица известных чатов (для рассылок)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chats (
+                chat_id INTEGER PRIMARY KEY,
+                username TEXT DEFAULT '',
+                chat_type TEXT DEFAULT '',
+                blocked INTEGER DEFAULT 0,
+                first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Таблица рассылок (курсор позволяет продолжить после перезапуска)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                created_by TEXT DEFAULT '',
+                status TEXT DEFAULT 'running',
+                last_chat_id INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                report_chat_id INTEGER,
+                report_message_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        # Изменения существующих таблиц - только через миграции
+        run_migrations(conn, backup=not fresh)
+        conn.close()
+    
+    # Создаем первоначальный бэкап при инициализации
+    create_backup("initial")
+    logger.info("База данных инициализирована")
+
+# Миграции схемы: версия базы хранится в PRAGMA user_version, шаги применяются по порядку.
+# Заполнение данных идет пачками по MIGRATION_BATCH_SIZE строк с фиксацией после каждой,
+# чтобы не держать блокировку записи; перед каждым шагом делается бэкап.
+MIGRATION_BATCH_SIZE = 500
+
+def migrate_item_due_columns(conn):
+    """Когда предмет выдан и до какого числа должен вернуться"""
+    item_columns = [row[1] for row in conn.execute('PRAGMA table_info(items)')]
+    if 'issued_at' not in item_columns:
+        conn.execute('ALTER TABLE items ADD COLUMN issued_at TEXT')
+    if 'due_at' not in item_columns:
+        conn.execute('ALTER TABLE items ADD COLUMN due_at TEXT')
+    # Частичный индекс только по выданным предметам - для поиска просрочек
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_items_issued_due ON items(due_at) WHERE issued = 1')
+
+def migrate_lookup_indexes(conn):
+    """Индексы под частые выборки: админы и чаты по имени без учета регистра, предметы по кладовой"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_admins_username_lower ON admins(LOWER(username))')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chats_username_lower ON chats(LOWER(username))')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_items_storage ON items(storage_id)')
+
+def migrate_backfill_issued_at(conn):
+    """Время выдачи для предметов, выданных до появления issued_at (берем время создания записи)"""
+    return backfill_in_batches(
+        conn,
+        'SELECT id FROM items WHERE issued = 1 AND issued_at IS NULL LIMIT ?',
+        'UPDATE items SET issued_at = created_at WHERE id = ? AND issued_at IS NULL'
+    )
+
+def backfill_in_batches(conn, select_sql, update_sql):
+    """Обновление строк пачками: select_sql выбирает id очередной пачки, update_sql обновляет одну строку"""
+    total = 0
+    while True:
+        ids = [row[0] for row in conn.execute(select_sql, (MIGRATION_BATCH_SIZE,))]
+        if not ids:
+            return total
+        conn.executemany(update_sql, [(row_id,) for row_id in ids])
+        conn.commit()
+        total += len(ids)
+        logger.info(f"Миграция: обработано строк: {total}")
+
+def migrate_reservations(conn):
+    """Брони предметов под события на период дат"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reservations (
+            id TEXT PRIMARY KEY,
+            item_id INTEGER NOT NULL,
+            storage_id TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            event_name TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            created_by TEXT DEFAULT '',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reservations_item ON reservations(item_id, start_date)')
+
+MIGRATIONS = [
+    (1, "колонки issued_at/due_at и индекс просрочек", migrate_item_due_columns),
+    (2, "индексы поиска по имени и кладовой", migrate_lookup_indexes),
+    (3, "заполнение issued_at у выданных предметов", migrate_backfill_issued_at),
+    (4, "таблица броней предметов", migrate_reservations),
+]
+
+def backup_before_migration(number):
+    """Бэкап перед шагом миграции - в текущем процессе (идет при открытии базы, возможно во время импорта модуля)"""
+    tenant = current_tenant()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_path = os.path.join(tenant.backup_dir, f"inventory_backup_{timestamp}_migration_{number}.db.{BACKUP_COMPRESSION}")
+    try:
+        record_backup_result(write_backup_snapshot(tenant.db_file, backup_path, BACKUP_COMPRESSION), f"migration_{number}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка бэкапа перед миграцией {number}: {e}")
+        return False
+
+def run_migrations(conn, backup=True):
+    """Применение недостающих миграций; backup=False - для только что созданной базы или временной копии"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    pending = [migration for migration in MIGRATIONS if migration[0] > version]
+    if not pending:
+        return version
+    logger.info(f"Версия схемы {version}, миграций к применению: {len(pending)}")
+    for number, description, step in pending:
+        if backup and not backup_before_migration(number):
+            logger.error(f"Миграция {number} отложена: не удалось сделать бэкап")
+            break
+        started = time.time()
+        logger.info(f"Миграция {number}: {description}")
+        step(conn)
+        # Номер версии фиксируется вместе с последними изменениями шага
+        conn.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+        logger.info(f"Миграция {number} завершена за {time.time() - started:.1f} с")
+        version = number
+    return version
+
+def get_db_connection():
+    """Получение соединения с базой данных текущего тенанта (из его пула)"""
+    return current_tenant().pool.acquire()
+
+# Трассировка запросов: счетчики и время по каждому выражению, журнал медленных запросов с планом
+DB_SLOW_QUERY_SECONDS = float(os.environ.get('DB_SLOW_QUERY_MS', 50)) / 1000
+DB_SLOW_LOG_INTERVAL = 300
+EXPLAINABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+class QueryStats:
+    """Статистика выполнения SQL-выражений (текст выражения с ? вместо значений - ключ)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.since = time.time()
+
+    def record(self, conn, sql, params, elapsed, rows=1):
+        key = ' '.join(sql.split())
+        now = time.time()
+        slow = elapsed >= DB_SLOW_QUERY_SECONDS
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {'count': 0, 'rows': 0, 'total': 0.0, 'max': 0.0, 'slow': 0, 'plan': None, 'logged_at': 0}
+            entry['count'] += 1
+            entry['rows'] += rows
+            entry['total'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            # Медленное выражение пишем в лог не чаще раза в DB_SLOW_LOG_INTERVAL
+            log_now = slow and now - entry['logged_at'] >= DB_SLOW_LOG_INTERVAL
+            if slow:
+                entry['slow'] += 1
+            if log_now:
+                entry['logged_at'] = now
+        if log_now:
+            entry['plan'] = explain_query_plan(conn, sql, params)
+            logger.warning(f"Медленный запрос ({elapsed * 1000:.1f} мс, строк: {rows}): {key[:300]} | план: {entry['plan']}")
+
+    def top(self, limit=15):
+        with self.lock:
+            entries = [(key, dict(entry)) for key, entry in self.entries.items()]
+        return sorted(entries, key=lambda item: -item[1]['total'])[:limit]
+
+    def reset(self):
+        with self.lock:
+            self.entries.clear()
+            self.since = time.time()
+
+query_stats = QueryStats()
+
+def explain_query_plan(conn, sql, params):
+    """EXPLAIN QUERY PLAN для выражения с теми же параметрами (строка вида 'SCAN items / USE TEMP B-TREE ...')"""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+        return None
+    try:
+        rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        return ' / '.join(row[3] for row in rows) or None
+    except sqlite3.Error as e:
+        return f"нет плана: {e}"
+
+class TracedCursor(sqlite3.Cursor):
+    """Курсор с замером времени выполнения выражений"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            query_stats.record(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            query_stats.record(self.connection, sql, seq_of_parameters[0] if seq_of_parameters else (),
+                               time.perf_counter() - started, len(seq_of_parameters))
+
+class PooledConnection(sqlite3.Connection):
+    """Соединение из пула: close() возвращает его в пул, выражения и фиксации замеряются"""
+    pool = None
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            query_stats.record(self, 'COMMIT', (), time.perf_counter() - started)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+class ConnectionPool:
+    """Пул соединений одной базы: свободные соединения переиспользуются"""
+
+    def __init__(self, db_file, size=TENANT_POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        # WAL: читатели (в том числе курсор, который отдает список по частям между отправками сообщений)
+        # не блокируют запись; режим хранится в файле базы, повторная установка ничего не стоит
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.pool = self
+        return conn
+
+    def release(self, conn):
+        try:
+            # Незафиксированные изменения не должны достаться следующему владельцу
+            if conn.in_transaction:
+                conn.rollback()
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(conn)
+                    return
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка возврата соединения в пул {self.db_file}: {e}")
+        conn.pool = None
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            conns, self.idle = self.idle, []
+        for conn in conns:
+            conn.pool = None
+            conn.close()
+
+# Тенанты
+class Tenant:
+    """Команда со своей базой, бэкапами, журналом, пулом соединений и кэшами"""
+
+    def __init__(self, name, config=None):
+        config = config or {}
+        self.name = name
+        if name == DEFAULT_TENANT:
+            # Тенант по умолчанию использует прежние пути - однокомандная установка не меняется
+            self.db_file, self.backup_dir, self.journal_dir = DB_FILE, BACKUP_DIR, JOURNAL_DIR
+        else:
+            base_dir = os.path.join(TENANTS_DIR, name)
+            self.db_file = os.path.join(base_dir, DB_FILE)
+            self.backup_dir = os.path.join(base_dir, 'backups')
+            self.journal_dir = os.path.join(base_dir, 'journal')
+        self.backup_manifest = os.path.join(self.backup_dir, 'manifest.json')
+        self.storage_ids = config.get('storages') or STORAGE_IDS
+        self.reverse_storage_ids = {v: k for k, v in self.storage_ids.items()}
+        self.secret_word = config.get('secret_word') or SECRET_WORD
+        self.backup_min_interval = config.get('backup_interval', BACKUP_MIN_INTERVAL)
+        self.backup_every_records = config.get('backup_every_records', BACKUP_EVERY_RECORDS)
+        self.backup_state = {'at': 0, 'seq': 0}
+        self.manifest_lock = threading.Lock()
+        self.pool = ConnectionPool(self.db_file)
+        # Кэши - неизменяемые снимки: писатели строят новый и подменяют ссылку под cache_lock,
+        # читатели берут текущую ссылку без блокировок (None - не загружен)
+        self.cache_lock = threading.Lock()
+        self.cache_generation = 0
+        # Версии данных для HTTP-кэша: 'events' и id кладовых; эпоха меняется при восстановлении базы
+        self.data_versions = {}
+        self.data_epoch = 0
+        self.items_cache = {}
+        self.events_cache = None
+        self.rules_cache = None
+        self.admins_cache = None
+        self.reservations_cache = None
+        # Проверка пересечений и запись брони - одним шагом
+        self.reservation_lock = threading.Lock()
+        self.role_cache = {}
+        self.chats_pending = {}
+        self.chats_seen = {}
+        self.journal = None
+        self.stats = None
+        self.last_used = time.time()
+
+    def open(self):
+        """Создание каталогов и базы, запуск журнала изменений"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with use_tenant(self):
+            init_database()
+            self.journal = ChangeJournal(self.journal_dir, get_db_journal_seq())
+            self.stats = InventoryStats()
+        logger.info(f"Тенант {self.name} открыт: {self.db_file}")
+
+    def cache_size(self):
+        """Число записей в кэшах тенанта (для общего бюджета памяти)"""
+        return (sum(len(items) for items in list(self.items_cache.values())) + len(self.events_cache or ())
+                + len(self.reservations_cache.by_id if self.reservations_cache else ()))
+
+    def evict(self):
+        """Выгрузка кэшей и соединений простаивающего тенанта (данные остаются в его базе)"""
+        size = self.cache_size()
+        with self.cache_lock:
+            self.cache_generation += 1
+            self.items_cache = {}
+            self.events_cache = None
+            self.rules_cache = None
+            self.reservations_cache = None
+        self.role_cache.clear()
+        self.pool.close()
+        logger.info(f"Тенант {self.name} выгружен из памяти ({size} записей)")
+
+def load_tenant_configs():
+    """Настройки тенантов: {"имя": {"chats": [...], "users": [...], "secret_word": ..., "storages": {...}, "backup_interval": ...}}"""
+    try:
+        with open(TENANTS_FILE, encoding='utf-8') as f:
+            configs = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Ошибка чтения настроек тенантов {TENANTS_FILE}: {e}")
+        return {}
+    valid = {}
+    for name, config in configs.items():
+        # Имя тенанта становится именем каталога
+        if not re.fullmatch(r'[\w-]+', name):
+            logger.error(f"Недопустимое имя тенанта: {name}")
+            continue
+        valid[name] = config
+    return valid
+
+tenant_configs = load_tenant_configs()
+tenant_by_chat = {int(chat_id): name for name, config in tenant_configs.items() for chat_id in config.get('chats', [])}
+tenant_by_user = {username.lstrip('@').lower(): name for name, config in tenant_configs.items() for username in config.get('users', [])}
+tenants = {}
+tenants_lock = threading.Lock()
+tenant_context = threading.local()
+
+def get_tenant(name):
+    """Открытый тенант по имени (открывается при первом обращении)"""
+    tenant = tenants.get(name)
+    if tenant is None:
+        with tenants_lock:
+            tenant = tenants.get(name)
+            if tenant is None:
+                tenant = Tenant(name, tenant_configs.get(name))
+                tenant.open()
+                tenants[name] = tenant
+    return tenant
+
+def resolve_tenant(chat_id, username=None):
+    """Тенант чата: по id чата, для личных чатов - еще и по username"""
+    name = tenant_by_chat.get(chat_id)
+    if name is None and username:
+        name = tenant_by_user.get(username.lower())
+    return get_tenant(name or DEFAULT_TENANT)
+
+def current_tenant():
+    return getattr(tenant_context, 'tenant', None) or get_tenant(DEFAULT_TENANT)
+
+@contextmanager
+def use_tenant(tenant):
+    """Выполнение кода от имени тенанта (фоновые задачи, колбэки бэкапов)"""
+    previous = getattr(tenant_context, 'tenant', None)
+    tenant_context.tenant = tenant
+    try:
+        yield tenant
+    finally:
+        tenant_context.tenant = previous
+
+def opened_tenants():
+    return list(tenants.values())
+
+def all_tenants():
+    """Все настроенные тенанты (открываются при необходимости)"""
+    return [get_tenant(name) for name in dict.fromkeys((DEFAULT_TENANT, *tenant_configs))]
+
+def for_each_tenant(tenants_list, action, description):
+    """Фоновое действие для каждого тенанта: ошибка одного не мешает остальным"""
+    for tenant in tenants_list:
+        try:
+            with use_tenant(tenant):
+                action()
+        except Exception as e:
+            logger.error(f"Ошибка фоновой задачи «{description}» ({tenant.name}): {e}")
+
+def enforce_tenant_budget():
+    """Выгрузка давно не использованных тенантов (LRU), если кэши превысили общий бюджет"""
+    now = time.time()
+    opened = opened_tenants()
+    total = sum(tenant.cache_size() for tenant in opened)
+    for tenant in sorted(opened, key=lambda tenant: tenant.last_used):
+        if total <= TENANT_CACHE_BUDGET or now - tenant.last_used < TENANT_IDLE_SECONDS:
+            break
+        size = tenant.cache_size()
+        if size:
+            tenant.evict()
+            total -= size
+    if total > TENANT_CACHE_BUDGET:
+        logger.warning(f"Кэши тенантов превышают бюджет: {total} > {TENANT_CACHE_BUDGET} записей")
+
+# Журнал изменений
+class ChangeJournal:
+    """Журнал изменений: компактные записи, дозапись в файл и fsync пачками"""
+
+    def __init__(self, directory, start_seq):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.wakeup = threading.Event()
+        self.file = None
+        last_seq = start_seq
+        for record in self.iter_records():
+            last_seq = max(last_seq, record[0])
+        self.seq = last_seq
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def segments(self):
+        """Файлы журнала в порядке номеров первых записей"""
+        names = [name for name in os.listdir(self.directory) if name.startswith('changes_') and name.endswith('.log')]
+        return sorted(os.path.join(self.directory, name) for name in names)
+
+    def iter_records(self, after_seq=0):
+        for path in self.segments():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная строка после аварийного завершения
+                        continue
+                    if record[0] > after_seq:
+                        yield record
+
+    def commit(self, conn, records):
+        """Фиксация транзакции вместе с номером журнала и постановка записей в очередь"""
+        with self.lock:
+            last_seq = self.seq + len(records)
+            conn.execute('UPDATE journal_state SET seq = ? WHERE id = 1', (last_seq,))
+            conn.commit()
+            ts = round(time.time(), 3)
+            for offset, record in enumerate(records, 1):
+                self.pending.append([self.seq + offset, ts, *record])
+            self.seq = last_seq
+        self.wakeup.set()
+
+    def flush(self):
+        """Запись накопленных изменений на диск с fsync"""
+        with self.flush_lock:
+            with self.lock:
+                records, self.pending = self.pending, []
+            if not records:
+                return
+            if self.file is None or self.file.tell() >= JOURNAL_SEGMENT_BYTES:
+                if self.file:
+                    self.file.close()
+                path = os.path.join(self.directory, f"changes_{records[0][0]:012d}.log")
+                self.file = open(path, 'a', encoding='utf-8')
+            self.file.write(''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def _flush_loop(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(JOURNAL_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала изменений: {e}")
+
+    def cleanup(self, min_seq):
+        """Удаление сегментов, все записи которых уже вошли в самый старый снимок"""
+        with self.flush_lock:
+            segments = self.segments()
+            current = self.file.name if self.file else None
+            for path, next_path in zip(segments, segments[1:]):
+                next_first_seq = int(os.path.basename(next_path)[len('changes_'):-len('.log')])
+                if next_first_seq <= min_seq + 1 and path != current:
+                    os.remove(path)
+                    logger.info(f"Удален сегмент журнала: {os.path.basename(path)}")
+
+def apply_journal_record(conn, record):
+    """Применение записи журнала к базе (записи содержат итоговое состояние, повтор безопасен)"""
+    op, args = record[2], record[3:]
+    if op == 'item':
+        issued_at, due_at = (list(args[5:7]) + [None, None])[:2]
+        conn.execute(
+            '''INSERT INTO items (id, storage_id, item_name, issued, owner, issued_at, due_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET storage_id = excluded.storage_id, item_name = excluded.item_name,
+               issued = excluded.issued, owner = excluded.owner, issued_at = excluded.issued_at, due_at = excluded.due_at''',
+            (*args[:5], issued_at, due_at)
+        )
+    elif op == 'item_del':
+        conn.execute('DELETE FROM items WHERE id = ?', (args[0],))
+    elif op == 'event':
+        conn.execute('INSERT OR REPLACE INTO events (id, event_name, event_date) VALUES (?, ?, ?)', args[:3])
+    elif op == 'event_del':
+        conn.execute('DELETE FROM events WHERE id = ?', (args[0],))
+    elif op == 'rule':
+        conn.execute('INSERT OR REPLACE INTO event_rules (id, event_name, start_date, freq, until) VALUES (?, ?, ?, ?, ?)', args[:5])
+    elif op == 'rule_del':
+        conn.execute('DELETE FROM event_rules WHERE id = ?', (args[0],))
+        conn.execute('DELETE FROM event_exceptions WHERE rule_id = ?', (args[0],))
+    elif op == 'rule_ex':
+        conn.execute('INSERT OR IGNORE INTO event_exceptions (rule_id, event_date) VALUES (?, ?)', args[:2])
+    elif op == 'resv':
+        conn.execute(
+            '''INSERT OR REPLACE INTO reservations (id, item_id, storage_id, event_id, event_name, start_date, end_date, created_by)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            args[:8]
+        )
+    elif op == 'resv_del':
+        conn.execute('DELETE FROM reservations WHERE id = ?', (args[0],))
+    elif op == 'admin':
+        conn.execute(
+            '''INSERT INTO admins (username, is_main_admin) VALUES (?, ?)
+               ON CONFLICT(username) DO UPDATE SET is_main_admin = excluded.is_main_admin''',
+            args[:2]
+        )
+    elif op == 'admin_del':
+        conn.execute('DELETE FROM admins WHERE username = ?', (args[0],))
+
+def journal_commit(conn, records):
+    current_tenant().journal.commit(conn, records)
+
+def keep_live_broadcasts(live, restored):
+    """Перенос рассылок из рабочей базы в восстановленную: они не откатываются вместе с данными.
+
+    Иначе незавершенная в снимке рассылка возобновится с сохраненного курсора и повторно
+    отправит сообщения уже получившим их чатам.
+    """
+    schema = live.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'broadcasts'").fetchone()[0]
+    restored.execute(schema.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+    restored.execute('DELETE FROM broadcasts')
+    cursor = live.execute('SELECT * FROM broadcasts')
+    columns = [column[0] for column in cursor.description]
+    restored.executemany(
+        f"INSERT INTO broadcasts ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [tuple(row) for row in cursor]
+    )
+    restored.commit()
+
+def swap_in_database(restore_path, barrier_seq):
+    """Подмена рабочей базы восстановленной копией через sqlite3 backup API (рассылки не восстанавливаются)"""
+    # Сохраняем текущее состояние перед подменой
+    create_backup("pre_restore", wait=True)
+    restored = sqlite3.connect(restore_path)
+    live = get_db_connection()
+    try:
+        # Снимок мог быть сделан до последних миграций
+        run_migrations(restored, backup=False)
+        keep_live_broadcasts(live, restored)
+        restored.backup(live)
+        journal_commit(live, [('restore', barrier_seq)])
+    finally:
+        live.close()
+        restored.close()
+    invalidate_caches()
+    create_backup("restore")
+
+def restore_to_time(target_ts):
+    """Восстановление базы на момент времени: базовый снимок + повтор журнала"""
+    tenant = current_tenant()
+    journal = tenant.journal
+    journal.flush()
+    target_seq = 0
+    barriers = []
+    for record in journal.iter_records():
+        if record[1] > target_ts:
+            break
+        target_seq = record[0]
+        if record[2] == 'restore':
+            barriers.append(record[0])
+    
+    # Самый свежий снимок, не позже цели и не раньше последнего восстановления
+    min_seq = barriers[-1] if barriers else 0
+    candidates = [
+        (entry['journal_seq'], filename)
+        for filename, entry in load_backup_manifest().items()
+        if entry.get('journal_seq') is not None and min_seq <= entry['journal_seq'] <= target_seq
+        and entry.get('verified', True) and os.path.exists(os.path.join(tenant.backup_dir, filename))
+    ]
+    if not candidates:
+        return None
+    base_seq, filename = max(candidates)
+    
+    restore_path = os.path.join(tenant.backup_dir, 'restore_tmp.db')
+    try:
+        unpack_backup(os.path.join(tenant.backup_dir, filename), restore_path)
+        restored = sqlite3.connect(restore_path)
+        try:
+            replayed = 0
+            for record in journal.iter_records(after_seq=base_seq):
+                if record[0] > target_seq:
+                    break
+                apply_journal_record(restored, record)
+                replayed += 1
+            restored.commit()
+        finally:
+            restored.close()
+        swap_in_database(restore_path, target_seq)
+    finally:
+        if os.path.exists(restore_path):
+            os.remove(restore_path)
+    
+    logger.info(f"База восстановлена на {datetime.fromtimestamp(target_ts)}: снимок {filename}, повторено записей: {replayed}")
+    return filename, replayed
+
+def restore_snapshot(filename):
+    """Восстановление базы из выбранного снимка с проверкой перед подменой"""
+    tenant = current_tenant()
+    tenant.journal.flush()
+    entry = load_backup_manifest().get(filename)
+    backup_path = os.path.join(tenant.backup_dir, filename)
+    if not entry or not os.path.exists(backup_path):
+        return "снимок не найден"
+        
+    restore_path = os.path.join(tenant.backup_dir, 'restore_tmp.db')
+    try:
+        if unpack_backup(backup_path, restore_path) != entry['sha256']:
+            mark_backup_verified(filename, {'verified': False, 'verified_at': time.time()})
+            return "контрольная сумма не совпадает"
+        quick_check = check_database_file(restore_path)
+        if quick_check != 'ok':
+            mark_backup_verified(filename, {'verified': False, 'verified_at': time.time(), 'quick_check': quick_check})
+            return f"quick_check: {quick_check}"
+        swap_in_database(restore_path, entry['journal_seq'])
+    finally:
+        if os.path.exists(restore_path):
+            os.remove(restore_path)
+            
+    logger.info(f"База восстановлена из снимка {filename}")
+    return None
+
+def get_db_journal_seq():
+    conn = get_db_connection()
+    try:
+        return conn.execute('SELECT seq FROM journal_state WHERE id = 1').fetchone()[0]
+    finally:
+        conn.close()
+
+# Функции для работы с администраторами
+def load_admins():
+    """Загрузка списка администраторов из базы данных"""
+    tenant = current_tenant()
+    if tenant.admins_cache is not None:
+        return tenant.admins_cache
+    
+    generation = tenant.cache_generation
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT username, is_main_admin FROM admins')
+        admins_data = cursor.fetchall()
+        admins_cache = tuple(
+            {
+                'username': row['username'],
+                'is_main_admin': bool(row['is_main_admin'])
+            }
+            for row in admins_data
+        )
+        logger.info(f"Загружено {len(admins_cache)} администраторов")
+        return publish_loaded_cache('admins_cache', admins_cache, generation)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки администраторов: {e}")
+        return []
+    finally:
+        conn.close()
+
+def is_admin_by_username(username):
+    """Проверка, является ли пользователь администратором по username"""
+    if not username:
+        return False
+        
+    username = username.lstrip('@').lower()
+    
+    for admin in current_tenant().admins_cache or ():
+        if admin['username'].lower() == username:
+            return True
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT 1 FROM admins WHERE LOWER(username) = LOWER(?)', (username,))
+        result = cursor.fetchone()
+        return result is not None
+    except Exception as e:
+        logger.error(f"Ошибка проверки администратора по username: {e}")
+        return False
+    finally:
+        conn.close()
+
+def is_admin(chat_id, username=None):
+    """Проверка, является ли пользователь администратором"""
+    if username:
+        return is_admin_by_username(username)
+    return False
+
+def is_main_admin_by_username(username):
+    """Проверка, является ли пользователь главным администратором по username"""
+    if not username:
+        return False
+        
+    username = username.lstrip('@').lower()
+    
+    for admin in current_tenant().admins_cache or ():
+        if admin['username'].lower() == username and admin['is_main_admin']:
+            return True
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT 1 FROM admins WHERE LOWER(username) = LOWER(?) AND is_main_admin = 1', (username,))
+        result = cursor.fetchone()
+        return result is not None
+    except Exception as e:
+        logger.error(f"Ошибка проверки главного администратора: {e}")
+        return False
+    finally:
+        conn.close()
+
+def is_main_admin(chat_id, username=None):
+    """Проверка, является ли пользователь главным администратором"""
+    if username:
+        return is_main_admin_by_username(username)
+    return False
+
+def add_admin(username, is_main=False):
+    """Добавление нового администратора"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        username = username.lstrip('@')
+        
+        cursor.execute('SELECT 1 FROM admins WHERE username = ?', (username,))
+        if cursor.fetchone():
+            logger.warning(f"Администратор {username} уже существует")
+            return False
+            
+        cursor.execute(
+            'INSERT INTO admins (username, is_main_admin) VALUES (?, ?)',
+            (username, 1 if is_main else 0)
+        )
+        journal_commit(conn, [('admin', username, 1 if is_main else 0)])
+        
+        admin_data = {
+            'username': username,
+            'is_main_admin': is_main
+        }
+        publish_cache('admins_cache', lambda admins: admins + (admin_data,))
+        invalidate_keyboards()
+        
+        # Создаем бэкап после добавления админа
+        maybe_create_backup(f"add_admin_{username}")
+        
+        logger.info(f"Администратор {username} добавлен (main: {is_main})")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка добавления администратора {username}: {e}")
+        return False
+    finally:
+        conn.close()
+
+def remove_admin(username):
+    """Удаление администратора"""
+    # Главного админа нельзя удалить
+    main_admin = get_main_admin()
+    if main_admin and main_admin['username'] == username.lstrip('@'):
+        return False
+        
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        username = username.lstrip('@')
+        cursor.execute('DELETE FROM admins WHERE username = ? AND is_main_admin = 0', (username,))
+        removed = cursor.rowcount > 0
+        if removed:
+            journal_commit(conn, [('admin_del', username)])
+        
+        publish_cache('admins_cache', lambda admins: tuple(admin for admin in admins if admin['username'] != username))
+        invalidate_keyboards()
+        
+        # Создаем бэкап после удаления админа
+        if removed:
+            maybe_create_backup(f"remove_admin_{username}")
+        
+        logger.info(f"Администратор {username} удален")
+        return removed
+    except Exception as e:
+        logger.error(f"Ошибка удаления администратора {username}: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_main_admin():
+    """Получение главного администратора"""
+    for admin in current_tenant().admins_cache or ():
+        if admin['is_main_admin']:
+            return admin
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT username FROM admins WHERE is_main_admin = 1')
+        result = cursor.fetchone()
+        if result:
+            return {
+                'username': result['username'],
+                'is_main_admin': True
+            }
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка получения главного администратора: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_all_admins():
+    """Получение списка всех администраторов"""
+    return load_admins()
+
+CACHE_VERSION_KEYS = {'events_cache': 'events', 'rules_cache': 'events'}
+
+def bump_data_version(tenant, key):
+    """Вызывается под tenant.cache_lock при каждом изменении данных"""
+    tenant.data_versions[key] = tenant.data_versions.get(key, 0) + 1
+
+def data_version(tenant, key):
+    return (tenant.data_epoch, tenant.data_versions.get(key, 0))
+
+def publish_cache(name, update):
+    """Публикация нового снимка кэша тенанта: update строит его из текущего (незагруженный кэш не трогаем)"""
+    tenant = current_tenant()
+    with tenant.cache_lock:
+        tenant.cache_generation += 1
+        if name in CACHE_VERSION_KEYS:
+            bump_data_version(tenant, CACHE_VERSION_KEYS[name])
+        current = getattr(tenant, name)
+        if current is not None:
+            setattr(tenant, name, update(current))
+
+def publish_loaded_cache(name, snapshot, generation):
+    """Публикация снимка, прочитанного из базы, если за время чтения кэши не менялись"""
+    tenant = current_tenant()
+    with tenant.cache_lock:
+        if tenant.cache_generation != generation:
+            return snapshot
+        current = getattr(tenant, name)
+        if current is None:
+            setattr(tenant, name, snapshot)
+            return snapshot
+        return current
+
+def invalidate_caches():
+    """Сброс всех кэшей тенанта в памяти (после восстановления базы)"""
+    tenant = current_tenant()
+    with tenant.cache_lock:
+        tenant.cache_generation += 1
+        tenant.data_epoch += 1
+        tenant.items_cache = {}
+        tenant.events_cache = None
+        tenant.rules_cache = None
+        tenant.admins_cache = None
+        tenant.reservations_cache = None
+    invalidate_keyboards()
+    load_admins()
+    tenant.stats.load()
+
+def get_user_role(username):
+    """Роль пользователя: 'main', 'admin' или 'user' (результат кэшируется)"""
+    if not username:
+        return 'user'
+    key = username.lstrip('@').lower()
+    role_cache = current_tenant().role_cache
+    role = role_cache.get(key)
+    if role is None:
+        if is_main_admin_by_username(key):
+            role = 'main'
+        elif is_admin_by_username(key):
+            role = 'admin'
+        else:
+            role = 'user'
+        role_cache[key] = role
+    return role
+
+# Хранилище предметов в памяти
+class ItemRecord:
+    """Запись о предмете (компактная, без словаря атрибутов; после публикации в снимке не меняется)"""
+    __slots__ = ('id', 'item_name', 'storage_id', 'issued', 'owner', 'issued_at', 'due_at')
+
+    def __init__(self, row_id, item_name, storage_id, issued=0, owner='', issued_at=None, due_at=None):
+        self.id = row_id
+        self.item_name = item_name
+        self.storage_id = storage_id
+        self.issued = issued
+        self.owner = owner
+        self.issued_at = issued_at
+        self.due_at = due_at
+
+    def with_issue(self, issued, owner, issued_at=None, due_at=None):
+        """Копия записи с другим статусом выдачи"""
+        return ItemRecord(self.id, self.item_name, self.storage_id, issued, owner, issued_at, due_at)
+
+class StorageItems:
+    """Неизменяемый снимок предметов кладовой с индексами по id и по нормализованному названию.
+
+    Изменения не трогают снимок: updated() строит новый, и он публикуется одной подменой ссылки
+    в кэше тенанта, поэтому читатели перебирают свой снимок без блокировок.
+    """
+    __slots__ = ('storage_id', 'by_id', 'by_name', 'available_count', 'issued_count', '_sorted', '_ids')
+
+    def __init__(self, storage_id, records=()):
+        self.storage_id = storage_id
+        self.by_id = {}
+        self.by_name = {}
+        self.available_count = 0
+        self.issued_count = 0
+        self._sorted = None
+        self._ids = None
+        for record in records:
+            self._add(record)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def get(self, row_id):
+        return self.by_id.get(row_id)
+
+    def find(self, item_name):
+        return self.by_name.get(normalize_text(item_name))
+
+    def sorted_items(self):
+        """Предметы, отсортированные по названию (порядок вычисляется один раз на снимок)"""
+        if self._sorted is None:
+            self._sorted = tuple(sorted(self.by_id.values(), key=lambda item: normalize_text(item.item_name)))
+        return self._sorted
+
+    def page_after(self, cursor, limit):
+        """Страница предметов по возрастанию id после курсора (id последнего предмета прошлой страницы)"""
+        if self._ids is None:
+            self._ids = sorted(self.by_id)
+        start = bisect.bisect_right(self._ids, cursor)
+        page_ids = self._ids[start:start + limit]
+        next_cursor = page_ids[-1] if start + limit < len(self._ids) else None
+        return [self.by_id[row_id] for row_id in page_ids], next_cursor
+
+    def updated(self, added=(), removed=()):
+        """Новый снимок: без записей removed (id), с записями added (запись с тем же id заменяется)"""
+        snapshot = StorageItems(self.storage_id)
+        snapshot.by_id = dict(self.by_id)
+        snapshot.by_name = dict(self.by_name)
+        snapshot.available_count = self.available_count
+        snapshot.issued_count = self.issued_count
+        for row_id in removed:
+            snapshot._remove(row_id)
+        for record in added:
+            snapshot._remove(record.id)
+            snapshot._add(record)
+        return snapshot
+
+    def _add(self, record):
+        self.by_id[record.id] = record
+        self.by_name[normalize_text(record.item_name)] = record
+        if record.issued:
+            self.issued_count += 1
+        else:
+            self.available_count += 1
+
+    def _remove(self, row_id):
+        record = self.by_id.pop(row_id, None)
+        if record is None:
+            return
+        name_key = normalize_text(record.item_name)
+        if self.by_name.get(name_key) is record:
+            del self.by_name[name_key]
+        if record.issued:
+            self.issued_count -= 1
+        else:
+            self.available_count -= 1
+
+def publish_items(storage_id, added=(), removed=()):
+    """Публикация нового снимка кладовой поверх текущего (незагруженную кладовую не трогаем)"""
+    tenant = current_tenant()
+    with tenant.cache_lock:
+        tenant.cache_generation += 1
+        bump_data_version(tenant, storage_id)
+        current = tenant.items_cache.get(storage_id)
+        if current is not None:
+            tenant.items_cache[storage_id] = current.updated(added, removed)
+
+# Статистика
+USAGE_FIELDS = ('added', 'deleted', 'issued', 'returned')
+USAGE_WINDOW_DAYS = 30
+
+class InventoryStats:
+    """Счетчики по кладовым, владельцам и общие, обновляются из функций изменения предметов"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.storages = {}
+        self.owners = {}
+        self.available = 0
+        self.issued = 0
+        self.today = None
+        self.daily = {}
+        self.week = dict.fromkeys(USAGE_FIELDS, 0)
+        self.month = dict.fromkeys(USAGE_FIELDS, 0)
+
+    def load(self):
+        """Начальная загрузка агрегатами из базы (один раз, дальше только инкременты)"""
+        conn = get_db_connection()
+        try:
+            storages = {}
+            for row in conn.execute('SELECT storage_id, issued, COUNT(*) AS cnt FROM items GROUP BY storage_id, issued'):
+                counters = storages.setdefault(row['storage_id'], [0, 0])
+                counters[1 if row['issued'] else 0] += row['cnt']
+            owners = {
+                row['owner']: row['cnt']
+                for row in conn.execute('SELECT owner, COUNT(*) AS cnt FROM items WHERE issued = 1 GROUP BY owner')
+            }
+            today = datetime.now().date()
+            since = (today - timedelta(days=USAGE_WINDOW_DAYS - 1)).isoformat()
+            daily = {}
+            cursor = conn.execute(
+                f"SELECT day, {', '.join(f'SUM({field}) AS {field}' for field in USAGE_FIELDS)} "
+                "FROM item_stats_daily WHERE day >= ? GROUP BY day",
+                (since,)
+            )
+            for row in cursor:
+                daily[row['day']] = {field: row[field] for field in USAGE_FIELDS}
+        finally:
+            conn.close()
+        with self.lock:
+            self.storages = storages
+            self.owners = owners
+            self.available = sum(counters[0] for counters in storages.values())
+            self.issued = sum(counters[1] for counters in storages.values())
+            self.daily = daily
+            self.today = None
+            self.month = {field: sum(day[field] for day in daily.values()) for field in USAGE_FIELDS}
+            self._roll(today)
+            self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _roll(self, today):
+        """Сдвиг окон 7/30 дней при смене даты (вычитаются только выпавшие дни)"""
+        if self.today == today:
+            return
+        self.today = today
+        month_start = (today - timedelta(days=USAGE_WINDOW_DAYS - 1)).isoformat()
+        for day in [day for day in self.daily if day < month_start]:
+            for field in USAGE_FIELDS:
+                self.month[field] -= self.daily[day][field]
+            del self.daily[day]
+        week_start = (today - timedelta(days=6)).isoformat()
+        self.week = {field: sum(counts[field] for day, counts in self.daily.items() if day >= week_start) for field in USAGE_FIELDS}
+
+    def _count_usage(self, field, count):
+        today = datetime.now().date()
+        self._roll(today)
+        counts = self.daily.setdefault(today.isoformat(), dict.fromkeys(USAGE_FIELDS, 0))
+        counts[field] += count
+        self.week[field] += count
+        self.month[field] += count
+
+    def _change_owner(self, owner, delta):
+        count = self.owners.get(owner, 0) + delta
+        if count > 0:
+            self.owners[owner] = count
+        else:
+            self.owners.pop(owner, None)
+
+    def on_added(self, storage_id, count=1):
+        if not self.loaded:
+            return
+        with self.lock:
+            self.storages.setdefault(storage_id, [0, 0])[0] += count
+            self.available += count
+            self._count_usage('added', count)
+
+    def on_deleted(self, storage_id, issued, owner):
+        if not self.loaded:
+            return
+        with self.lock:
+            counters = self.storages.setdefault(storage_id, [0, 0])
+            if issued:
+                counters[1] -= 1
+                self.issued -= 1
+                self._change_owner(owner, -1)
+            else:
+                counters[0] -= 1
+                self.available -= 1
+            self._count_usage('deleted', 1)
+
+    def on_issued(self, storage_id, was_issued, old_owner, owner):
+        if not self.loaded:
+            return
+        with self.lock:
+            if was_issued:
+                self._change_owner(old_owner, -1)
+            else:
+                counters = self.storages.setdefault(storage_id, [0, 0])
+                counters[0] -= 1
+                counters[1] += 1
+                self.available -= 1
+                self.issued += 1
+            self._change_owner(owner, 1)
+            self._count_usage('issued', 1)
+
+    def on_returned(self, storage_id, owner):
+        if not self.loaded:
+            return
+        with self.lock:
+            counters = self.storages.setdefault(storage_id, [0, 0])
+            counters[0] += 1
+            counters[1] -= 1
+            self.available += 1
+            self.issued -= 1
+            self._change_owner(owner, -1)
+            self._count_usage('returned', 1)
+
+    def snapshot(self):
+        """Согласованная копия счетчиков для вывода"""
+        self.ensure_loaded()
+        with self.lock:
+            self._roll(datetime.now().date())
+            return {
+                'storages': {storage_id: tuple(counters) for storage_id, counters in self.storages.items()},
+                'owners': dict(self.owners),
+                'available': self.available,
+                'issued': self.issued,
+                'week': dict(self.week),
+                'month': dict(self.month)
+            }
+
+# Тенант по умолчанию открывается при запуске
+if not BACKUP_PROCESS:
+    get_tenant(DEFAULT_TENANT)
+
+def record_daily_usage(conn, storage_id, field, count):
+    """Инкремент дневной статистики в той же транзакции, что и изменение"""
+    conn.execute(
+        f'''INSERT INTO item_stats_daily (day, storage_id, {field}) VALUES (?, ?, ?)
+            ON CONFLICT(day, storage_id) DO UPDATE SET {field} = {field} + excluded.{field}''',
+        (datetime.now().date().isoformat(), storage_id, count)
+    )
+
+# Функции для работы с предметами
+def load_items(storage):
+    """Загрузка предметов кладовой в хранилище в памяти"""
+    tenant = current_tenant()
+    storage_id = tenant.storage_ids.get(storage)
+    items = tenant.items_cache.get(storage_id)
+    if items is not None:
+        return items
+    
+    generation = tenant.cache_generation
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT id, item_name, issued, owner, issued_at, due_at FROM items WHERE storage_id = ?', (storage_id,))
+        items = StorageItems(storage_id, (
+            ItemRecord(row['id'], row['item_name'], storage_id, row['issued'], row['owner'], row['issued_at'], row['due_at'])
+            for row in cursor
+        ))
+        # Снимок, прочитанный параллельно с изменением, не публикуем - он мог устареть
+        with tenant.cache_lock:
+            if tenant.cache_generation == generation:
+                items = tenant.items_cache.setdefault(storage_id, items)
+        return items
+    except Exception as e:
+        logger.error(f"Ошибка загрузки предметов из БД для {storage}: {e}")
+        return StorageItems(storage_id)
+    finally:
+        conn.close()
+
+def get_inventory(storage):
+    try:
+        items = load_items(storage)
+        return [(item.id, item.item_name, item.issued, item.owner) for item in items]
+    except Exception as e:
+        logger.error(f"Ошибка получения инвентаря для {storage}: {e}")
+        return []
+
+def get_items_by_row_ids(storage, row_ids):
+    """Получение предметов кладовой по id строк в базе данных"""
+    items = load_items(storage)
+    return [items.get(row_id) for row_id in row_ids if items.get(row_id)]
+
+def resolve_item_names(item_names, storage):
+    """Приведение введенных названий к названиям предметов в кладовой"""
+    items = load_items(storage)
+    resolved = []
+    for item_name in item_names:
+        item = items.find(item_name)
+        resolved.append(item.item_name if item else item_name)
+    return resolved
+
+def add_item(item_name, storage):
+    item_name = re.sub(r'[|\\]', '', item_name.strip())[:50]
+    if not item_name:
+        return None
+        
+    storage_id = current_tenant().storage_ids.get(storage)
+    if not storage_id:
+        return None
+        
+    items = load_items(storage)
+    if items.find(item_name):
+        return None
+        
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            'INSERT INTO items (item_name, storage_id, issued, owner) VALUES (?, ?, 0, "")',
+            (item_name, storage_id)
+        )
+        record_daily_usage(conn, storage_id, 'added', 1)
+        journal_commit(conn, [('item', cursor.lastrowid, storage_id, item_name, 0, "")])
+        
+        publish_items(storage_id, added=[ItemRecord(cursor.lastrowid, item_name, storage_id)])
+        current_tenant().stats.on_added(storage_id)
+            
+        # Создаем бэкап после добавления предмета
+        maybe_create_backup(f"add_item_{storage_id}")
+            
+        return item_name
+    except Exception as e:
+        logger.error(f"Ошибка добавления предмета {item_name} в {storage}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def delete_items(item_names, storage):
+    storage_id = current_tenant().storage_ids.get(storage)
+    if not storage_id:
+        return []
+        
+    items = load_items(storage)
+    records = list({item.id: item for item in map(items.find, item_names) if item}.values())
+    if not records:
+        return []
+        
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany('DELETE FROM items WHERE id = ?', [(item.id,) for item in records])
+        record_daily_usage(conn, storage_id, 'deleted', len(records))
+        # Брони удаленных предметов удаляются вместе с ними
+        dropped = load_reservations().matching(item_ids=[item.id for item in records])
+        journal_commit(conn, [('item_del', item.id) for item in records] + drop_reservations(cursor, dropped))
+        
+        publish_items(storage_id, removed=[item.id for item in records])
+        publish_reservations(removed=[reservation.id for reservation in dropped])
+        deleted_names = []
+        for item in records:
+            current_tenant().stats.on_deleted(storage_id, item.issued, item.owner)
+            deleted_names.append(item.item_name)
+            
+        # Создаем бэкап после удаления предметов
+        if deleted_names:
+            maybe_create_backup(f"delete_items_{storage_id}")
+            
+        return deleted_names
+    except Exception as e:
+        logger.error(f"Ошибка удаления предметов из {storage}: {e}")
+        return []
+    finally:
+        conn.close()
+
+def update_items_owner(item_names, owner, storage, due_date=None):
+    storage_id = current_tenant().storage_ids.get(storage)
+    if not storage_id:
+        return []
+        
+    items = load_items(storage)
+    records = list({item.id: item for item in map(items.find, item_names) if item}.values())
+    if not records:
+        return []
+        
+    issued_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    due_at = (due_date or datetime.now() + timedelta(days=LOAN_DAYS)).strftime('%Y-%m-%d')
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            'UPDATE items SET issued = 1, owner = ?, issued_at = ?, due_at = ? WHERE id = ?',
+            [(owner, issued_at, due_at, item.id) for item in records]
+        )
+        record_daily_usage(conn, storage_id, 'issued', len(records))
+        journal_commit(conn, [('item', item.id, storage_id, item.item_name, 1, owner, issued_at, due_at) for item in records])
+        
+        publish_items(storage_id, added=[item.with_issue(1, owner, issued_at, due_at) for item in records])
+        updated_names = []
+        for item in records:
+            current_tenant().stats.on_issued(storage_id, item.issued, item.owner, owner)
+            updated_names.append(item.item_name)
+                    
+        # Создаем бэкап после выдачи предметов
+        if updated_names:
+            maybe_create_backup(f"issue_items_{storage_id}")
+                    
+        return updated_names
+    except Exception as e:
+        logger.error(f"Ошибка обновления статуса предметов в {storage}: {e}")
+        return []
+    finally:
+        conn.close()
+
+def return_items(item_names, storage):
+    storage_id = current_tenant().storage_ids.get(storage)
+    if not storage_id:
+        return []
+        
+    items = load_items(storage)
+    records = list({item.id: item for item in map(items.find, item_names) if item and item.issued}.values())
+    if not records:
+        return []
+        
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            'UPDATE items SET issued = 0, owner = "", issued_at = NULL, due_at = NULL WHERE id = ? AND issued = 1',
+            [(item.id,) for item in records]
+        )
+        record_daily_usage(conn, storage_id, 'returned', len(records))
+        journal_commit(conn, [('item', item.id, storage_id, item.item_name, 0, "") for item in records])
+        
+        publish_items(storage_id, added=[item.with_issue(0, "") for item in records])
+        returned_names = []
+        for item in records:
+            current_tenant().stats.on_returned(storage_id, item.owner)
+            returned_names.append(item.item_name)
+                    
+        # Создаем бэкап после возврата предметов
+        if returned_names:
+            maybe_create_backup(f"return_items_{storage_id}")
+                    
+        return returned_names
+    except Exception as e:
+        logger.error(f"Ошибка возврата предметов в {storage}: {e}")
+        return []
+    finally:
+        conn.close()
+
+# Пакетные команды: действия с предметами разных кладовых одной транзакцией
+BATCH_ACTIONS = {'выдать': 'i', 'вернуть': 'r', 'добавить': 'a', 'удалить': 'd'}
+BATCH_MAX_LINES = INBOUND_MAX_LINES
+BATCH_ICONS = {'i': '🎁', 'r': '↩️', 'a': '➕', 'd': '🗑️'}
+
+def parse_owner_due(text):
+    """Получатель и срок из строки «Иван до 25.12.2030» (ValueError с причиной - неверная или прошедшая дата)"""
+    owner = text.strip()
+    match = re.match(r'^(.*?)\s+до\s+(\d{1,2}\.\d{1,2}\.\d{4})$', owner)
+    if not match:
+        return owner, None
+    try:
+        due_date = datetime.strptime(match.group(2), '%d.%m.%Y')
+    except ValueError:
+        raise ValueError("неверная дата, формат ДД.ММ.ГГГГ")
+    # Предмет с прошедшим сроком оказался бы просроченным сразу при выдаче
+    if due_date.date() < datetime.now().date():
+        raise ValueError("срок возврата уже прошел")
+    return match.group(1).strip(), due_date
+
+def match_storage_header(line):
+    """Название кладовой, если строка - заголовок кладовой («📍 Гринбокс 11:» или «Гринбокс 11»)"""
+    key = normalize_text(line.replace('📍', '').rstrip(':'))
+    for storage in current_tenant().storage_ids:
+        if normalize_text(storage) == key:
+            return storage
+    return None
+
+def parse_batch(text):
+    """Разбор пакета: строки-заголовки кладовых и команды выдать/вернуть/добавить/удалить.
+
+    Возвращает (операции, ошибки); операция - (номер строки, действие, кладовая или None, название, получатель, срок).
+    """
+    operations = []
+    errors = []
+    storage = None
+    lines = text.splitlines()
+    if len(lines) > BATCH_MAX_LINES:
+        return [], [f"слишком много строк ({len(lines)}), не больше {BATCH_MAX_LINES}"]
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        header = match_storage_header(line)
+        if header:
+            storage = header
+            continue
+        word, _, argument = line.partition(' ')
+        action = BATCH_ACTIONS.get(word.lower())
+        if not action:
+            errors.append(f"строка {line_no}: неизвестная команда «{word}»")
+            continue
+        owner = due_date = None
+        if action == 'i':
+            argument, arrow, owner_text = argument.replace('→', '->').partition('->')
+            try:
+                owner, due_date = parse_owner_due(owner_text)
+            except ValueError as e:
+                errors.append(f"строка {line_no}: {e}")
+                continue
+            if not arrow or not owner:
+                errors.append(f"строка {line_no}: укажите получателя: выдать Название -> @username")
+                continue
+        item_name = argument.strip()
+        if not item_name:
+            errors.append(f"строка {line_no}: не указан предмет")
+            continue
+        operations.append((line_no, action, storage, item_name, owner, due_date))
+    return operations, errors
+
+def plan_batch(operations):
+    """Проверка пакета по кэшам с учетом предыдущих строк пакета.
+
+    Возвращает (шаги, ошибки); шаг - (действие, кладовая, id кладовой, запись до шага или None, название, получатель, срок).
+    """
+    tenant = current_tenant()
+    state = {}
+    steps = []
+    errors = []
+
+    def lookup(storage, item_name):
+        key = (storage, normalize_text(item_name))
+        if key not in state:
+            state[key] = load_items(storage).find(item_name)
+        return state[key]
+
+    for line_no, action, storage, item_name, owner, due_date in operations:
+        if storage is None:
+            if action == 'a':
+                if len(tenant.storage_ids) != 1:
+                    errors.append(f"строка {line_no}: для добавления укажите кладовую строкой перед командой")
+                    continue
+                storage = next(iter(tenant.storage_ids))
+            else:
+                found = [candidate for candidate in tenant.storage_ids if lookup(candidate, item_name)]
+                if len(found) != 1:
+                    errors.append(f"строка {line_no}: «{item_name}» " + (
+                        "есть в нескольких кладовых, укажите кладовую строкой перед командой" if found else "не найден"))
+                    continue
+                storage = found[0]
+        record = lookup(storage, item_name)
+        if action == 'a':
+            if record:
+                errors.append(f"строка {line_no}: «{item_name}» уже есть в {storage}")
+                continue
+            item_name = re.sub(r'[|\\]', '', item_name)[:50]
+            new_record = ItemRecord(None, item_name, tenant.storage_ids[storage])
+        elif not record:
+            errors.append(f"строка {line_no}: «{item_name}» не найден в {storage}")
+            continue
+        elif action == 'i' and record.issued:
+            errors.append(f"строка {line_no}: «{record.item_name}» уже выдан ({record.owner})")
+            continue
+        elif action == 'r' and not record.issued:
+            errors.append(f"строка {line_no}: «{record.item_name}» не выдан")
+            continue
+        elif action == 'd':
+            new_record = None
+        else:
+            new_record = record.with_issue(1 if action == 'i' else 0, owner if action == 'i' else "")
+        state[(storage, normalize_text(item_name))] = new_record
+        steps.append((action, storage, tenant.storage_ids[storage], record, item_name, owner, due_date))
+    return steps, errors
+
+def apply_batch(steps):
+    """Применение проверенного пакета одной транзакцией: все шаги или ни одного.
+
+    Возвращает None при успехе или текст ошибки (база не изменена).
+    """
+    tenant = current_tenant()
+    issued_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ids = {}
+    final = {}
+    usage = {}
+    journal = []
+    stats_updates = []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for action, storage, storage_id, record, item_name, owner, due_date in steps:
+            key = (storage_id, normalize_text(item_name))
+            # Предмет мог появиться в предыдущей строке пакета
+            if key in ids:
+                record = final[storage_id][ids[key]]
+            if action == 'a':
+                cursor.execute(
+                    'INSERT INTO items (item_name, storage_id, issued, owner) VALUES (?, ?, 0, "")',
+                    (item_name, storage_id)
+                )
+                new_record = ItemRecord(cursor.lastrowid, item_name, storage_id)
+                journal.append(('item', new_record.id, storage_id, item_name, 0, ""))
+                stats_updates.append(('on_added', storage_id))
+                field = 'added'
+            elif action == 'd':
+                cursor.execute('DELETE FROM items WHERE id = ?', (record.id,))
+                new_record = None
+                journal.append(('item_del', record.id))
+                stats_updates.append(('on_deleted', storage_id, record.issued, record.owner))
+                field = 'deleted'
+            elif action == 'i':
+                due_at = (due_date or datetime.now() + timedelta(days=LOAN_DAYS)).strftime('%Y-%m-%d')
+                cursor.execute(
+                    'UPDATE items SET issued = 1, owner = ?, issued_at = ?, due_at = ? WHERE id = ? AND issued = 0',
+                    (owner, issued_at, due_at, record.id)
+                )
+                new_record = record.with_issue(1, owner, issued_at, due_at)
+                journal.append(('item', record.id, storage_id, record.item_name, 1, owner, issued_at, due_at))
+                stats_updates.append(('on_issued', storage_id, record.issued, record.owner, owner))
+                field = 'issued'
+            else:
+                cursor.execute(
+                    'UPDATE items SET issued = 0, owner = "", issued_at = NULL, due_at = NULL WHERE id = ? AND issued = 1',
+                    (record.id,)
+                )
+                new_record = record.with_issue(0, "")
+                journal.append(('item', record.id, storage_id, record.item_name, 0, ""))
+                stats_updates.append(('on_returned', storage_id, record.owner))
+                field = 'returned'
+            # Кэш мог устареть: другой запрос успел изменить предмет
+            if action != 'a' and cursor.rowcount != 1:
+                conn.rollback()
+                with tenant.cache_lock:
+                    tenant.cache_generation += 1
+                    tenant.items_cache.pop(storage_id, None)
+                return f"«{record.item_name}» изменен другим действием, повторите пакет"
+            row_id = new_record.id if new_record else record.id
+            ids[key] = row_id
+            final.setdefault(storage_id, {})[row_id] = new_record
+            usage[(storage_id, field)] = usage.get((storage_id, field), 0) + 1
+        for (storage_id, field), count in usage.items():
+            record_daily_usage(conn, storage_id, field, count)
+        dropped = load_reservations().matching(item_ids=[step[3].id for step in steps if step[0] == 'd' and step[3]])
+        journal.extend(drop_reservations(cursor, dropped))
+        journal_commit(conn, journal)
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        logger.error(f"Пакет отклонен базой: {e}")
+        return "предмет с таким названием уже есть, повторите пакет"
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка применения пакета: {e}")
+        return "ошибка базы данных"
+    finally:
+        conn.close()
+
+    for storage_id, records in final.items():
+        publish_items(
+            storage_id,
+            added=[record for record in records.values() if record],
+            removed=[row_id for row_id, record in records.items() if record is None]
+        )
+    publish_reservations(removed=[reservation.id for reservation in dropped])
+    for method, *args in stats_updates:
+        getattr(tenant.stats, method)(*args)
+    maybe_create_backup("batch")
+    return None
+
+def format_batch_step(step):
+    action, storage, storage_id, record, item_name, owner, due_date = step
+    line = f"{BATCH_ICONS[action]} {record.item_name if record else item_name} ({storage})"
+    if action == 'i':
+        line += f" → {owner}, до {(due_date or datetime.now() + timedelta(days=LOAN_DAYS)).strftime('%d.%m.%Y')}"
+    return line
+
+def run_batch(text):
+    """Разбор, проверка и применение пакета; возвращает строки ответа"""
+    operations, errors = parse_batch(text)
+    steps, plan_errors = plan_batch(operations)
+    errors = sorted(errors + plan_errors, key=lambda error: int(re.search(r'\d+', error).group()))
+    if not errors and not steps:
+        errors.append("нет команд")
+    if errors:
+        return [f"❌ Пакет не применен, ошибок: {len(errors)}", ""] + [f"• {error}" for error in errors]
+    error = apply_batch(steps)
+    if error:
+        return [f"❌ Пакет не применен: {error}"]
+    warnings = []
+    for action, storage, storage_id, record, item_name, owner, due_date in steps:
+        if action == 'i':
+            warnings.extend(issue_warnings([record.item_name if record else item_name], storage, due_date))
+    return ([f"✅ Пакет применен, действий: {len(steps)}", ""] + [format_batch_step(step) for step in steps]
+            + ([""] + warnings if warnings else []))
+
+# Просроченные предметы
+def get_overdue_items(today=None):
+    """Выданные предметы с истекшим сроком возврата (по частичному индексу, без загрузки кладовых)"""
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            '''SELECT storage_id, item_name, owner, due_at FROM items
+               WHERE issued = 1 AND due_at < ? ORDER BY due_at''',
+            (today,)
+        )
+        return [(row['storage_id'], row['item_name'], row['owner'], row['due_at']) for row in cursor]
+    except Exception as e:
+        logger.error(f"Ошибка получения просроченных предметов: {e}")
+        return []
+    finally:
+        conn.close()
+
+def build_overdue_report():
+    """Текст отчета о просрочках по кладовым или None, если просрочек нет"""
+    overdue = get_overdue_items()
+    if not overdue:
+        return None
+    by_storage = {}
+    for storage_id, item_name, owner, due_at in overdue:
+        by_storage.setdefault(storage_id, []).append((item_name, owner, due_at))
+    today = datetime.now().date()
+    text = f"⏰ Просроченные предметы: {len(overdue)}\n"
+    for storage_id, rows in by_storage.items():
+        text += f"\n📦 {current_tenant().reverse_storage_ids.get(storage_id, storage_id)}:\n"
+        for item_name, owner, due_at in rows:
+            days = (today - datetime.strptime(due_at, '%Y-%m-%d').date()).days
+            text += f"• {item_name} — {owner}, срок {datetime.strptime(due_at, '%Y-%m-%d').strftime('%d.%m.%Y')} (+{days} дн.)\n"
+    return text
+
+def get_admin_chat_ids():
+    """Личные чаты администраторов из реестра чатов"""
+    usernames = [admin['username'].lower() for admin in load_admins()]
+    if not usernames:
+        return []
+    flush_chats()
+    conn = get_db_connection()
+    try:
+        placeholders = ','.join(['?'] * len(usernames))
+        cursor = conn.execute(
+            f"SELECT chat_id FROM chats WHERE chat_type = 'private' AND blocked = 0 AND LOWER(username) IN ({placeholders})",
+            usernames
+        )
+        return [row[0] for row in cursor]
+    finally:
+        conn.close()
+
+def send_overdue_report():
+    report = build_overdue_report()
+    if not report:
+        logger.info("Просроченных предметов нет")
+        return
+    for chat_id in get_admin_chat_ids():
+        try:
+            bot.send_message(chat_id, report)
+        except Exception as e:
+            logger.error(f"Ошибка отправки отчета о просрочках в {chat_id}: {e}")
+
+# Функции для работы с событиями
+def load_events():
+    tenant = current_tenant()
+    if tenant.events_cache is not None:
+        return tenant.events_cache
+        
+    generation = tenant.cache_generation
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT id, event_name, event_date FROM events')
+        events_data = cursor.fetchall()
+        events = tuple(
+            {
+                'id': row['id'],
+                'event_name': row['event_name'],
+                'event_date': row['event_date']
+            }
+            for row in events_data
+        )
+        return publish_loaded_cache('events_cache', events, generation)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки событий: {e}")
+        return []
+    finally:
+        conn.close()
+
+def add_event(event_name, event_date):
+    event_id = str(uuid4())
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            'INSERT INTO events (id, event_name, event_date) VALUES (?, ?, ?)',
+            (event_id, event_name, event_date)
+        )
+        journal_commit(conn, [('event', event_id, event_name, event_date)])
+        
+        event = {
+            'id': event_id,
+            'event_name': event_name,
+            'event_date': event_date
+        }
+        publish_cache('events_cache', lambda events: events + (event,))
+        
+        # Создаем бэкап после добавления события
+        maybe_create_backup("add_event")
+        
+        return event_id
+    except Exception as e:
+        logger.error(f"Ошибка добавления события {event_name}: {e}")
+        return None
+    finally:
+        conn.close()
+
+# Повторяющиеся события
+RECURRENCE_WORDS = {
+    'ежедневно': 'daily',
+    'каждый день': 'daily',
+    'еженедельно': 'weekly',
+    'каждую неделю': 'weekly',
+    'ежемесячно': 'monthly',
+    'каждый месяц': 'monthly'
+}
+RECURRENCE_TITLES = {
+    'daily': 'каждый день',
+    'weekly': 'каждую неделю',
+    'monthly': 'каждый месяц'
+}
+# Сколько дней вперед разворачиваются повторения в общем списке событий
+EVENTS_LIST_DAYS = 90
+
+def load_event_rules():
+    """Правила повторения с исключениями (кэшируются)"""
+    tenant = current_tenant()
+    if tenant.rules_cache is not None:
+        return tenant.rules_cache
+        
+    generation = tenant.cache_generation
+    conn = get_db_connection()
+    try:
+        rules = {
+            row['id']: {
+                'id': row['id'],
+                'event_name': row['event_name'],
+                'start_date': row['start_date'],
+                'freq': row['freq'],
+                'until': row['until'],
+                'exdates': set()
+            }
+            for row in conn.execute('SELECT id, event_name, start_date, freq, until FROM event_rules')
+        }
+        for row in conn.execute('SELECT rule_id, event_date FROM event_exceptions'):
+            if row['rule_id'] in rules:
+                rules[row['rule_id']]['exdates'].add(row['event_date'])
+        for rule in rules.values():
+            rule['exdates'] = frozenset(rule['exdates'])
+        return publish_loaded_cache('rules_cache', rules, generation)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки повторяющихся событий: {e}")
+        return {}
+    finally:
+        conn.close()
+
+def iter_occurrences(rule, start, end):
+    """Даты повторений правила в окне [start, end] - без перебора дат до начала окна"""
+    first = date.fromisoformat(rule['start_date'])
+    last = min(end, date.fromisoformat(rule['until'])) if rule['until'] else end
+    if rule['freq'] in ('daily', 'weekly'):
+        step = 1 if rule['freq'] == 'daily' else 7
+        # Первое повторение не раньше начала окна
+        current = first + timedelta(days=max(0, -(-(start - first).days // step)) * step)
+        while current <= last:
+            if current.isoformat() not in rule['exdates']:
+                yield current.isoformat()
+            current += timedelta(days=step)
+        return
+    # Ежемесячно: в месяцах без такого числа (31-е, 29 февраля) повторения нет
+    months = max(0, (start.year - first.year) * 12 + start.month - first.month)
+    while True:
+        year, month = divmod(first.month - 1 + months, 12)
+        year += first.year
+        month += 1
+        if date(year, month, 1) > last:
+            return
+        if first.day <= calendar.monthrange(year, month)[1]:
+            current = date(year, month, first.day)
+            if start <= current <= last and current.isoformat() not in rule['exdates']:
+                yield current.isoformat()
+        months += 1
+
+def iter_rule_events(rule, start, end):
+    """Повторения правила как события: id повторения - '<id правила>@<дата>'"""
+    for event_date in iter_occurrences(rule, start, end):
+        yield (f"{rule['id']}@{event_date}", rule['event_name'], event_date)
+
+def without_rule_dates(rules, rule_ids, occurrences):
+    """Новый снимок правил: без удаленных серий, с добавленными исключениями"""
+    rules = {rule_id: rule for rule_id, rule in rules.items() if rule_id not in rule_ids}
+    for rule_id, event_date in occurrences:
+        if rule_id in rules:
+            rules[rule_id] = {**rules[rule_id], 'exdates': rules[rule_id]['exdates'] | {event_date}}
+    return rules
+
+def add_event_rule(event_name, start_date, freq, until=None):
+    """Добавление повторяющегося события"""
+    rule_id = str(uuid4())
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            'INSERT INTO event_rules (id, event_name, start_date, freq, until) VALUES (?, ?, ?, ?, ?)',
+            (rule_id, event_name, start_date, freq, until)
+        )
+        journal_commit(conn, [('rule', rule_id, event_name, start_date, freq, until)])
+        
+        rule = {
+            'id': rule_id,
+            'event_name': event_name,
+            'start_date': start_date,
+            'freq': freq,
+            'until': until,
+            'exdates': frozenset()
+        }
+        publish_cache('rules_cache', lambda rules: {**rules, rule_id: rule})
+        
+        maybe_create_backup("add_event_rule")
+        
+        return rule_id
+    except Exception as e:
+        logger.error(f"Ошибка добавления повторяющегося события {event_name}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def iter_events(period=None):
+    """Разовые события и повторения правил в порядке даты (слияние потоков через кучу).
+
+    Оба потока берутся из одного окна: от сегодня на неделю, месяц или EVENTS_LIST_DAYS дней.
+    """
+    today = datetime.now().date()
+    end = today + timedelta(days={'week': 7, 'month': 30}.get(period, EVENTS_LIST_DAYS))
+    streams = [iter_single_events(today, end)]
+    for rule in list(load_event_rules().values()):
+        streams.append(iter_rule_events(rule, today, end))
+    return heapq.merge(*streams, key=lambda event: event[2])
+
+def iter_single_events(start, end):
+    """Разовые события окна [start, end] в порядке даты, построчно из курсора (весь список в память не загружается)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            'SELECT id, event_name, event_date FROM events WHERE event_date BETWEEN ? AND ? ORDER BY event_date',
+            (start.isoformat(), end.isoformat())
+        )
+        for row in cursor:
+            yield (row['id'], row['event_name'], row['event_date'])
+    finally:
+        conn.close()
+
+def get_events(period=None):
+    try:
+        return list(iter_events(period))
+    except Exception as e:
+        logger.error(f"Ошибка получения событий: {e}")
+        return []
+
+def delete_event(event_ids):
+    """Удаление событий: id разового события или правила (вся серия), '<id правила>@<дата>' - одно повторение"""
+    if not event_ids:
+        return []
+        
+    rules = load_event_rules()
+    occurrences = [event_id.split('@', 1) for event_id in event_ids if '@' in event_id]
+    occurrences = [(rule_id, event_date) for rule_id, event_date in occurrences if rule_id in rules]
+    rule_ids = [event_id for event_id in event_ids if event_id in rules]
+    occurrences = [(rule_id, event_date) for rule_id, event_date in occurrences if rule_id not in rule_ids]
+    event_ids = [event_id for event_id in event_ids if '@' not in event_id and event_id not in rules]
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ','.join(['?'] * len(event_ids))
+        cursor.execute(f'SELECT id, event_name, event_date FROM events WHERE id IN ({placeholders})', event_ids)
+        events_to_delete = cursor.fetchall()
+        
+        cursor.execute(f'DELETE FROM events WHERE id IN ({placeholders})', event_ids)
+        cursor.executemany('DELETE FROM event_rules WHERE id = ?', [(rule_id,) for rule_id in rule_ids])
+        cursor.executemany('DELETE FROM event_exceptions WHERE rule_id = ?', [(rule_id,) for rule_id in rule_ids])
+        # Отдельное повторение не удаляется, а становится исключением правила
+        cursor.executemany('INSERT OR IGNORE INTO event_exceptions (rule_id, event_date) VALUES (?, ?)', occurrences)
+        dropped = load_reservations().matching(
+            event_ids=[event['id'] for event in events_to_delete] + [f"{rule_id}@{event_date}" for rule_id, event_date in occurrences],
+            rule_ids=rule_ids
+        )
+        journal_commit(conn, [('event_del', event['id']) for event in events_to_delete]
+                       + [('rule_del', rule_id) for rule_id in rule_ids]
+                       + [('rule_ex', rule_id, event_date) for rule_id, event_date in occurrences]
+                       + drop_reservations(cursor, dropped))
+        
+        publish_cache('events_cache', lambda events: tuple(ev for ev in events if ev['id'] not in event_ids))
+        publish_cache('rules_cache', lambda current: without_rule_dates(current, rule_ids, occurrences))
+        publish_reservations(removed=[reservation.id for reservation in dropped])
+        deleted_events = []
+        for rule_id, event_date in occurrences:
+            deleted_events.append(f"{rules[rule_id]['event_name']} ({format_event_date(event_date)}, одно повторение)")
+        for rule_id in rule_ids:
+            deleted_events.append(f"{rules[rule_id]['event_name']} (вся серия)")
+        
+        # Создаем бэкап после удаления событий
+        maybe_create_backup("delete_events")
+        
+        for event in events_to_delete:
+            event_name = event['event_name']
+            event_date = event['event_date']
+            try:
+                date_obj = datetime.strptime(event_date, '%Y-%m-%d')
+                formatted_date = date_obj.strftime('%d %B %Y').replace(
+                    date_obj.strftime('%B'),
+                    MONTHS_RU[date_obj.month]
+                )
+                deleted_events.append(f"{event_name} ({formatted_date})")
+            except ValueError:
+                deleted_events.append(f"{event_name} ({event_date})")
+                
+        return deleted_events
+    except Exception as e:
+        logger.error(f"Ошибка удаления событий: {e}, event_ids: {event_ids}")
+        return []
+    finally:
+        conn.close()
+
+# Брони предметов под события
+class Reservation:
+    """Бронь предмета под событие на период [start_date, end_date] (даты ГГГГ-ММ-ДД включительно)"""
+    __slots__ = ('id', 'item_id', 'storage_id', 'event_id', 'event_name', 'start_date', 'end_date')
+
+    def __init__(self, reservation_id, item_id, storage_id, event_id, event_name, start_date, end_date):
+        self.id = reservation_id
+        self.item_id = item_id
+        self.storage_id = storage_id
+        self.event_id = event_id
+        self.event_name = event_name
+        self.start_date = start_date
+        self.end_date = end_date
+
+class ItemSchedule:
+    """Неизменяемый индекс броней одного предмета - статическое дерево интервалов.
+
+    Брони отсортированы по дате начала; середина каждого отрезка массива - узел неявного сбалансированного
+    дерева, для узла хранится максимум дат окончания в его поддереве. Пересечение с периодом [start, end] -
+    бронь, начавшаяся не позже end и закончившаяся не раньше start: поддеревья с максимумом окончаний раньше
+    start и правые поддеревья узлов, начавшихся позже end, не обходятся - O(log n + k·log n) для k найденных.
+    Проверка занятости дня - бинарный поиск и префиксный максимум окончаний, O(log n).
+    """
+    __slots__ = ('reservations', 'starts', 'max_ends', 'subtree_ends')
+
+    def __init__(self, reservations=()):
+        self.reservations = tuple(sorted(reservations, key=lambda reservation: (reservation.start_date, reservation.id)))
+        self.starts = [reservation.start_date for reservation in self.reservations]
+        self.max_ends = list(itertools.accumulate((reservation.end_date for reservation in self.reservations), max))
+        self.subtree_ends = [''] * len(self.reservations)
+        self._build(0, len(self.reservations))
+
+    def _build(self, lo, hi):
+        """Максимум окончаний поддерева отрезка [lo, hi); пустая строка меньше любой даты"""
+        if lo >= hi:
+            return ''
+        mid = (lo + hi) // 2
+        self.subtree_ends[mid] = max(self.reservations[mid].end_date, self._build(lo, mid), self._build(mid + 1, hi))
+        return self.subtree_ends[mid]
+
+    def __len__(self):
+        return len(self.reservations)
+
+    def overlapping(self, start, end):
+        """Брони, пересекающиеся с периодом, в порядке начала"""
+        found = []
+        self._collect(0, len(self.reservations), start, end, found)
+        return found
+
+    def _collect(self, lo, hi, start, end, found):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self.subtree_ends[mid] < start:
+            return
+        self._collect(lo, mid, start, end, found)
+        reservation = self.reservations[mid]
+        # Правее начинаются не раньше - тоже после периода
+        if reservation.start_date > end:
+            return
+        if reservation.end_date >= start:
+            found.append(reservation)
+        self._collect(mid + 1, hi, start, end, found)
+
+    def busy(self, day):
+        position = bisect.bisect_right(self.starts, day)
+        return bool(position) and self.max_ends[position - 1] >= day
+
+class ReservationIndex:
+    """Неизменяемый снимок броней тенанта: по id и индексы по предметам"""
+    __slots__ = ('by_id', 'by_item')
+
+    def __init__(self, reservations=()):
+        self.by_id = {reservation.id: reservation for reservation in reservations}
+        grouped = {}
+        for reservation in self.by_id.values():
+            grouped.setdefault(reservation.item_id, []).append(reservation)
+        self.by_item = {item_id: ItemSchedule(group) for item_id, group in grouped.items()}
+
+    def overlapping(self, item_id, start, end):
+        schedule = self.by_item.get(item_id)
+        return schedule.overlapping(start, end) if schedule else []
+
+    def busy(self, item_id, day):
+        schedule = self.by_item.get(item_id)
+        return schedule is not None and schedule.busy(day)
+
+    def matching(self, item_ids=(), event_ids=(), rule_ids=()):
+        """Брони удаляемых предметов или событий (для правила - всех его повторений)"""
+        item_ids, event_ids = set(item_ids), set(event_ids)
+        rule_prefixes = tuple(f"{rule_id}@" for rule_id in rule_ids)
+        return [
+            reservation for reservation in self.by_id.values()
+            if reservation.item_id in item_ids or reservation.event_id in event_ids
+            or (rule_prefixes and reservation.event_id.startswith(rule_prefixes))
+        ]
+
+    def updated(self, added=(), removed=()):
+        """Новый снимок: индексы пересобираются только у затронутых предметов"""
+        snapshot = ReservationIndex()
+        snapshot.by_id = dict(self.by_id)
+        snapshot.by_item = dict(self.by_item)
+        touched = set()
+        for reservation_id in removed:
+            reservation = snapshot.by_id.pop(reservation_id, None)
+            if reservation:
+                touched.add(reservation.item_id)
+        for reservation in added:
+            snapshot.by_id[reservation.id] = reservation
+            touched.add(reservation.item_id)
+        for item_id in touched:
+            schedule = self.by_item.get(item_id)
+            reservations = {reservation.id: reservation for reservation in (schedule.reservations if schedule else ())
+                            if reservation.id in snapshot.by_id}
+            reservations.update((reservation.id, reservation) for reservation in added if reservation.item_id == item_id)
+            if reservations:
+                snapshot.by_item[item_id] = ItemSchedule(reservations.values())
+            else:
+                snapshot.by_item.pop(item_id, None)
+        return snapshot
+
+def load_reservations():
+    """Брони тенанта (кэшируются)"""
+    tenant = current_tenant()
+    if tenant.reservations_cache is not None:
+        return tenant.reservations_cache
+        
+    generation = tenant.cache_generation
+    conn = get_db_connection()
+    try:
+        index = ReservationIndex(
+            Reservation(row['id'], row['item_id'], row['storage_id'], row['event_id'], row['event_name'], row['start_date'], row['end_date'])
+            for row in conn.execute('SELECT id, item_id, storage_id, event_id, event_name, start_date, end_date FROM reservations')
+        )
+        return publish_loaded_cache('reservations_cache', index, generation)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки броней: {e}")
+        return ReservationIndex()
+    finally:
+        conn.close()
+
+def drop_reservations(cursor, reservations):
+    """Удаление броней в текущей транзакции, возвращает записи журнала"""
+    cursor.executemany('DELETE FROM reservations WHERE id = ?', [(reservation.id,) for reservation in reservations])
+    return [('resv_del', reservation.id) for reservation in reservations]
+
+def publish_reservations(added=(), removed=()):
+    if added or removed:
+        publish_cache('reservations_cache', lambda index: index.updated(added, removed))
+
+def format_period(start_date, end_date):
+    if start_date == end_date:
+        return format_due_date(start_date)
+    return f"{format_due_date(start_date)}–{format_due_date(end_date)}"
+
+def parse_reservation_period(text):
+    """Период брони: «01.05.2030», «01.05.2030 - 03.05.2030» или «с 01.05.2030 по 03.05.2030» (None - не период)"""
+    match = re.match(r'^(?:с\s+)?(\d{1,2}\.\d{1,2}\.\d{4})(?:\s*(?:-|—|–|по)\s*(\d{1,2}\.\d{1,2}\.\d{4}))?$', text.strip())
+    if not match:
+        return None
+    start = datetime.strptime(match.group(1), '%d.%m.%Y').date()
+    end = datetime.strptime(match.group(2), '%d.%m.%Y').date() if match.group(2) else start
+    if end < start:
+        raise ValueError(text)
+    return start.isoformat(), end.isoformat()
+
+def resolve_reservation_items(lines):
+    """Предметы из строк «Палатка» или «Гринбокс 11: Палатка»; возвращает (записи, ошибки)"""
+    tenant = current_tenant()
+    records = {}
+    errors = []
+    for line in lines:
+        storage, colon, item_name = line.partition(':')
+        storage = match_storage_header(storage) if colon else None
+        if not storage:
+            item_name = line
+            found = [candidate for candidate in tenant.storage_ids if load_items(candidate).find(item_name)]
+            if len(found) != 1:
+                errors.append(f"«{item_name.strip()}» " + (
+                    "есть в нескольких кладовых, укажите: «Кладовая: предмет»" if found else "не найден"))
+                continue
+            storage = found[0]
+        record = load_items(storage).find(item_name.strip())
+        if not record:
+            errors.append(f"«{item_name.strip()}» не найден в {storage}")
+            continue
+        records[record.id] = record
+    return list(records.values()), errors
+
+def issue_conflicts(record, start_date, end_date):
+    """Предупреждение, если предмет выдан и не вернется к началу брони"""
+    if record.issued and (not record.due_at or record.due_at >= start_date):
+        return f"⚠️ «{record.item_name}» выдан ({record.owner})" + (f" до {format_due_date(record.due_at)}" if record.due_at else "")
+    return None
+
+def reserve_items(event_id, event_name, start_date, end_date, records, created_by=''):
+    """Бронь предметов под событие целиком: при пересечении с другой бронью не бронируется ничего.
+
+    Возвращает (созданные брони, ошибки).
+    """
+    tenant = current_tenant()
+    with tenant.reservation_lock:
+        index = load_reservations()
+        errors = []
+        for record in records:
+            for other in index.overlapping(record.id, start_date, end_date):
+                errors.append(f"«{record.item_name}» уже забронирован: {other.event_name} ({format_period(other.start_date, other.end_date)})")
+        if errors:
+            return [], errors
+            
+        reservations = [
+            Reservation(str(uuid4()), record.id, record.storage_id, event_id, event_name, start_date, end_date)
+            for record in records
+        ]
+        conn = get_db_connection()
+        try:
+            conn.executemany(
+                '''INSERT INTO reservations (id, item_id, storage_id, event_id, event_name, start_date, end_date, created_by)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                [(r.id, r.item_id, r.storage_id, r.event_id, r.event_name, r.start_date, r.end_date, created_by) for r in reservations]
+            )
+            journal_commit(conn, [('resv', r.id, r.item_id, r.storage_id, r.event_id, r.event_name, r.start_date, r.end_date, created_by)
+                                  for r in reservations])
+            publish_reservations(added=reservations)
+        except Exception as e:
+            logger.error(f"Ошибка бронирования под событие {event_name}: {e}")
+            return [], ["ошибка базы данных"]
+        finally:
+            conn.close()
+            
+    maybe_create_backup("reserve_items")
+    return reservations, []
+
+def cancel_reservations(reservation_ids):
+    """Отмена броней по id, возвращает отмененные"""
+    index = load_reservations()
+    reservations = [index.by_id[reservation_id] for reservation_id in reservation_ids if reservation_id in index.by_id]
+    if not reservations:
+        return []
+        
+    conn = get_db_connection()
+    try:
+        journal_commit(conn, drop_reservations(conn.cursor(), reservations))
+        publish_reservations(removed=[reservation.id for reservation in reservations])
+        maybe_create_backup("cancel_reservations")
+        return reservations
+    except Exception as e:
+        logger.error(f"Ошибка отмены броней: {e}")
+        return []
+    finally:
+        conn.close()
+
+def get_active_reservations(today=None):
+    """Брони, которые еще не закончились, по дате начала"""
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    return sorted(
+        (reservation for reservation in load_reservations().by_id.values() if reservation.end_date >= today),
+        key=lambda reservation: (reservation.start_date, reservation.event_name, reservation.id)
+    )
+
+def reservation_item_name(reservation):
+    storage = current_tenant().reverse_storage_ids.get(reservation.storage_id)
+    item = load_items(storage).get(reservation.item_id) if storage else None
+    return f"{item.item_name if item else '?'} ({storage or reservation.storage_id})"
+
+def get_free_items(day):
+    """Свободные в день day предметы по кладовым: не забронированы и не выданы (или вернутся раньше).
+
+    Каждый предмет проверяется по своему индексу броней за O(log n), все брони не перебираются.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    index = load_reservations()
+    free = {}
+    for storage in current_tenant().storage_ids:
+        free[storage] = [
+            item for item in load_items(storage).sorted_items()
+            if not index.busy(item.id, day)
+            and (not item.issued or (day > today and item.due_at and item.due_at < day))
+        ]
+    return free
+
+def reservation_warnings(item_names, storage, start_date, end_date):
+    """Брони, с которыми пересекается выдача предметов на период"""
+    items = load_items(storage)
+    index = load_reservations()
+    warnings = []
+    for item_name in item_names:
+        item = items.find(item_name)
+        for reservation in index.overlapping(item.id, start_date, end_date) if item else ():
+            warnings.append(f"⚠️ «{item.item_name}» забронирован: {reservation.event_name} ({format_period(reservation.start_date, reservation.end_date)})")
+    return warnings
+
+def issue_warnings(item_names, storage, due_date=None):
+    """Брони, с которыми пересекается выдача с сегодняшнего дня до срока возврата (общая для выдачи из меню и пакетом)"""
+    due = due_date or datetime.now() + timedelta(days=LOAN_DAYS)
+    return reservation_warnings(item_names, storage, datetime.now().strftime('%Y-%m-%d'), due.strftime('%Y-%m-%d'))
+
+# Реестр чатов
+CHATS_FLUSH_INTERVAL = 30
+CHATS_FLUSH_BATCH = 500
+CHATS_TOUCH_INTERVAL = 3600
+
+chats_lock = threading.Lock()
+
+def touch_chat(chat, username=None):
+    """Отметка активности чата; запись в базу откладывается и делается пачкой"""
+    tenant = current_tenant()
+    chats_seen, chats_pending = tenant.chats_seen, tenant.chats_pending
+    now = time.time()
+    if now - chats_seen.get(chat.id, 0) < CHATS_TOUCH_INTERVAL:
+        return
+    with chats_lock:
+        chats_seen[chat.id] = now
+        chats_pending[chat.id] = (chat.id, username or '', chat.type or '')
+        flush_now = len(chats_pending) >= CHATS_FLUSH_BATCH
+    if flush_now:
+        flush_chats()
+
+def flush_chats():
+    """Пакетная запись накопленных чатов в базу"""
+    chats_pending = current_tenant().chats_pending
+    with chats_lock:
+        if not chats_pending:
+            return
+        rows = list(chats_pending.values())
+        chats_pending.clear()
+    conn = get_db_connection()
+    try:
+        conn.executemany(
+            '''INSERT INTO chats (chat_id, username, chat_type) VALUES (?, ?, ?)
+               ON CONFLICT(chat_id) DO UPDATE SET username = excluded.username, chat_type = excluded.chat_type,
+               blocked = 0, last_seen = CURRENT_TIMESTAMP''',
+            rows
+        )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка записи чатов: {e}")
+        # Повторим при следующей записи
+        with chats_lock:
+            for row in rows:
+                chats_pending.setdefault(row[0], row)
+    finally:
+        conn.close()
+
+def mark_chat_blocked(chat_id):
+    conn = get_db_connection()
+    try:
+        conn.execute('UPDATE chats SET blocked = 1 WHERE chat_id = ?', (chat_id,))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка отметки чата {chat_id} как заблокировавшего бота: {e}")
+    finally:
+        conn.close()
+    current_tenant().chats_seen.pop(chat_id, None)
+
+# Рассылки
+BROADCAST_RATE = 25
+BROADCAST_PAGE_SIZE = 200
+BROADCAST_REPORT_INTERVAL = 5
+
+broadcast_wakeup = threading.Event()
+
+class RateLimiter:
+    """Ограничитель частоты (маркерная корзина) для исходящих сообщений"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+broadcast_limiter = RateLimiter(BROADCAST_RATE)
+
+def start_broadcast(text, username, report_chat_id):
+    """Создание рассылки по всем известным чатам"""
+    flush_chats()
+    conn = get_db_connection()
+    try:
+        total = conn.execute('SELECT COUNT(*) FROM chats WHERE blocked = 0').fetchone()[0]
+        report = bot.send_message(report_chat_id, f"📣 Рассылка запущена: 0/{total}")
+        cursor = conn.execute(
+            'INSERT INTO broadcasts (text, created_by, total, report_chat_id, report_message_id) VALUES (?, ?, ?, ?, ?)',
+            (text, username, total, report_chat_id, report.message_id)
+        )
+        conn.commit()
+        broadcast_wakeup.set()
+        logger.info(f"Рассылка {cursor.lastrowid} от {username} создана: {total} чатов")
+        return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"Ошибка создания рассылки: {e}")
+        return None
+    finally:
+        conn.close()
+
+def stop_broadcasts():
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute("UPDATE broadcasts SET status = 'cancelled' WHERE status = 'running'")
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def save_broadcast_progress(conn, broadcast):
+    conn.execute(
+        'UPDATE broadcasts SET status = ?, last_chat_id = ?, sent = ?, blocked = ?, failed = ? WHERE id = ?',
+        (broadcast['status'], broadcast['last_chat_id'], broadcast['sent'], broadcast['blocked'], broadcast['failed'], broadcast['id'])
+    )
+    conn.commit()
+
+def report_broadcast_progress(broadcast):
+    done = broadcast['sent'] + broadcast['blocked'] + broadcast['failed']
+    title = {'done': "✅ Рассылка завершена", 'cancelled': "⛔ Рассылка остановлена"}.get(broadcast['status'], "📣 Рассылка")
+    text = (f"{title}: {done}/{broadcast['total']}\n\n"
+            f"Доставлено: {broadcast['sent']}\nЗаблокировали бота: {broadcast['blocked']}\nОшибки: {broadcast['failed']}")
+    try:
+        bot.edit_message_text(text, broadcast['report_chat_id'], broadcast['report_message_id'])
+    except Exception as e:
+        logger.error(f"Ошибка обновления отчета о рассылке {broadcast['id']}: {e}")
+
+def send_broadcast_message(chat_id, text):
+    """Отправка одного сообщения рассылки: 'sent', 'blocked' или 'failed'"""
+    for _ in range(3):
+        broadcast_limiter.acquire()
+        try:
+            bot.send_message(chat_id, text)
+            return 'sent'
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                time.sleep(retry_after)
+                continue
+            # Чат недоступен навсегда: бот заблокирован (403) или чата больше нет; прочие 400 - ошибки запроса
+            if e.error_code == 403 or (e.error_code == 400 and 'chat not found' in (e.description or '').lower()):
+                mark_chat_blocked(chat_id)
+                return 'blocked'
+            logger.error(f"Ошибка рассылки в чат {chat_id}: {e}")
+            return 'failed'
+        except Exception as e:
+            logger.error(f"Ошибка рассылки в чат {chat_id}: {e}")
+            return 'failed'
+    return 'failed'
+
+def run_broadcast(broadcast):
+    """Отправка рассылки с места остановки, с ограничением частоты"""
+    conn = get_db_connection()
+    try:
+        last_report = time.time()
+        while not lifecycle.draining:
+            status = conn.execute('SELECT status FROM broadcasts WHERE id = ?', (broadcast['id'],)).fetchone()[0]
+            if status != 'running':
+                broadcast['status'] = status
+                break
+            chat_ids = [row[0] for row in conn.execute(
+                'SELECT chat_id FROM chats WHERE chat_id > ? AND blocked = 0 ORDER BY chat_id LIMIT ?',
+                (broadcast['last_chat_id'], BROADCAST_PAGE_SIZE)
+            )]
+            if not chat_ids:
+                broadcast['status'] = 'done'
+                break
+            for chat_id in chat_ids:
+                if lifecycle.draining:
+                    break
+                broadcast[send_broadcast_message(chat_id, broadcast['text'])] += 1
+                broadcast['last_chat_id'] = chat_id
+                if time.time() - last_report >= BROADCAST_REPORT_INTERVAL:
+                    save_broadcast_progress(conn, broadcast)
+                    report_broadcast_progress(broadcast)
+                    last_report = time.time()
+        # При завершении процесса статус остается 'running' - рассылка продолжится после перезапуска
+        save_broadcast_progress(conn, broadcast)
+        report_broadcast_progress(broadcast)
+        logger.info(f"Рассылка {broadcast['id']}: {broadcast['status']}, доставлено {broadcast['sent']}, заблокировали {broadcast['blocked']}, ошибок {broadcast['failed']}")
+    finally:
+        conn.close()
+
+def next_broadcast():
+    """Первая незавершенная рассылка среди тенантов: (тенант, рассылка) или (None, None)"""
+    for tenant in all_tenants():
+        with use_tenant(tenant):
+            conn = get_db_connection()
+            try:
+                row = conn.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1").fetchone()
+            finally:
+                conn.close()
+        if row:
+            return tenant, dict(row)
+    return None, None
+
+def broadcast_worker():
+    """Фоновый поток рассылок: по одной за раз, в порядке создания"""
+    while not lifecycle.draining:
+        while not lifecycle.draining:
+            tenant, broadcast = next_broadcast()
+            if not broadcast:
+                break
+            try:
+                with use_tenant(tenant):
+                    run_broadcast(broadcast)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки {broadcast['id']} ({tenant.name}): {e}")
+                break
+        broadcast_wakeup.wait(60)
+        broadcast_wakeup.clear()
+
+# UI / клавиатуры
+def build_main_menu_keyboard(role):
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    buttons = [
+        types.KeyboardButton('📦 Кладовая'),
+        types.KeyboardButton('📅 События')
+    ]
+    # Добавляем кнопку управления админами только для главного админа
+    if role == 'main':
+        buttons.append(types.KeyboardButton('👑 Админы'))
+    keyboard.add(*buttons)
+    return keyboard
+
+def build_storage_selection_keyboard(role):
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    buttons = [types.KeyboardButton(f'📍 {storage}') for storage in current_tenant().storage_ids]
+    buttons.append(types.KeyboardButton('🔙 В главное меню'))
+    keyboard.add(*buttons)
+    return keyboard
+
+def build_storage_keyboard(role):
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    buttons = []
+    if role in ('admin', 'main'):
+        buttons.extend([
+            types.KeyboardButton('➕ Добавить предмет'),
+            types.KeyboardButton('➖ Удалить предмет'),
+            types.KeyboardButton('🎁 Выдать предмет'),
+            types.KeyboardButton('↩️ Вернуть предмет')
+        ])
+    buttons.append(types.KeyboardButton('🔙 Назад'))
+    keyboard.add(*buttons)
+    return keyboard
+
+def build_events_keyboard(role):
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    buttons = []
+    if role in ('admin', 'main'):
+        buttons.extend([
+            types.KeyboardButton('➕ Добавить событие'),
+            types.KeyboardButton('🗑️ Удалить событие'),
+            types.KeyboardButton('📌 Забронировать'),
+            types.KeyboardButton('📋 Брони')
+        ])
+    buttons.append(types.KeyboardButton('🔙 В главное меню'))
+    keyboard.add(*buttons)
+    return keyboard
+
+def build_admins_keyboard(role):
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    buttons = [
+        types.KeyboardButton('➕ Добавить админа'),
+        types.KeyboardButton('➖ Удалить админа'),
+        types.KeyboardButton('📋 Список админов'),
+        types.KeyboardButton('🔙 В главное меню')
+    ]
+    keyboard.add(*buttons)
+    return keyboard
+
+def build_cancel_keyboard(role):
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
+    keyboard.add(types.KeyboardButton('❌ Отмена'))
+    return keyboard
+
+KEYBOARD_BUILDERS = {
+    'main_menu': build_main_menu_keyboard,
+    'storage_selection': build_storage_selection_keyboard,
+    'storage': build_storage_keyboard,
+    'events': build_events_keyboard,
+    'admins': build_admins_keyboard,
+    'cancel': build_cancel_keyboard
+}
+
+def get_keyboard(screen, role=None):
+    """Готовая (сериализованная) клавиатура для экрана и роли, строится один раз"""
+    key = (screen, role, tuple(current_tenant().storage_ids))
+    markup = keyboard_cache.get(key)
+    if markup is None:
+        markup = KEYBOARD_BUILDERS[screen](role).to_json()
+        keyboard_cache[key] = markup
+    return markup
+
+def invalidate_keyboards():
+    """Сброс кэша ролей и клавиатур (при изменении админов или кладовых)"""
+    current_tenant().role_cache.clear()
+    keyboard_cache.clear()
+
+def create_main_menu_keyboard(chat_id, username=None):
+    return get_keyboard('main_menu', get_user_role(username))
+
+def create_storage_selection_keyboard(chat_id):
+    return get_keyboard('storage_selection')
+
+def create_storage_keyboard(chat_id, username=None):
+    return get_keyboard('storage', get_user_role(username))
+
+def create_events_keyboard(chat_id, username=None):
+    return get_keyboard('events', get_user_role(username))
+
+def create_admins_keyboard(chat_id):
+    return get_keyboard('admins')
+
+def encode_id(number):
+    """Компактная запись id строки для callback_data (base36)"""
+    if number == 0:
+        return '0'
+    digits = []
+    while number:
+        number, rest = divmod(number, 36)
+        digits.append(ID_ALPHABET[rest])
+    return ''.join(reversed(digits))
+
+def decode_id(text):
+    return int(text, 36)
+
+def get_picker_items(storage, action):
+    """Предметы, доступные для выбора в зависимости от действия"""
+    items = load_items(storage).sorted_items()
+    if action == 'i':
+        return [item for item in items if not item.issued]
+    if action == 'r':
+        return [item for item in items if item.issued]
+    return items
+
+def create_item_picker_keyboard(storage, action, selected, page=0):
+    """Инлайн-клавиатура множественного выбора предметов с постраничным выводом"""
+    items = get_picker_items(storage, action)
+    pages = max(1, (len(items) + PICKER_PAGE_SIZE - 1) // PICKER_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    for item in items[page * PICKER_PAGE_SIZE:(page + 1) * PICKER_PAGE_SIZE]:
+        mark = '☑️' if item.id in selected else '▫️'
+        title = item.item_name
+        if action == 'r' and item.owner:
+            title += f" ({item.owner})"
+        keyboard.add(types.InlineKeyboardButton(
+            f"{mark} {title}",
+            callback_data=f"pk:{action}:t:{encode_id(item.id)}"
+        ))
+    if pages > 1:
+        keyboard.row(
+            types.InlineKeyboardButton('◀️', callback_data=f"pk:{action}:p:{(page - 1) % pages}"),
+            types.InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"pk:{action}:n"),
+            types.InlineKeyboardButton('▶️', callback_data=f"pk:{action}:p:{(page + 1) % pages}")
+        )
+    keyboard.row(
+        types.InlineKeyboardButton(f"✅ Готово ({len(selected)})", callback_data=f"pk:{action}:ok"),
+        types.InlineKeyboardButton('❌ Отмена', callback_data=f"pk:{action}:x")
+    )
+    return keyboard
+
+def create_cancel_keyboard():
+    return get_keyboard('cancel')
+
+# Длинные списки: вывод частями по лимиту длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+def text_length(text):
+    """Длина текста так, как ее считает Telegram (в единицах UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def iter_message_chunks(lines, limit=MESSAGE_LIMIT):
+    """Склейка строк в сообщения не длиннее лимита; разрыв только между строками"""
+    chunk = []
+    size = 0
+    for line in lines:
+        # Строку длиннее лимита приходится резать (символ занимает не больше двух единиц UTF-16)
+        pieces = [line] if text_length(line) <= limit else [line[i:i + limit // 2] for i in range(0, len(line), limit // 2)]
+        for piece in pieces:
+            length = text_length(piece)
+            if chunk and size + 1 + length > limit:
+                yield '\n'.join(chunk)
+                chunk = []
+                size = 0
+            size += length + (1 if chunk else 0)
+            chunk.append(piece)
+    if chunk:
+        yield '\n'.join(chunk)
+
+def send_chunked(chat_id, lines, reply_markup=None):
+    """Отправка списка частями по мере форматирования строк; клавиатура - у последней части"""
+    previous = None
+    for chunk in iter_message_chunks(lines):
+        if not chunk.strip():
+            continue
+        if previous is not None:
+            bot.send_message(chat_id, previous)
+        previous = chunk
+    if previous is not None:
+        bot.send_message(chat_id, previous, reply_markup=reply_markup)
+
+def peek(rows):
+    """Первый элемент генератора и генератор со всеми элементами (None, если пусто)"""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return None
+    return itertools.chain([first], rows)
+
+def format_event_date(event_date):
+    try:
+        date_obj = datetime.strptime(event_date, '%Y-%m-%d')
+        return date_obj.strftime('%d %B %Y').replace(date_obj.strftime('%B'), MONTHS_RU[date_obj.month])
+    except ValueError:
+        return event_date
+
+# Функции отображения
+def format_due_date(due_at):
+    try:
+        return datetime.strptime(due_at, '%Y-%m-%d').strftime('%d.%m.%Y')
+    except ValueError:
+        return due_at
+
+def show_main_menu(chat_id, username=None):
+    admin_status = "👑 Режим админа активирован\n\n" if get_user_role(username) != 'user' else ""
+    text = f"{admin_status}📋 Главное меню\n\nВыберите раздел:"
+    bot.send_message(chat_id, text, reply_markup=create_main_menu_keyboard(chat_id, username))
+    user_states[chat_id] = 'main_menu'
+    user_selections.pop(chat_id, None)
+    user_item_lists.pop(chat_id, None)
+
+def show_storage_selection(chat_id):
+    text = "📦 Выберите кладовую:"
+    bot.send_message(chat_id, text, reply_markup=create_storage_selection_keyboard(chat_id))
+    user_states[chat_id] = 'storage_selection'
+    user_selections.pop(chat_id, None)
+    user_item_lists.pop(chat_id, None)
+
+def show_storage_menu(chat_id, storage, username=None, message_text=None):
+    if message_text:
+        bot.send_message(chat_id, message_text, reply_markup=create_storage_keyboard(chat_id, username))
+    else:
+        admin_status = " 👑" if get_user_role(username) != 'user' else ""
+        bot.send_message(chat_id, f"📦 Кладовая: {storage}{admin_status}\n\nВыберите действие:", reply_markup=create_storage_keyboard(chat_id, username))
+    user_states[chat_id] = ('storage', storage)
+    user_selections.pop(chat_id, None)
+    user_item_lists.pop(chat_id, None)
+
+def format_inventory_line(item, today):
+    if not item.issued:
+        return f"✅ {item.item_name}"
+    if item.due_at and item.due_at < today:
+        return f"⏰ {item.item_name} - выдано ({item.owner}), срок истек {format_due_date(item.due_at)}"
+    if item.due_at:
+        return f"🔸 {item.item_name} - выдано ({item.owner}) до {format_due_date(item.due_at)}"
+    return f"🔸 {item.item_name} - выдано ({item.owner})"
+
+def show_inventory(chat_id, storage, username=None):
+    if storage not in current_tenant().storage_ids:
+        bot.send_message(chat_id, "❌ Не удалось выбрать кладовую, попробуйте снова")
+        show_storage_selection(chat_id)
+        return
+        
+    items = load_items(storage)
+    header = [f"📦 ИНВЕНТАРЬ ({storage}):", ""]
+    if not items:
+        lines = header + ["📭 Пусто"]
+    else:
+        lines = itertools.chain(
+            header,
+            map(format_inventory_line, items.sorted_items(), itertools.repeat(datetime.now().strftime('%Y-%m-%d'))),
+            ["", f"📊 Статистика: {items.available_count} доступно, {items.issued_count} выдано"]
+        )
+        
+    send_chunked(chat_id, lines, reply_markup=create_storage_keyboard(chat_id, username))
+    user_states[chat_id] = ('storage', storage)
+    user_selections.pop(chat_id, None)
+    user_item_lists.pop(chat_id, None)
+
+def show_events_menu(chat_id, username=None, message_text=None):
+    if message_text:
+        bot.send_message(chat_id, message_text, reply_markup=create_events_keyboard(chat_id, username))
+    else:
+        admin_status = " 👑" if get_user_role(username) != 'user' else ""
+        text = f"📅 Управление событиями{admin_status}\n\nВыберите действие:"
+        bot.send_message(chat_id, text, reply_markup=create_events_keyboard(chat_id, username))
+    user_states[chat_id] = 'events_menu'
+    user_selections.pop(chat_id, None)
+    user_item_lists.pop(chat_id, None)
+
+def show_events_list(chat_id, username=None):
+    events = peek(iter_events())
+    if events is None:
+        bot.send_message(chat_id, "📅 Нет запланированных событий")
+        show_events_menu(chat_id, username)
+        return
+        
+    lines = itertools.chain(
+        [f"📅 Все события на {EVENTS_LIST_DAYS} дней вперед:", ""],
+        (f"• {format_event_date(event_date)} — {event_name}{' 🔁' if '@' in event_id else ''}" for event_id, event_name, event_date in events)
+    )
+    send_chunked(chat_id, lines, reply_markup=create_events_keyboard(chat_id, username))
+    user_states[chat_id] = 'events_menu'
+
+def show_admins_menu(chat_id, username=None, message_text=None):
+    """Показать меню управления администраторами"""
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может управлять админами.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message_text:
+        bot.send_message(chat_id, message_text, reply_markup=create_admins_keyboard(chat_id))
+    else:
+        text = "👑 Управление администраторами\n\nВыберите действие:"
+        bot.send_message(chat_id, text, reply_markup=create_admins_keyboard(chat_id))
+    user_states[chat_id] = 'admins_menu'
+    user_selections.pop(chat_id, None)
+    user_item_lists.pop(chat_id, None)
+
+def show_admins_list(chat_id, username=None):
+    """Показать список администраторов"""
+    admins = get_all_admins()
+    if not admins:
+        bot.send_message(chat_id, "📭 Нет добавленных администраторов")
+        show_admins_menu(chat_id, username)
+        return
+        
+    lines = itertools.chain(
+        ["👑 Список администраторов:", ""],
+        (f"{i}. @{admin['username']}{' (главный)' if admin['is_main_admin'] else ''}" for i, admin in enumerate(admins, 1))
+    )
+    send_chunked(chat_id, lines, reply_markup=create_admins_keyboard(chat_id))
+
+# Обработчики сообщений
+@bot.message_handler(commands=['start'])
+def start(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    
+    welcome_text = "👋 Добро пожаловать в систему управления инвентарем и событиями!\n\n"
+    welcome_text += "📋 Доступные разделы:\n"
+    welcome_text += "• 📦 Кладовая - управление инвентарем\n"
+    welcome_text += "• 📅 События - управление мероприятиями\n\n"
+    
+    role = get_user_role(username)
+    if role != 'user':
+        welcome_text += "👑 Режим админа активирован\n"
+        if role == 'main':
+            welcome_text += "• 👑 Админы - управление администраторами\n\n"
+    else:
+        welcome_text += "💡 Для доступа к функциям управления обратитесь к администратору"
+    welcome_text += "\nВыберите нужный раздел в меню ниже 👇"
+    
+    bot.send_message(chat_id, welcome_text, reply_markup=create_main_menu_keyboard(chat_id, username))
+    user_states[chat_id] = 'main_menu'
+    user_selections.pop(chat_id, None)
+    user_item_lists.pop(chat_id, None)
+
+RESTORE_TIME_FORMATS = ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M')
+
+def parse_restore_time(text):
+    for time_format in RESTORE_TIME_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), time_format)
+        except ValueError:
+            continue
+    return None
+
+@bot.message_handler(commands=['restore'])
+def handle_restore(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может восстанавливать базу.")
+        return
+        
+    parts = message.text.split(maxsplit=1)
+    if len(parts) == 1:
+        show_backups_for_restore(chat_id)
+        return
+    target = parse_restore_time(parts[1])
+    if not target:
+        bot.send_message(chat_id, "🕓 Укажите момент восстановления: /restore ДД.ММ.ГГГГ ЧЧ:ММ[:СС] (например, /restore 25.12.2024 18:30) или /restore без параметров для выбора снимка")
+        return
+        
+    try:
+        result = restore_to_time(target.timestamp())
+    except Exception as e:
+        logger.error(f"Ошибка восстановления базы на {target}: {e}")
+        result = None
+    if result:
+        filename, replayed = result
+        bot.send_message(chat_id, f"✅ База восстановлена на {target.strftime('%d.%m.%Y %H:%M:%S')}\n\nБазовый снимок: {filename}\nПовторено изменений: {replayed}")
+    else:
+        bot.send_message(chat_id, "❌ Не удалось восстановить базу: нет подходящего снимка на это время")
+    show_main_menu(chat_id, username)
+
+def show_backups_for_restore(chat_id, limit=10):
+    """Список последних снимков для восстановления"""
+    manifest = load_backup_manifest()
+    snapshots = sorted(
+        ((entry.get('created_at', 0), filename, entry) for filename, entry in manifest.items()
+         if os.path.exists(os.path.join(current_tenant().backup_dir, filename))),
+        reverse=True
+    )[:limit]
+    if not snapshots:
+        bot.send_message(chat_id, "📭 Нет снимков для восстановления")
+        return
+        
+    text = "🗄️ Снимки базы:\n\n"
+    snapshot_dict = {}
+    for i, (created_at, filename, entry) in enumerate(snapshots, 1):
+        if entry.get('verified') is None:
+            status = '❔'
+        else:
+            status = '✅' if entry['verified'] else '⚠️'
+        created = datetime.fromtimestamp(created_at).strftime('%d.%m.%Y %H:%M:%S')
+        text += f"{i}. {status} {created} — {entry.get('reason', '')} ({entry.get('size', 0)} bytes)\n"
+        snapshot_dict[str(i)] = filename
+    text += "\n✅ проверен, ⚠️ поврежден, ❔ не проверялся\n\nВведите номер снимка для восстановления или '❌ Отмена':"
+    
+    user_selections[chat_id] = snapshot_dict
+    user_states[chat_id] = 'restoring_backup'
+    bot.send_message(chat_id, text, reply_markup=create_cancel_keyboard())
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'restoring_backup')
+def handle_restoring_backup(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может восстанавливать базу.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Восстановление отменено")
+        show_main_menu(chat_id, username)
+        return
+        
+    filename = user_selections.get(chat_id, {}).get(message.text.strip())
+    if not filename:
+        bot.send_message(chat_id, "❌ Неверно указан номер снимка. Попробуйте еще раз:")
+        return
+        
+    try:
+        error = restore_snapshot(filename)
+    except Exception as e:
+        logger.error(f"Ошибка восстановления из снимка {filename}: {e}")
+        error = str(e)
+    if error:
+        bot.send_message(chat_id, f"❌ Снимок {filename} не восстановлен: {error}")
+    else:
+        bot.send_message(chat_id, f"✅ База восстановлена из снимка {filename}")
+    show_main_menu(chat_id, username)
+
+def build_stats_text():
+    """Текст статистики из счетчиков в памяти (без обхода предметов)"""
+    stats = current_tenant().stats.snapshot()
+    text = "📊 Статистика инвентаря\n\n"
+    text += f"Всего: {stats['available'] + stats['issued']} (✅ {stats['available']} доступно, 🔸 {stats['issued']} выдано)\n\n"
+    for storage_id, (available, issued) in sorted(stats['storages'].items()):
+        text += f"📦 {current_tenant().reverse_storage_ids.get(storage_id, storage_id)}: ✅ {available}, 🔸 {issued}\n"
+    if stats['owners']:
+        text += "\n👤 У кого предметы:\n"
+        top_owners = sorted(stats['owners'].items(), key=lambda x: -x[1])[:10]
+        text += "\n".join(f"• {owner}: {count}" for owner, count in top_owners) + "\n"
+    labels = {'added': 'добавлено', 'deleted': 'удалено', 'issued': 'выдано', 'returned': 'возвращено'}
+    for title, window in (("7 дней", stats['week']), (f"{USAGE_WINDOW_DAYS} дней", stats['month'])):
+        text += f"\n📈 За {title}: " + ", ".join(f"{labels[field]} {window[field]}" for field in USAGE_FIELDS)
+    return text
+
+@bot.message_handler(commands=['stats'])
+def handle_stats(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут смотреть статистику.")
+        return
+    bot.send_message(chat_id, build_stats_text())
+
+@bot.message_handler(commands=['dbstats'])
+def handle_dbstats(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может смотреть статистику базы.")
+        return
+        
+    parts = message.text.split(maxsplit=1)
+    if len(parts) > 1 and parts[1].strip().lower() == 'reset':
+        query_stats.reset()
+        bot.send_message(chat_id, "🧹 Статистика запросов сброшена")
+        return
+        
+    top = query_stats.top()
+    if not top:
+        bot.send_message(chat_id, "📭 Запросов еще не было")
+        return
+    since = datetime.fromtimestamp(query_stats.since).strftime('%d.%m.%Y %H:%M')
+    lines = [f"🗄️ Запросы к базе с {since} (по суммарному времени):", ""]
+    for i, (sql, entry) in enumerate(top, 1):
+        avg_ms = entry['total'] / entry['count'] * 1000
+        lines.append(f"{i}. {entry['count']}× ср. {avg_ms:.2f} мс, макс. {entry['max'] * 1000:.1f} мс, всего {entry['total'] * 1000:.0f} мс"
+                     + (f", медленных: {entry['slow']}" if entry['slow'] else ""))
+        lines.append(f"   {sql[:200]}")
+        if entry['plan']:
+            lines.append(f"   план: {entry['plan']}")
+    lines.extend(["", f"Порог медленного запроса: {DB_SLOW_QUERY_SECONDS * 1000:.0f} мс. /dbstats reset — сбросить"])
+    send_chunked(chat_id, lines)
+
+@bot.message_handler(commands=['jobs'])
+def handle_jobs(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может смотреть фоновые задачи.")
+        return
+        
+    lines = ["⏱️ Фоновые задачи:", ""]
+    for job in scheduler.stats():
+        status = "▶️" if job['running'] else "⏸️"
+        lines.append(f"{status} {job['name']} ({job['schedule']}), следующий запуск {datetime.fromtimestamp(job['next_run']).strftime('%d.%m %H:%M:%S')}")
+        if job['runs']:
+            lines.append(f"   запусков {job['runs']}, ср. {job['avg_duration'] * 1000:.0f} мс, макс. {job['max_duration'] * 1000:.0f} мс, "
+                         f"опоздание {job['last_lag'] * 1000:.0f} мс (макс. {job['max_lag'] * 1000:.0f} мс)"
+                         + (f", пропущено {job['skipped']}" if job['skipped'] else "")
+                         + (f", ошибок {job['errors']}" if job['errors'] else ""))
+    send_chunked(chat_id, lines)
+
+@bot.message_handler(commands=['overdue'])
+def handle_overdue(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут смотреть просрочки.")
+        return
+    bot.send_message(chat_id, build_overdue_report() or "✅ Просроченных предметов нет")
+
+@bot.message_handler(commands=['free'])
+def handle_free(message):
+    """Свободные предметы на дату: /free 01.05.2030 (по умолчанию - сегодня)"""
+    chat_id = message.chat.id
+    parts = message.text.split(maxsplit=1)
+    try:
+        day = datetime.strptime(parts[1].strip(), '%d.%m.%Y').date() if len(parts) > 1 else datetime.now().date()
+    except ValueError:
+        bot.send_message(chat_id, "❌ Неверный формат даты. Используйте /free ДД.ММ.ГГГГ (например, /free 25.12.2024)")
+        return
+        
+    lines = [f"📆 Свободно на {format_event_date(day.isoformat())}:"]
+    for storage, items in get_free_items(day.isoformat()).items():
+        lines.extend(["", f"📦 {storage}: {len(items)}"])
+        lines.extend(f"✅ {item.item_name}" for item in items)
+    send_chunked(chat_id, lines)
+
+@bot.message_handler(commands=['broadcast'])
+def handle_broadcast(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут делать рассылки.")
+        return
+        
+    parts = message.text.split(maxsplit=1)
+    if len(parts) > 1 and parts[1].strip().lower() == 'stop':
+        stopped = stop_broadcasts()
+        bot.send_message(chat_id, f"⛔ Остановлено рассылок: {stopped}" if stopped else "📭 Нет активных рассылок")
+        return
+        
+    bot.send_message(chat_id, "📣 Введите текст рассылки для всех чатов или нажмите '❌ Отмена':", reply_markup=create_cancel_keyboard())
+    user_states[chat_id] = 'broadcast_text'
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'broadcast_text')
+def handle_broadcast_text(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут делать рассылки.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Рассылка отменена")
+        show_main_menu(chat_id, username)
+        return
+        
+    if not start_broadcast(message.text, username, chat_id):
+        bot.send_message(chat_id, "❌ Ошибка при создании рассылки")
+    show_main_menu(chat_id, username)
+
+BATCH_HELP = (
+    "📋 Введите пакет команд, каждая с новой строки, или нажмите '❌ Отмена':\n\n"
+    "Гринбокс 11\n"
+    "добавить Стол\n"
+    "выдать Проектор -> @ivan до 25.12.2030\n"
+    "вернуть Палатка\n"
+    "удалить Сломанный стул\n\n"
+    "Строка с названием кладовой выбирает кладовую для следующих строк; для выдачи, возврата и удаления "
+    "ее можно не указывать, если предмет есть только в одной кладовой. Пакет применяется целиком или не применяется вовсе."
+)
+
+@bot.message_handler(commands=['batch'])
+def handle_batch(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут выполнять пакетные команды.")
+        return
+        
+    parts = message.text.split(maxsplit=1)
+    if len(parts) > 1:
+        send_chunked(chat_id, run_batch(parts[1]))
+        return
+    bot.send_message(chat_id, BATCH_HELP, reply_markup=create_cancel_keyboard())
+    user_states[chat_id] = 'batch_commands'
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'batch_commands')
+def handle_batch_commands(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут выполнять пакетные команды.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Пакет отменен")
+        show_main_menu(chat_id, username)
+        return
+        
+    send_chunked(chat_id, run_batch(message.text))
+    show_main_menu(chat_id, username)
+
+# Обработчик секретного слова для главного админа
+@bot.message_handler(func=lambda message: normalize_text(message.text) == normalize_text(current_tenant().secret_word))
+def handle_secret_word(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    
+    # Проверяем, есть ли уже главный админ
+    main_admin = get_main_admin()
+    
+    if main_admin:
+        if username and main_admin['username'].lower() == username.lower():
+            bot.send_message(chat_id, "👑 Вы уже являетесь главным администратором.")
+        else:
+            bot.send_message(chat_id, "❌ Главный администратор уже назначен. Обратитесь к нему для получения прав.")
+        return
+    
+    # Если главного админа нет, создаем его
+    if not username:
+        bot.send_message(chat_id, "❌ У вас не установлен username в Telegram. Пожалуйста, установите username в настройках Telegram и попробуйте снова.")
+        return
+        
+    if add_admin(username, is_main=True):
+        bot.send_message(chat_id, "👑 Вы стали главным администратором! Теперь вам доступны все функции управления, включая управление администраторами.")
+        show_main_menu(chat_id, username)
+    else:
+        bot.send_message(chat_id, "❌ Ошибка при назначении главного администратора.")
+
+# Основные обработчики кнопок
+@bot.message_handler(func=lambda message: message.text == '🔙 В главное меню')
+def back_to_main_menu(message):
+    username = message.from_user.username
+    show_main_menu(message.chat.id, username)
+
+@bot.message_handler(func=lambda message: message.text == '📦 Кладовая')
+def handle_storage(message):
+    show_storage_selection(message.chat.id)
+
+@bot.message_handler(func=lambda message: message.text == '📅 События')
+def handle_events(message):
+    username = message.from_user.username
+    show_events_list(message.chat.id, username)
+
+@bot.message_handler(func=lambda message: message.text == '👑 Админы')
+def handle_admins(message):
+    username = message.from_user.username
+    show_admins_menu(message.chat.id, username)
+
+@bot.message_handler(func=lambda message: message.text == '🔙 Назад')
+def back_to_storage_selection(message):
+    show_storage_selection(message.chat.id)
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'storage_selection')
+def handle_storage_selection(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    storage = message.text.replace('📍 ', '').strip()
+    
+    if storage in current_tenant().storage_ids:
+        show_inventory(chat_id, storage, username)
+    elif message.text == '🔙 В главное меню':
+        show_main_menu(chat_id, username)
+    else:
+        bot.send_message(chat_id, "❌ Не удалось выбрать кладовую, используйте кнопки меню")
+        show_storage_selection(chat_id)
+
+@bot.message_handler(func=lambda message: isinstance(user_states.get(message.chat.id), tuple) and user_states.get(message.chat.id)[0] == 'storage')
+def handle_storage_actions(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    state_data = user_states[chat_id]
+    if len(state_data) >= 2:
+        storage = state_data[1]
+    else:
+        bot.send_message(chat_id, "❌ Ошибка состояния, выберите кладовую снова")
+        show_storage_selection(chat_id)
+        return
+        
+    if message.text == '➕ Добавить предмет':
+        if not username or not is_admin_by_username(username):
+            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут добавлять предметы.")
+            return
+        bot.send_message(chat_id, "📝 Введите названия предметов для добавления (каждый предмет с новой строки) или нажмите '❌ Отмена':", reply_markup=create_cancel_keyboard())
+        user_states[chat_id] = ('adding_item', storage)
+    elif message.text == '➖ Удалить предмет':
+        if not username or not is_admin_by_username(username):
+            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут удалять предметы.")
+            return
+        show_item_picker(chat_id, storage, 'd', "🗑️ Отметьте предметы для удаления или введите их названия (каждый предмет с новой строки), '❌ Отмена' — выход:", username)
+    elif message.text == '🎁 Выдать предмет':
+        if not username or not is_admin_by_username(username):
+            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут выдавать предметы.")
+            return
+        if not get_picker_items(storage, 'i'):
+            bot.send_message(chat_id, "📭 Нет доступных предметов для выдачи")
+            return
+        bot.send_message(chat_id, f"👤 Введите, кому выдать предметы (срок можно указать: «Иван до 25.12.2030», по умолчанию {LOAN_DAYS} дней), или нажмите '❌ Отмена':", reply_markup=create_cancel_keyboard())
+        user_states[chat_id] = ('issuing_owner', storage)
+    elif message.text == '↩️ Вернуть предмет':
+        if not username or not is_admin_by_username(username):
+            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут возвращать предметы.")
+            return
+        show_item_picker(chat_id, storage, 'r', "↩️ Отметьте предметы для возврата или введите их названия (каждый предмет с новой строки), '❌ Отмена' — выход:", username)
+    elif message.text == '🔙 Назад':
+        show_storage_selection(chat_id)
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'events_menu')
+def handle_events_actions(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if message.text == '➕ Добавить событие':
+        if not username or not is_admin_by_username(username):
+            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут добавлять события.")
+            return
+        bot.send_message(chat_id, "📝 Введите название события или '❌ Отмена':", reply_markup=create_cancel_keyboard())
+        user_states[chat_id] = 'adding_event_name'
+    elif message.text == '🗑️ Удалить событие':
+        if not username or not is_admin_by_username(username):
+            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут удалять события.")
+            return
+        show_events_list_for_deletion(chat_id, username)
+    elif message.text in ('📌 Забронировать', '📋 Брони'):
+        if not username or not is_admin_by_username(username):
+            bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут бронировать предметы.")
+            return
+        if message.text == '📌 Забронировать':
+            show_events_list_for_reservation(chat_id, username)
+        else:
+            show_reservations_list(chat_id, username)
+    elif message.text == '🔙 В главное меню':
+        show_main_menu(chat_id, username)
+
+def show_events_list_for_deletion(chat_id, username=None):
+    events = peek(iter_events())
+    if events is None:
+        bot.send_message(chat_id, "📅 Нет событий для удаления")
+        show_events_menu(chat_id, username)
+        return
+        
+    # Номера заполняются по мере вывода строк
+    event_dict = {}
+    def numbered_lines():
+        for i, (event_id, event_name, event_date) in enumerate(events, 1):
+            event_dict[str(i)] = event_id
+            yield f"{i}. {format_event_date(event_date)} — {event_name}{' 🔁' if '@' in event_id else ''}"
+            
+    lines = itertools.chain(
+        ["🗑️ Выберите события для удаления:", ""],
+        numbered_lines(),
+        ["", "Введите номера событий для удаления через запятую (например: 1,3,5) или '❌ Отмена'.",
+         "🔁 Для повторяющегося события номер удаляет одно повторение, номер со звездочкой (например, 2*) — всю серию."]
+    )
+    user_selections[chat_id] = event_dict
+    user_states[chat_id] = 'deleting_event'
+    send_chunked(chat_id, lines, reply_markup=create_cancel_keyboard())
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'admins_menu')
+def handle_admins_actions(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может управлять админами.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '➕ Добавить админа':
+        bot.send_message(chat_id, "👤 Введите username нового администратора (например, @username или просто username):", reply_markup=create_cancel_keyboard())
+        user_states[chat_id] = 'adding_admin'
+    elif message.text == '➖ Удалить админа':
+        admins = get_all_admins()
+        if not admins:
+            bot.send_message(chat_id, "📭 Нет администраторов для удаления")
+            return
+            
+        text = "🗑️ Список администраторов для удаления:\n\n"
+        for i, admin in enumerate(admins, 1):
+            status = " (главный)" if admin['is_main_admin'] else ""
+            text += f"{i}. @{admin['username']}{status}\n"
+        text += "\nВведите username администратора для удаления (например, @username или просто username):"
+        bot.send_message(chat_id, text, reply_markup=create_cancel_keyboard())
+        user_states[chat_id] = 'removing_admin'
+    elif message.text == '📋 Список админов':
+        show_admins_list(chat_id, username)
+    elif message.text == '🔙 В главное меню':
+        show_main_menu(chat_id, username)
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'adding_admin')
+def handle_adding_admin(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может добавлять админов.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Добавление администратора отменено")
+        show_admins_menu(chat_id, username)
+        return
+        
+    new_username = message.text.strip()
+    if not new_username:
+        bot.send_message(chat_id, "❌ Username не может быть пустым. Попробуйте еще раз:")
+        return
+        
+    if add_admin(new_username):
+        bot.send_message(chat_id, f"✅ Администратор @{new_username.lstrip('@')} добавлен. Теперь он имеет права администратора.")
+    else:
+        bot.send_message(chat_id, f"❌ Ошибка при добавлении администратора @{new_username.lstrip('@')}. Возможно, такой администратор уже существует.")
+    show_admins_menu(chat_id, username)
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'removing_admin')
+def handle_removing_admin(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_main_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только главный администратор может удалять админов.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Удаление администратора отменено")
+        show_admins_menu(chat_id, username)
+        return
+        
+    remove_username = message.text.strip()
+    if not remove_username:
+        bot.send_message(chat_id, "❌ Username не может быть пустым. Попробуйте еще раз:")
+        return
+        
+    if remove_admin(remove_username):
+        bot.send_message(chat_id, f"✅ Администратор @{remove_username.lstrip('@')} удален")
+    else:
+        bot.send_message(chat_id, f"❌ Ошибка при удалении администратора @{remove_username.lstrip('@')} или администратор не найден (главного админа нельзя удалить)")
+    show_admins_menu(chat_id, username)
+
+# Обработчики состояний
+@bot.message_handler(func=lambda message: isinstance(user_states.get(message.chat.id), tuple) and user_states.get(message.chat.id)[0] == 'adding_item')
+def handle_adding_item(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    state_data = user_states[chat_id]
+    storage = state_data[1]
+    
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Добавление предметов отменено")
+        show_storage_menu(chat_id, storage, username)
+        return
+        
+    item_names = [name.strip() for name in message.text.split('\n') if name.strip()]
+    added_items = []
+    
+    for item_name in item_names:
+        result = add_item(item_name, storage)
+        if result:
+            added_items.append(result)
+            
+    if added_items:
+        text = f"✅ Добавлено предметов: {len(added_items)}\n\n"
+        text += "\n".join(f"• {item}" for item in added_items)
+    else:
+        text = "❌ Не удалось добавить предметы (возможно, они уже существуют)"
+        
+    show_storage_menu(chat_id, storage, username, text)
+
+def show_item_picker(chat_id, storage, action, prompt, username=None, owner=None, due_date=None):
+    """Показать инлайн-выбор предметов для выдачи, возврата или удаления"""
+    if not get_picker_items(storage, action):
+        show_storage_menu(chat_id, storage, username, "📭 Нет подходящих предметов")
+        return
+    bot.send_message(chat_id, prompt, reply_markup=create_cancel_keyboard())
+    picker_message = bot.send_message(
+        chat_id,
+        "Отметьте предметы и нажмите «✅ Готово»:",
+        reply_markup=create_item_picker_keyboard(storage, action, set())
+    )
+    user_states[chat_id] = (PICKER_ACTIONS[action], storage)
+    user_selections[chat_id] = {
+        'action': action,
+        'selected': set(),
+        'page': 0,
+        'message_id': picker_message.message_id,
+        'owner': owner,
+        'due_date': due_date
+    }
+
+def close_item_picker(chat_id, text):
+    """Убрать инлайн-клавиатуру выбора, заменив ее текстом"""
+    selection = user_selections.pop(chat_id, None)
+    if not isinstance(selection, dict) or not selection.get('message_id'):
+        return
+    try:
+        bot.edit_message_text(text, chat_id, selection['message_id'])
+    except Exception as e:
+        logger.error(f"Ошибка закрытия выбора предметов для {chat_id}: {e}")
+
+def apply_item_action(action, item_names, storage, owner=None, due_date=None):
+    """Применение действия к выбранным предметам, возвращает текст результата"""
+    if action == 'i':
+        done_items = update_items_owner(item_names, owner, storage, due_date)
+        if done_items:
+            due = due_date or datetime.now() + timedelta(days=LOAN_DAYS)
+            warnings = issue_warnings(done_items, storage, due_date)
+            return (f"✅ Выдано предметов ({owner}, до {due.strftime('%d.%m.%Y')}): {len(done_items)}\n\n"
+                    + "\n".join(f"• {item}" for item in done_items)
+                    + ("\n\n" + "\n".join(warnings) if warnings else ""))
+        return "❌ Не удалось выдать предметы (возможно, они не найдены)"
+    if action == 'r':
+        done_items = return_items(item_names, storage)
+        if done_items:
+            return f"✅ Возвращено предметов: {len(done_items)}\n\n" + "\n".join(f"• {item}" for item in done_items)
+        return "❌ Не удалось вернуть предметы (возможно, они не были выданы)"
+    done_items = delete_items(item_names, storage)
+    if done_items:
+        return f"✅ Удалено предметов: {len(done_items)}\n\n" + "\n".join(f"• {item}" for item in done_items)
+    return "❌ Не удалось удалить предметы (возможно, они не найдены)"
+
+@bot.message_handler(func=lambda message: isinstance(user_states.get(message.chat.id), tuple) and user_states.get(message.chat.id)[0] == 'issuing_owner')
+def handle_issuing_owner(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    storage = user_states[chat_id][1]
+    
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Выдача предметов отменена")
+        show_storage_menu(chat_id, storage, username)
+        return
+        
+    try:
+        owner, due_date = parse_owner_due(message.text)
+    except ValueError as e:
+        bot.send_message(chat_id, f"❌ Срок не принят: {e}. Пример: Иван до 25.12.2030")
+        return
+    if not owner:
+        bot.send_message(chat_id, "❌ Получатель не может быть пустым. Попробуйте еще раз:")
+        return
+        
+    show_item_picker(chat_id, storage, 'i', f"🎁 Выдача для {owner}. Отметьте предметы или введите их названия (каждый предмет с новой строки), '❌ Отмена' — выход:", username, owner, due_date)
+
+@bot.message_handler(func=lambda message: isinstance(user_states.get(message.chat.id), tuple) and user_states.get(message.chat.id)[0] in PICKER_ACTIONS.values())
+def handle_item_selection_text(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    state, storage = user_states[chat_id]
+    selection = user_selections.get(chat_id)
+    if not isinstance(selection, dict):
+        selection = {'action': PICKER_STATES[state], 'owner': None}
+    
+    if message.text == '❌ Отмена':
+        close_item_picker(chat_id, "❌ Выбор отменен")
+        bot.send_message(chat_id, "❌ Действие отменено")
+        show_storage_menu(chat_id, storage, username)
+        return
+        
+    item_names = resolve_item_names([name.strip() for name in message.text.split('\n') if name.strip()], storage)
+    text = apply_item_action(selection['action'], item_names, storage, selection.get('owner'), selection.get('due_date'))
+    close_item_picker(chat_id, "✏️ Предметы введены вручную")
+    show_storage_menu(chat_id, storage, username, text)
+
+@bot.callback_query_handler(func=lambda call: call.data and call.data.startswith('pk:'))
+def handle_item_picker(call):
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    username = call.from_user.username
+    parts = call.data.split(':')
+    action, op = parts[1], parts[2]
+    state_data = user_states.get(chat_id)
+    selection = user_selections.get(chat_id)
+    
+    if (not isinstance(state_data, tuple) or state_data[0] != PICKER_ACTIONS.get(action)
+            or not isinstance(selection, dict) or selection.get('message_id') != message_id):
+        bot.answer_callback_query(call.id, "⌛ Выбор устарел")
+        return
+    if not username or not is_admin_by_username(username):
+        bot.answer_callback_query(call.id, "❌ Недостаточно прав")
+        return
+        
+    storage = state_data[1]
+    if op == 't':
+        row_id = decode_id(parts[3])
+        selection['selected'] ^= {row_id}
+    elif op == 'p':
+        selection['page'] = int(parts[3])
+    elif op == 'x':
+        bot.answer_callback_query(call.id)
+        close_item_picker(chat_id, "❌ Выбор отменен")
+        show_storage_menu(chat_id, storage, username)
+        return
+    elif op == 'ok':
+        if not selection['selected']:
+            bot.answer_callback_query(call.id, "Ничего не выбрано")
+            return
+        bot.answer_callback_query(call.id)
+        item_names = [item.item_name for item in get_items_by_row_ids(storage, selection['selected'])]
+        text = apply_item_action(action, item_names, storage, selection.get('owner'), selection.get('due_date'))
+        close_item_picker(chat_id, f"✅ Выбрано предметов: {len(item_names)}")
+        show_storage_menu(chat_id, storage, username, text)
+        return
+    else:
+        bot.answer_callback_query(call.id)
+        return
+        
+    bot.answer_callback_query(call.id)
+    bot.edit_message_reply_markup(
+        chat_id, message_id,
+        reply_markup=create_item_picker_keyboard(storage, action, selection['selected'], selection['page'])
+    )
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'adding_event_name')
+def handle_adding_event_name(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Добавление события отменено")
+        show_events_menu(chat_id, username)
+        return
+        
+    user_selections[chat_id] = {'event_name': message.text}
+    bot.send_message(chat_id, "📅 Введите дату события в формате ДД.ММ.ГГГГ (например, 25.12.2024) или '❌ Отмена'.\n\n🔁 Повторяющееся событие: «25.12.2024 каждую неделю» (каждый день / каждую неделю / каждый месяц), окончание — «... до 01.06.2025»", reply_markup=create_cancel_keyboard())
+    user_states[chat_id] = 'adding_event_date'
+
+def parse_event_date_input(text):
+    """Дата события и необязательное повторение: «25.12.2024 каждую неделю до 01.06.2025»"""
+    match = re.match(r'^(\d{1,2}\.\d{1,2}\.\d{4})(.*?)(?:\s+до\s+(\d{1,2}\.\d{1,2}\.\d{4}))?$', text.strip())
+    if not match:
+        raise ValueError(text)
+    date_obj = datetime.strptime(match.group(1), '%d.%m.%Y')
+    freq = None
+    if match.group(2).strip():
+        freq = RECURRENCE_WORDS.get(normalize_text(match.group(2)))
+        if not freq:
+            raise ValueError(text)
+    until = datetime.strptime(match.group(3), '%d.%m.%Y') if match.group(3) else None
+    if until and (not freq or until < date_obj):
+        raise ValueError(text)
+    return date_obj, freq, until
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'adding_event_date')
+def handle_adding_event_date(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Добавление события отменено")
+        show_events_menu(chat_id, username)
+        return
+        
+    try:
+        date_obj, freq, until = parse_event_date_input(message.text)
+        event_date = date_obj.strftime('%Y-%m-%d')
+        event_name = user_selections[chat_id]['event_name']
+        formatted_date = format_event_date(event_date)
+        
+        if freq:
+            until_date = until.strftime('%Y-%m-%d') if until else None
+            if add_event_rule(event_name, event_date, freq, until_date):
+                period_text = f"до {format_event_date(until_date)}" if until_date else "без окончания"
+                bot.send_message(chat_id, f"✅ Повторяющееся событие '{event_name}' ({RECURRENCE_TITLES[freq]} с {formatted_date}, {period_text}) добавлено")
+            else:
+                bot.send_message(chat_id, "❌ Ошибка при добавлении события")
+        elif add_event(event_name, event_date):
+            bot.send_message(chat_id, f"✅ Событие '{event_name}' на {formatted_date} добавлено")
+        else:
+            bot.send_message(chat_id, "❌ Ошибка при добавлении события")
+            
+    except ValueError:
+        bot.send_message(chat_id, "❌ Неверный формат даты. Используйте формат ДД.ММ.ГГГГ (например, 25.12.2024 или 25.12.2024 каждую неделю до 01.06.2025)")
+        return
+        
+    show_events_menu(chat_id, username)
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'deleting_event')
+def handle_deleting_event(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Удаление событий отменено")
+        show_events_menu(chat_id, username)
+        return
+        
+    event_dict = user_selections.get(chat_id, {})
+    numbers = [num.strip() for num in message.text.split(',')]
+    event_ids_to_delete = []
+    
+    for num in numbers:
+        # «2*» - вся серия повторяющегося события
+        whole_series = num.endswith('*')
+        num = num.rstrip('*').strip()
+        if num in event_dict:
+            event_id = event_dict[num]
+            event_ids_to_delete.append(event_id.split('@', 1)[0] if whole_series else event_id)
+            
+    if event_ids_to_delete:
+        deleted_events = delete_event(event_ids_to_delete)
+        if deleted_events:
+            text = f"✅ Удалено событий: {len(deleted_events)}\n\n"
+            text += "\n".join(f"• {event}" for event in deleted_events)
+        else:
+            text = "❌ Не удалось удалить события"
+    else:
+        text = "❌ Неверно указаны номера событий"
+        
+    show_events_menu(chat_id, username, text)
+
+RESERVATION_HELP = (
+    "Введите предметы, каждый с новой строки («Палатка» или «Гринбокс 11: Палатка», если название есть в нескольких кладовых).\n"
+    "Последней строкой можно указать период брони: «01.05.2030 - 03.05.2030» (по умолчанию — день события).\n"
+    "'❌ Отмена' — выход."
+)
+
+def show_events_list_for_reservation(chat_id, username=None):
+    events = peek(iter_events('month'))
+    if events is None:
+        bot.send_message(chat_id, "📅 Нет событий в ближайший месяц")
+        show_events_menu(chat_id, username)
+        return
+        
+    event_dict = {}
+    def numbered_lines():
+        for i, (event_id, event_name, event_date) in enumerate(events, 1):
+            event_dict[str(i)] = (event_id, event_name, event_date)
+            yield f"{i}. {format_event_date(event_date)} — {event_name}{' 🔁' if '@' in event_id else ''}"
+            
+    lines = itertools.chain(
+        ["📌 Выберите событие для брони:", ""],
+        numbered_lines(),
+        ["", "Введите номер события или '❌ Отмена'."]
+    )
+    user_selections[chat_id] = event_dict
+    user_states[chat_id] = 'reserving_event'
+    send_chunked(chat_id, lines, reply_markup=create_cancel_keyboard())
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'reserving_event')
+def handle_reserving_event(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Бронирование отменено")
+        show_events_menu(chat_id, username)
+        return
+        
+    event = user_selections.get(chat_id, {}).get(message.text.strip())
+    if not event:
+        bot.send_message(chat_id, "❌ Неверный номер события. Попробуйте еще раз:")
+        return
+    user_selections[chat_id] = {'event': event}
+    bot.send_message(chat_id, f"📌 Бронь под «{event[1]}» ({format_event_date(event[2])}).\n\n{RESERVATION_HELP}", reply_markup=create_cancel_keyboard())
+    user_states[chat_id] = 'reserving_items'
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'reserving_items')
+def handle_reserving_items(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут бронировать предметы.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '❌ Отмена':
+        bot.send_message(chat_id, "❌ Бронирование отменено")
+        show_events_menu(chat_id, username)
+        return
+        
+    event_id, event_name, event_date = user_selections.get(chat_id, {}).get('event', (None, None, None))
+    if not event_id:
+        show_events_menu(chat_id, username)
+        return
+    lines = [line.strip() for line in message.text.split('\n') if line.strip()]
+    try:
+        period = parse_reservation_period(lines[-1]) if lines else None
+    except ValueError:
+        bot.send_message(chat_id, "❌ Неверный период. Используйте формат ДД.ММ.ГГГГ - ДД.ММ.ГГГГ (окончание не раньше начала)")
+        return
+    if period:
+        lines = lines[:-1]
+    start_date, end_date = period or (event_date, event_date)
+    
+    records, errors = resolve_reservation_items(lines)
+    if not records and not errors:
+        errors.append("не указаны предметы")
+    if not errors:
+        reservations, errors = reserve_items(event_id, event_name, start_date, end_date, records, username)
+    if errors:
+        send_chunked(chat_id, ["❌ Бронь не создана:", ""] + [f"• {error}" for error in errors] + ["", "Исправьте список и отправьте снова или нажмите '❌ Отмена'."])
+        return
+        
+    warnings = [warning for warning in (issue_conflicts(record, start_date, end_date) for record in records) if warning]
+    text = (f"✅ Забронировано под «{event_name}» ({format_period(start_date, end_date)}): {len(reservations)}\n\n"
+            + "\n".join(f"• {reservation_item_name(reservation)}" for reservation in reservations)
+            + ("\n\n" + "\n".join(warnings) if warnings else ""))
+    show_events_menu(chat_id, username, text)
+
+def show_reservations_list(chat_id, username=None):
+    reservations = get_active_reservations()
+    if not reservations:
+        show_events_menu(chat_id, username, "📋 Активных броней нет")
+        return
+        
+    reservation_dict = {}
+    lines = ["📋 Брони:", ""]
+    for i, reservation in enumerate(reservations, 1):
+        reservation_dict[str(i)] = reservation.id
+        lines.append(f"{i}. {format_period(reservation.start_date, reservation.end_date)} — {reservation.event_name}: {reservation_item_name(reservation)}")
+    lines.extend(["", "Введите номера броней для отмены через запятую (например: 1,3) или '❌ Отмена'."])
+    user_selections[chat_id] = reservation_dict
+    user_states[chat_id] = 'cancelling_reservation'
+    send_chunked(chat_id, lines, reply_markup=create_cancel_keyboard())
+
+@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == 'cancelling_reservation')
+def handle_cancelling_reservation(message):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    if not username or not is_admin_by_username(username):
+        bot.send_message(chat_id, "❌ Недостаточно прав. Только администраторы могут отменять брони.")
+        show_main_menu(chat_id, username)
+        return
+        
+    if message.text == '❌ Отмена':
+        show_events_menu(chat_id, username)
+        return
+        
+    reservation_dict = user_selections.get(chat_id, {})
+    reservation_ids = [reservation_dict[num.strip()] for num in message.text.split(',') if num.strip() in reservation_dict]
+    cancelled = cancel_reservations(reservation_ids)
+    if cancelled:
+        text = f"✅ Отменено броней: {len(cancelled)}\n\n" + "\n".join(
+            f"• {reservation.event_name}: {reservation_item_name(reservation)}" for reservation in cancelled)
+    else:
+        text = "❌ Неверно указаны номера броней"
+    show_events_menu(chat_id, username, text)
+
+user_states = {}
+user_selections = {}
+user_item_lists = {}
+
+if not BACKUP_PROCESS:
+    load_admins()
+
+# Фоновые задачи: один поток-планировщик держит сроки в куче и будит себя к ближайшему,
+# сами задачи выполняются в небольшом пуле; запуск, пока предыдущий еще идет, пропускается
+SCHEDULER_WORKERS = 2
+KEEP_ALIVE_INTERVAL = 300
+KEEP_ALIVE_JITTER = 30
+BACKUP_CLEANUP_INTERVAL = 600
+BACKUP_IDLE_CHECK_INTERVAL = 300
+
+# Общая сессия с пулом соединений для исходящих HTTP-запросов фоновых задач
+http_session = requests.Session()
+
+class CronSchedule:
+    """Расписание cron: «минуты часы дни месяцы дни_недели» (*, числа, списки, диапазоны, */шаг; 0 - воскресенье).
+
+    Дни месяца и дни недели должны совпасть оба.
+    """
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, spec):
+        parts = spec.split()
+        if len(parts) != len(self.FIELDS):
+            raise ValueError(f"ожидается 5 полей: {spec}")
+        self.spec = spec
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)
+        )
+
+    @staticmethod
+    def _parse(part, low, high):
+        values = set()
+        for chunk in part.split(','):
+            span, slash, step = chunk.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = map(int, span.split('-', 1))
+            else:
+                start = int(span)
+                end = high if slash else start
+            step = int(step) if slash else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"неверное поле расписания: {part}")
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    def next_after(self, moment):
+        """Ближайшая минута расписания строго после moment"""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 8):
+            if day.month in self.months and day.day in self.days and day.isoweekday() % 7 in self.weekdays:
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"расписание не наступает: {self.spec}")
+
+class ScheduledJob:
+    """Задача планировщика и ее метрики (меняются под condition планировщика)"""
+
+    def __init__(self, name, func, every=None, cron=None, jitter=0):
+        self.name = name
+        self.func = func
+        self.every = every
+        self.cron = cron
+        self.jitter = jitter
+        self.cancelled = False
+        self.running = False
+        self.planned = None
+        self.due = None
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def plan(self, now, delay=None):
+        """Следующий срок: интервальные задачи идут от прошлого срока без накопления сдвига, cron - по расписанию"""
+        if self.cron:
+            planned = self.cron.next_after(datetime.fromtimestamp(now)).timestamp()
+        elif self.planned is None:
+            planned = now + (self.every if delay is None else delay)
+        else:
+            planned = self.planned + self.every
+            if planned <= now:
+                # Пропущенные сроки (долгий запуск, сон процесса) не догоняются
+                planned += ((now - planned) // self.every + 1) * self.every
+        self.planned = planned
+        self.due = planned + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+class Scheduler:
+    """Планировщик фоновых задач: интервальные и cron-задачи с разбросом времени запуска"""
+
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.thread = None
+        self.stopped = False
+
+    def add(self, name, func, every=None, cron=None, jitter=0, delay=None):
+        """Регистрация задачи (задача с тем же именем заменяется); delay - задержка первого запуска интервальной задачи"""
+        if (every is None) == (cron is None):
+            raise ValueError("нужен либо интервал, либо расписание cron")
+        job = ScheduledJob(name, func, every, CronSchedule(cron) if cron else None, jitter)
+        job.plan(time.time(), delay)
+        with self.condition:
+            previous = self.jobs.get(name)
+            if previous:
+                previous.cancelled = True
+            self.jobs[name] = job
+            heapq.heappush(self.heap, (job.due, next(self.counter), job))
+            self.condition.notify()
+        return job
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Остановка: новые запуски не начинаются, идущие дорабатывают"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.heap or self.heap[0][0] > time.time()):
+                    self.condition.wait(self.heap[0][0] - time.time() if self.heap else None)
+                if self.stopped:
+                    return
+                due, _, job = heapq.heappop(self.heap)
+                if job.cancelled:
+                    continue
+                if job.running:
+                    job.skipped += 1
+                    logger.warning(f"Фоновая задача {job.name} еще выполняется, запуск пропущен")
+                else:
+                    job.running = True
+                    self.executor.submit(self._execute, job, due)
+                job.plan(time.time())
+                heapq.heappush(self.heap, (job.due, next(self.counter), job))
+
+    def _execute(self, job, due):
+        started = time.time()
+        try:
+            job.func()
+        except Exception as e:
+            logger.error(f"Ошибка фоновой задачи {job.name}: {e}")
+            failed = True
+        else:
+            failed = False
+        duration = time.time() - started
+        with self.condition:
+            job.running = False
+            job.runs += 1
+            job.errors += failed
+            job.last_run = started
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+            job.total_duration += duration
+            # Опоздание - от срока (с разбросом) до фактического начала, включая ожидание свободного потока
+            job.last_lag = started - due
+            job.max_lag = max(job.max_lag, job.last_lag)
+
+    def stats(self):
+        with self.condition:
+            return [
+                {
+                    'name': job.name,
+                    'schedule': job.cron.spec if job.cron else f"каждые {job.every:g} с",
+                    'next_run': job.due,
+                    'running': job.running,
+                    'runs': job.runs,
+                    'skipped': job.skipped,
+                    'errors': job.errors,
+                    'last_run': job.last_run,
+                    'last_duration': job.last_duration,
+                    'avg_duration': job.total_duration / job.runs if job.runs else 0.0,
+                    'max_duration': job.max_duration,
+                    'last_lag': job.last_lag,
+                    'max_lag': job.max_lag
+                }
+                for job in sorted(self.jobs.values(), key=lambda job: job.name)
+            ]
+
+scheduler = Scheduler()
+
+def keep_alive():
+    url = f"https://{os.environ.get('RENDER_EXTERNAL_HOSTNAME')}"
+    try:
+        response = http_session.get(url, timeout=10)
+        logger.info(f"Keep-alive ping: {url} | Status: {response.status_code}")
+    except Exception as e:
+        logger.error(f"Keep-alive error: {e}")
+
+scheduler.add('backup_verify', lambda: for_each_tenant(opened_tenants(), verify_next_backup, "проверка бэкапов"),
+              every=BACKUP_VERIFY_INTERVAL)
+scheduler.add('backup_cleanup', lambda: for_each_tenant(opened_tenants(), cleanup_old_backups, "очистка бэкапов"),
+              every=BACKUP_CLEANUP_INTERVAL, jitter=60)
+scheduler.add('backup_idle', lambda: for_each_tenant(opened_tenants(), backup_idle_changes, "бэкап по расписанию"),
+              every=BACKUP_IDLE_CHECK_INTERVAL, jitter=60)
+scheduler.add('chats_flush', lambda: for_each_tenant(opened_tenants(), flush_chats, "запись чатов"),
+              every=CHATS_FLUSH_INTERVAL)
+scheduler.add('tenant_budget', enforce_tenant_budget, every=TENANT_BUDGET_CHECK_INTERVAL)
+# Ежедневный отчет о просрочках администраторам каждого тенанта
+scheduler.add('overdue_report', lambda: for_each_tenant(all_tenants(), send_overdue_report, "отчет о просрочках"),
+              cron=f"0 {OVERDUE_REPORT_HOUR} * * *")
+
+if os.environ.get('RENDER'):
+    scheduler.add('keep_alive', keep_alive, every=KEEP_ALIVE_INTERVAL, jitter=KEEP_ALIVE_JITTER)
+    logger.info("Keep-alive пинг запущен (каждые 5 минут)")
+
+if not BACKUP_PROCESS:
+    scheduler.start()
+
+# Жизненный цикл: прогрев, готовность и корректное завершение
+SHUTDOWN_DEADLINE = 20
+POLLING_TIMEOUT = 10
+
+class Lifecycle:
+    """Состояние процесса и счетчик обрабатываемых обновлений"""
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.inflight = 0
+        self.cond = threading.Condition()
+
+    def is_ready(self):
+        return self.ready and not self.draining
+
+    def enter(self):
+        with self.cond:
+            self.inflight += 1
+
+    def leave(self):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def wait_idle(self, deadline):
+        """Ожидание, пока обработчики и очередь потоков бота опустеют"""
+        with self.cond:
+            while time.time() < deadline:
+                queued = bot.worker_pool.tasks.qsize() if bot.threaded else 0
+                if self.inflight == 0 and queued == 0:
+                    return True
+                self.cond.wait(0.1)
+        return False
+
+    def backlog(self):
+        """Обновления в работе и в очереди потоков бота"""
+        return self.inflight + (bot.worker_pool.tasks.qsize() if bot.threaded else 0)
+
+lifecycle = Lifecycle()
+
+# Защита от флуда: корзины токенов по чатам в таблице фиксированного размера
+FLOOD_RATE = float(os.environ.get('FLOOD_RATE', 1))
+FLOOD_BURST = float(os.environ.get('FLOOD_BURST', 10))
+FLOOD_TABLE_SIZE = 4096
+# При перегрузке каждое обновление стоит дороже - первыми отсекаются самые активные чаты
+FLOOD_OVERLOAD_BACKLOG = int(os.environ.get('FLOOD_OVERLOAD_BACKLOG', 100))
+FLOOD_OVERLOAD_COST = 3
+
+class FloodGuard:
+    """Корзины токенов по чатам.
+
+    Таблица фиксированного размера: чату соответствуют два слота, если оба заняты другими чатами,
+    вытесняется тот, что дольше не писал (приблизительный LRU без роста памяти).
+    """
+
+    def __init__(self, size=FLOOD_TABLE_SIZE, rate=FLOOD_RATE, burst=FLOOD_BURST):
+        self.lock = threading.Lock()
+        self.size = size
+        self.rate = rate
+        self.burst = burst
+        self.chat_ids = [None] * size
+        self.tokens = [0.0] * size
+        self.updated = [0.0] * size
+        self.warned = [False] * size
+        self.dropped = 0
+        self.shed = 0
+        self.evicted = 0
+
+    def _slot(self, chat_id, now):
+        first = chat_id % self.size
+        second = (chat_id * 2654435761 >> 7) % self.size
+        for slot in (first, second):
+            if self.chat_ids[slot] == chat_id:
+                return slot
+        slot = first if self.updated[first] <= self.updated[second] else second
+        if self.chat_ids[slot] is not None:
+            self.evicted += 1
+        self.chat_ids[slot] = chat_id
+        self.tokens[slot] = self.burst
+        self.updated[slot] = now
+        self.warned[slot] = False
+        return slot
+
+    def allow(self, chat_id, cost=1):
+        """Списание токенов: (пропустить ли, сколько секунд ждать, предупреждать ли чат)"""
+        now = time.monotonic()
+        with self.lock:
+            slot = self._slot(chat_id, now)
+            tokens = min(self.burst, self.tokens[slot] + (now - self.updated[slot]) * self.rate)
+            self.updated[slot] = now
+            if tokens >= cost:
+                self.tokens[slot] = tokens - cost
+                self.warned[slot] = False
+                return True, 0, False
+            self.tokens[slot] = tokens
+            warn = not self.warned[slot]
+            self.warned[slot] = True
+            return False, (cost - tokens) / self.rate, warn
+
+    def count(self, overloaded):
+        with self.lock:
+            if overloaded:
+                self.shed += 1
+            else:
+                self.dropped += 1
+
+flood_guard = FloodGuard()
+
+def payload_too_large(message):
+    """Слишком много строк (например, огромный список предметов)"""
+    text = message.text or message.caption or ''
+    return text.count('\n') + 1 > INBOUND_MAX_LINES
+
+class FloodMiddleware(BaseMiddleware):
+    """Ограничение входящих обновлений до тенанта и обработчиков: частота по чату, размер, сброс нагрузки"""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, message, data):
+        is_callback = isinstance(message, types.CallbackQuery)
+        chat_id = message.message.chat.id if is_callback else message.chat.id
+        overloaded = lifecycle.backlog() >= FLOOD_OVERLOAD_BACKLOG
+        allowed, wait, warn = flood_guard.allow(chat_id, FLOOD_OVERLOAD_COST if overloaded else 1)
+        if not allowed:
+            flood_guard.count(overloaded)
+            # Под перегрузкой не тратим вызовы API на предупреждения
+            if warn and not overloaded:
+                logger.warning(f"Флуд из чата {chat_id}, обновления отбрасываются")
+                notify_flood(message, is_callback, f"⏳ Слишком много запросов, подождите {max(1, round(wait))} с")
+            return CancelUpdate()
+        if not is_callback and payload_too_large(message):
+            bot.send_message(chat_id, f"❌ Слишком большое сообщение: не больше {INBOUND_MAX_LINES} строк")
+            return CancelUpdate()
+
+    def post_process(self, message, data, exception):
+        pass
+
+def notify_flood(message, is_callback, text):
+    try:
+        if is_callback:
+            bot.answer_callback_query(message.id, text)
+        else:
+            bot.send_message(message.chat.id, text)
+    except Exception as e:
+        logger.error(f"Ошибка предупреждения о флуде: {e}")
+
+class TenantMiddleware(BaseMiddleware):
+    """Выбор тенанта по чату до остальных обработчиков"""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, message, data):
+        chat = message.message.chat if isinstance(message, types.CallbackQuery) else message.chat
+        username = message.from_user.username if message.from_user and chat.type == 'private' else None
+        tenant = resolve_tenant(chat.id, username)
+        tenant.last_used = time.time()
+        tenant_context.tenant = tenant
+
+    def post_process(self, message, data, exception):
+        tenant_context.tenant = None
+
+class ChatsMiddleware(BaseMiddleware):
+    """Учет чатов, с которыми общается бот"""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, message, data):
+        chat = message.message.chat if isinstance(message, types.CallbackQuery) else message.chat
+        touch_chat(chat, message.from_user.username if message.from_user else None)
+
+    def post_process(self, message, data, exception):
+        pass
+
+class LifecycleMiddleware(BaseMiddleware):
+    """Учет обновлений, которые сейчас обрабатываются"""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, message, data):
+        lifecycle.enter()
+
+    def post_process(self, message, data, exception):
+        lifecycle.leave()
+
+# Защита от флуда - первой: отброшенное обновление не доходит до тенанта, учета чатов и счетчика
+bot.setup_middleware(FloodMiddleware())
+bot.setup_middleware(TenantMiddleware())
+bot.setup_middleware(ChatsMiddleware())
+bot.setup_middleware(LifecycleMiddleware())
+
+if not BACKUP_PROCESS:
+    threading.Thread(target=broadcast_worker, daemon=True).start()
+
+# Запись входящих обновлений для воспроизведения (replay.py): обезличенный сжатый журнал только на дозапись.
+# Включается переменной RECORD_UPDATES_DIR. Каждый сброс - отдельный gzip-блок, поэтому файл
+# остается читаемым после аварийного завершения.
+RECORD_UPDATES_DIR = os.environ.get('RECORD_UPDATES_DIR')
+RECORD_FLUSH_INTERVAL = 2
+RECORD_SECRET_MARKER = '<secret>'
+RECORD_UPDATE_TYPES = ('message', 'callback_query')
+
+def update_to_dict(update):
+    """Исходный JSON обновления из объекта telebot (у сообщений и нажатий он сохранен в .json)"""
+    data = {'update_id': update.update_id}
+    for update_type in RECORD_UPDATE_TYPES:
+        obj = getattr(update, update_type, None)
+        if obj is not None:
+            data[update_type] = obj.json
+    return data
+
+class UpdateRecorder:
+    """Обезличивание и запись обновлений с временем получения.
+
+    Идентификаторы, имена пользователей, упоминания @username, телефоны, длинные числа и слова свободного
+    текста заменяются стабильными псевдонимами (HMAC с солью из каталога записи), поэтому сценарии чатов
+    сохраняются: один и тот же предмет или пользователь в записи всегда выглядит одинаково, а @username
+    в тексте совпадает с псевдонимом from.username. Как есть остаются только строки - точные надписи
+    кнопок, слово команды, даты ДД.ММ.ГГГГ и короткие номера (выбор из списка); секретное слово
+    заменяется меткой.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        salt_path = os.path.join(directory, 'salt')
+        if not os.path.exists(salt_path):
+            with open(salt_path, 'w') as f:
+                f.write(uuid4().hex)
+        with open(salt_path) as f:
+            self.salt = f.read().strip().encode()
+        self.secret_words = {normalize_text(SECRET_WORD)} | {
+            normalize_text(config['secret_word']) for config in tenant_configs.values() if config.get('secret_word')
+        }
+        self.keep_words = set(BATCH_ACTIONS) | {'до'} | {word for phrase in RECURRENCE_WORDS for word in phrase.split()}
+        # Названия кладовых - часть структуры пакетов и броней («Гринбокс 11» / «Гринбокс 11: Палатка»)
+        self.storage_names = set(STORAGE_IDS) | {
+            storage for config in tenant_configs.values() for storage in config.get('storages') or ()
+        }
+        self.button_labels = self.collect_button_labels() | self.storage_names
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        scheduler.add('record_flush', self.flush, every=RECORD_FLUSH_INTERVAL)
+
+    def record(self, update):
+        """Постановка обновления в очередь (обезличивание - при сбросе, не в потоке приема)"""
+        with self.lock:
+            self.pending.append((round(time.time(), 3), update))
+
+    def _digest(self, value):
+        return hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+
+    def pseudo_id(self, value):
+        pseudo = int.from_bytes(self._digest(abs(value))[:5], 'big') % 10 ** 10 + 1
+        return -pseudo if value < 0 else pseudo
+
+    def pseudo_word(self, word):
+        return 'x' + ''.join(chr(ord('a') + byte % 26) for byte in self._digest(word.lower())[:7])
+
+    def pseudo_digits(self, digits):
+        return ''.join(str(byte % 10) for byte in self._digest('#' + digits)[:len(digits)])
+
+    @staticmethod
+    def collect_button_labels():
+        """Надписи кнопок всех экранов и ролей (включая кладовые всех тенантов)"""
+        labels = {'❌ Отмена'}
+        with use_tenant(get_tenant(DEFAULT_TENANT)):
+            for builder in KEYBOARD_BUILDERS.values():
+                for role in ('user', 'admin', 'main'):
+                    labels.update(button['text'] for row in builder(role).keyboard for button in row)
+        for config in tenant_configs.values():
+            labels.update(f'📍 {storage}' for storage in config.get('storages') or ())
+        return labels
+
+    def anonymize_text(self, text):
+        if normalize_text(text) in self.secret_words:
+            return RECORD_SECRET_MARKER
+        lines = []
+        for line in text.split('\n'):
+            stripped = line.strip()
+            if stripped in self.button_labels:
+                line = stripped
+            elif stripped.startswith('/'):
+                command, _, rest = stripped.partition(' ')
+                line = f"{command} {self.anonymize_words(rest)}".rstrip()
+            else:
+                prefix, colon, rest = stripped.partition(':')
+                if colon and prefix.strip() in self.storage_names:
+                    line = f"{prefix}:{self.anonymize_words(rest)}"
+                else:
+                    line = self.anonymize_words(line)
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def anonymize_words(self, text):
+        def replace(match):
+            token = match.group()
+            if match.group('date'):
+                return token
+            if match.group('phone'):
+                digits = re.sub(r'\D', '', token)
+                return ('+' if token.startswith('+') else '') + self.pseudo_digits(digits)
+            if token.startswith('@'):
+                return '@' + self.pseudo_word(token[1:])
+            if token.isdigit():
+                # Короткие номера - выбор из пронумерованного списка, без них запись не воспроизводится
+                return token if len(token) <= 3 else self.pseudo_digits(token)
+            return token if token.lower() in self.keep_words else self.pseudo_word(token)
+        return re.sub(
+            r'(?P<date>\d{1,2}\.\d{1,2}\.\d{4})|(?P<phone>\+?\d[\d\s()-]{5,}\d)|@\w+|[^\W\d_]+|\d+',
+            replace, text
+        )
+
+    def anonymize_user(self, user):
+        anonymized = {'id': self.pseudo_id(user['id']), 'is_bot': user.get('is_bot', False), 'first_name': 'user'}
+        if user.get('username'):
+            anonymized['username'] = self.pseudo_word(user['username'])
+        return anonymized
+
+    def anonymize_message(self, message):
+        anonymized = {
+            'message_id': message['message_id'],
+            'date': message.get('date', 0),
+            'chat': {'id': self.pseudo_id(message['chat']['id']), 'type': message['chat'].get('type', 'private')}
+        }
+        if message.get('from'):
+            anonymized['from'] = self.anonymize_user(message['from'])
+        for field in ('text', 'caption'):
+            if message.get(field):
+                anonymized[field] = self.anonymize_text(message[field])
+        return anonymized
+
+    def anonymize(self, update):
+        anonymized = {'update_id': update['update_id']}
+        if update.get('message'):
+            anonymized['message'] = self.anonymize_message(update['message'])
+        elif update.get('callback_query'):
+            query = update['callback_query']
+            anonymized['callback_query'] = {
+                'id': query['id'],
+                'chat_instance': query.get('chat_instance', ''),
+                'data': query.get('data', ''),
+                'from': self.anonymize_user(query['from'])
+            }
+            if query.get('message'):
+                anonymized['callback_query']['message'] = {**self.anonymize_message(query['message']), 'text': ''}
+        else:
+            return None
+        return anonymized
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                records, self.pending = self.pending, []
+            if not records:
+                return
+            lines = []
+            for ts, update in records:
+                try:
+                    anonymized = self.anonymize(update)
+                except Exception as e:
+                    logger.error(f"Ошибка обезличивания обновления: {e}")
+                    continue
+                if anonymized:
+                    lines.append(json.dumps({'ts': ts, 'update': anonymized}, ensure_ascii=False) + '\n')
+            path = os.path.join(self.directory, f"updates_{datetime.now().strftime('%Y%m%d')}.jsonl.gz")
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                f.writelines(lines)
+
+update_recorder = UpdateRecorder(RECORD_UPDATES_DIR) if RECORD_UPDATES_DIR and not BACKUP_PROCESS else None
+
+web_server = None
+
+def warm_up():
+    """Прогрев кэшей тенанта по умолчанию перед приемом трафика (остальные - при первом обращении)"""
+    tenant = current_tenant()
+    load_admins()
+    for storage in tenant.storage_ids:
+        load_items(storage)
+    load_events()
+    tenant.stats.ensure_loaded()
+    for role in ('user', 'admin', 'main'):
+        for screen in KEYBOARD_BUILDERS:
+            get_keyboard(screen, role)
+    logger.info("Кэши прогреты")
+
+def stop_intake():
+    if web_server:
+        web_server.shutdown()
+    else:
+        bot.stop_polling()
+
+def handle_shutdown_signal(signum, frame):
+    if lifecycle.draining:
+        return
+    logger.info(f"Получен сигнал {signum}, прекращаем прием обновлений")
+    lifecycle.draining = True
+    # shutdown() веб-сервера нельзя вызывать из потока, в котором он работает
+    threading.Thread(target=stop_intake, daemon=True).start()
+
+def drain_and_flush():
+    """Завершение обработки текущих обновлений и сброс отложенных записей"""
+    if not lifecycle.wait_idle(time.time() + SHUTDOWN_DEADLINE):
+        logger.warning(f"Не все обновления обработаны за {SHUTDOWN_DEADLINE} с (в работе: {lifecycle.inflight})")
+    scheduler.stop()
+    if bot.threaded:
+        bot.worker_pool.close()
+    if update_recorder:
+        update_recorder.flush()
+    for tenant in opened_tenants():
+        with use_tenant(tenant):
+            flush_chats()
+            try:
+                tenant.journal.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала при завершении ({tenant.name}): {e}")
+            create_backup("shutdown", wait=True)
+    if backup_executor:
+        backup_executor.shutdown(wait=True)
+    logger.info("Бот остановлен")
+    logging.shutdown()
+
+from flask import Flask, Response, request
+app = Flask(__name__)
+
+# Готовые HTTP-ответы (календарь, API): собираются из кэшей один раз на версию данных,
+# повторные запросы с тем же ETag получают 304 без тела
+HTTP_CACHE_LIMIT = 256
+HTTP_GZIP_MIN_SIZE = 512
+FEED_TOKEN = os.environ.get('FEED_TOKEN')
+# Без токена календарь и API закрыты; открытый доступ - только явно (FEED_PUBLIC=1 или "feed_public": true у тенанта)
+FEED_PUBLIC = os.environ.get('FEED_PUBLIC') == '1'
+
+class ResponseCache:
+    """Тело ответа, его gzip-версия и сильный ETag по ключу и версии данных"""
+
+    def __init__(self, limit=HTTP_CACHE_LIMIT):
+        self.lock = threading.Lock()
+        self.limit = limit
+        self.entries = {}
+
+    def get(self, key, version, build):
+        entry = self.entries.get(key)
+        if entry and entry[0] == version:
+            return entry[1]
+        # Версия прочитана до сборки: если данные изменятся во время сборки, следующий запрос соберет заново
+        body = build()
+        prepared = (body, gzip.compress(body, 6, mtime=0), hashlib.sha256(body).hexdigest()[:32])
+        with self.lock:
+            if len(self.entries) >= self.limit:
+                self.entries.clear()
+            self.entries[key] = (version, prepared)
+        return prepared
+
+response_cache = ResponseCache()
+
+# HTTP-обработчики не зависят от среды выполнения: получают параметры запроса и заголовки
+# (поддерживают .get), возвращают (статус, заголовки, тело); Flask и aiohttp только оборачивают ответ
+def etag_matches(if_none_match, etag):
+    tags = [tag.strip().removeprefix('W/').strip('"') for tag in (if_none_match or '').split(',')]
+    return '*' in tags or etag in tags
+
+def prepared_reply(prepared, content_type, headers):
+    """Ответ с ETag: 304 при совпадении If-None-Match, сжатое тело, если клиент принимает gzip"""
+    body, packed, etag = prepared
+    gzipped = len(body) >= HTTP_GZIP_MIN_SIZE and 'gzip' in headers.get('Accept-Encoding', '')
+    if gzipped:
+        etag += '-gz'
+    reply_headers = {
+        'ETag': f'"{etag}"',
+        'Vary': 'Accept-Encoding',
+        # Клиент может хранить ответ, но должен каждый раз сверять ETag
+        'Cache-Control': 'no-cache'
+    }
+    if etag_matches(headers.get('If-None-Match'), etag):
+        return 304, reply_headers, b''
+    reply_headers['Content-Type'] = content_type
+    if gzipped:
+        reply_headers['Content-Encoding'] = 'gzip'
+    return 200, reply_headers, packed if gzipped else body
+
+def text_reply(status, text):
+    return status, {'Content-Type': 'text/plain; charset=utf-8'}, text.encode('utf-8')
+
+def flask_reply(reply):
+    status, headers, body = reply
+    return Response(body, status=status, headers=headers)
+
+def resolve_http_tenant(name, token):
+    """Тенант для HTTP-запроса и проверка токена (feed_token тенанта или FEED_TOKEN).
+
+    Возвращает (тенант, None) или (None, статус): 404 - нет тенанта или доступ не настроен,
+    401 - токен не передан, 403 - неверный токен.
+    """
+    name = name or DEFAULT_TENANT
+    if name != DEFAULT_TENANT and name not in tenant_configs:
+        return None, 404
+    config = tenant_configs.get(name, {})
+    expected = config.get('feed_token') or FEED_TOKEN
+    if not expected:
+        if FEED_PUBLIC or config.get('feed_public'):
+            return get_tenant(name), None
+        return None, 404
+    if not token:
+        return None, 401
+    if not hmac.compare_digest(token, expected):
+        return None, 403
+    return get_tenant(name), None
+
+HTTP_ERROR_TEXTS = {401: "Unauthorized", 403: "Forbidden", 404: "Not found"}
+
+# Календарь событий в формате iCalendar (RFC 5545)
+ICS_PRODID = '-//primklad//inventory bot//RU'
+ICS_FREQ = {'daily': 'DAILY', 'weekly': 'WEEKLY', 'monthly': 'MONTHLY'}
+
+def ics_escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ics_fold(line):
+    """Перенос строк длиннее 75 байт UTF-8 (продолжение начинается с пробела)"""
+    parts = []
+    current = ''
+    for char in line:
+        if len((current + char).encode('utf-8')) > (75 if not parts else 74):
+            parts.append(current)
+            current = ''
+        current += char
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+def ics_date(iso_date):
+    return iso_date.replace('-', '')
+
+def ics_event(uid, name, start_date, extra=()):
+    next_day = (date.fromisoformat(start_date) + timedelta(days=1)).isoformat()
+    return [
+        'BEGIN:VEVENT',
+        f'UID:{uid}@primklad',
+        # DTSTAMP из даты события, а не текущего времени: тело и ETag зависят только от данных
+        f'DTSTAMP:{ics_date(start_date)}T000000Z',
+        f'DTSTART;VALUE=DATE:{ics_date(start_date)}',
+        f'DTEND;VALUE=DATE:{ics_date(next_day)}',
+        f'SUMMARY:{ics_escape(name)}',
+        *extra,
+        'END:VEVENT'
+    ]
+
+def event_has_tag(name, tag):
+    return not tag or f"#{tag}" in name.lower()
+
+def build_calendar(tag=None):
+    """Все события тенанта (разовые и правила повторения с RRULE/EXDATE) в формате iCalendar"""
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{ICS_PRODID}', 'CALSCALE:GREGORIAN',
+             f"X-WR-CALNAME:{ics_escape('События' + (f' #{tag}' if tag else ''))}"]
+    for event in sorted(load_events(), key=lambda event: (event['event_date'], event['id'])):
+        if event_has_tag(event['event_name'], tag):
+            lines.extend(ics_event(event['id'], event['event_name'], event['event_date']))
+    for rule in sorted(load_event_rules().values(), key=lambda rule: (rule['start_date'], rule['id'])):
+        if not event_has_tag(rule['event_name'], tag):
+            continue
+        rrule = f"RRULE:FREQ={ICS_FREQ[rule['freq']]}" + (f";UNTIL={ics_date(rule['until'])}" if rule['until'] else '')
+        extra = [rrule]
+        if rule['exdates']:
+            extra.append('EXDATE;VALUE=DATE:' + ','.join(ics_date(day) for day in sorted(rule['exdates'])))
+        lines.extend(ics_event(rule['id'], rule['event_name'], rule['start_date'], extra))
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(ics_fold(line) for line in lines) + '\r\n').encode('utf-8')
+
+@app.route('/')
+def index():
+    return "Бот управления инвентарем работает!", 200
+
+@app.route('/health')
+def health():
+    return "ok", 200
+
+@app.route('/ready')
+def ready():
+    if lifecycle.is_ready():
+        return "ready", 200
+    return "not ready", 503
+
+# Read-only JSON API для панелей и планшета: только из кэшей в памяти, ETag от версий данных
+API_PAGE_LIMIT = 50
+API_MAX_PAGE_LIMIT = 500
+API_ITEM_FIELDS = ('id', 'name', 'issued', 'owner', 'issued_at', 'due_at')
+API_EVENT_FIELDS = ('id', 'name', 'date', 'series')
+
+API_ERRORS = {401: "unauthorized", 403: "forbidden", 404: "not found"}
+
+def api_error(message, status):
+    return status, {'Content-Type': 'application/json'}, json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+
+def api_tenant(args, headers):
+    """Тенант API: ?tenant=..., токен - ?token=... или заголовок Authorization: Bearer ...
+
+    Возвращает (тенант, None) или (None, ответ с ошибкой).
+    """
+    token = args.get('token') or headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    tenant, status = resolve_http_tenant(args.get('tenant'), token)
+    if tenant is None:
+        return None, api_error(API_ERRORS[status], status)
+    return tenant, None
+
+def api_fields(args, allowed):
+    """Поля из ?fields=a,b (по умолчанию все); ValueError - неизвестное поле"""
+    requested = [field.strip() for field in args.get('fields', '').split(',') if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return tuple(requested) or allowed
+
+def api_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def item_to_api(item):
+    return {'id': item.id, 'name': item.item_name, 'issued': bool(item.issued), 'owner': item.owner,
+            'issued_at': item.issued_at, 'due_at': item.due_at}
+
+def build_storages_json():
+    storages = []
+    for storage, storage_id in current_tenant().storage_ids.items():
+        items = load_items(storage)
+        storages.append({'id': storage_id, 'name': storage, 'items': len(items),
+                         'available': items.available_count, 'issued': items.issued_count})
+    return api_json({'storages': storages})
+
+def build_items_json(storage, cursor, limit, fields):
+    page, next_cursor = load_items(storage).page_after(cursor, limit)
+    items = [{field: value for field, value in item_to_api(item).items() if field in fields} for item in page]
+    return api_json({'items': items, 'next_cursor': str(next_cursor) if next_cursor else None})
+
+def build_events_json(start, end, fields):
+    """Разовые события и повторения правил в окне [start, end] из кэшей (без запросов к базе)"""
+    events = [(event['event_date'], event['id'], event['event_name'], None) for event in load_events()
+              if start.isoformat() <= event['event_date'] <= end.isoformat()]
+    for rule in load_event_rules().values():
+        events.extend((event_date, event_id, name, rule['id']) for event_id, name, event_date in iter_rule_events(rule, start, end))
+    events.sort()
+    return api_json({'events': [
+        {field: value for field, value in zip(API_EVENT_FIELDS, (event_id, name, event_date, series)) if field in fields}
+        for event_date, event_id, name, series in events
+    ]})
+
+def storages_reply(args, headers):
+    tenant, error = api_tenant(args, headers)
+    if tenant is None:
+        return error
+    version = tuple(data_version(tenant, storage_id) for storage_id in tenant.storage_ids.values())
+    with use_tenant(tenant):
+        prepared = response_cache.get(('storages', tenant.name), version, build_storages_json)
+    return prepared_reply(prepared, 'application/json', headers)
+
+def storage_items_reply(args, headers, storage_id):
+    tenant, error = api_tenant(args, headers)
+    if tenant is None:
+        return error
+    storage = tenant.reverse_storage_ids.get(storage_id)
+    if storage is None:
+        return api_error("storage not found", 404)
+    try:
+        cursor = int(args.get('cursor') or 0)
+        limit = min(int(args.get('limit') or API_PAGE_LIMIT), API_MAX_PAGE_LIMIT)
+        fields = api_fields(args, API_ITEM_FIELDS)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    if limit < 1:
+        return api_error("limit must be positive", 400)
+    with use_tenant(tenant):
+        prepared = response_cache.get(
+            ('items', tenant.name, storage_id, cursor, limit, fields),
+            data_version(tenant, storage_id),
+            lambda: build_items_json(storage, cursor, limit, fields)
+        )
+    return prepared_reply(prepared, 'application/json', headers)
+
+def events_reply(args, headers):
+    """События в окне ?from=ГГГГ-ММ-ДД&to=ГГГГ-ММ-ДД (по умолчанию от сегодня на EVENTS_LIST_DAYS дней)"""
+    tenant, error = api_tenant(args, headers)
+    if tenant is None:
+        return error
+    try:
+        today = datetime.now().date()
+        start = date.fromisoformat(args['from']) if args.get('from') else today
+        end = date.fromisoformat(args['to']) if args.get('to') else start + timedelta(days=EVENTS_LIST_DAYS)
+        fields = api_fields(args, API_EVENT_FIELDS)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    if (end - start).days > 366:
+        return api_error("window is longer than a year", 400)
+    with use_tenant(tenant):
+        prepared = response_cache.get(
+            ('events', tenant.name, start, end, fields),
+            data_version(tenant, 'events'),
+            lambda: build_events_json(start, end, fields)
+        )
+    return prepared_reply(prepared, 'application/json', headers)
+
+@app.route('/api/storages')
+def api_storages():
+    return flask_reply(storages_reply(request.args, request.headers))
+
+@app.route('/api/storages/<storage_id>/items')
+def api_storage_items(storage_id):
+    return flask_reply(storage_items_reply(request.args, request.headers, storage_id))
+
+@app.route('/api/events')
+def api_events():
+    return flask_reply(events_reply(request.args, request.headers))
+
+def calendar_reply(args, headers):
+    """Календарь для подписки: /calendar.ics?tag=концерт&tenant=...&token=..."""
+    tenant, status = resolve_http_tenant(args.get('tenant'), args.get('token'))
+    if tenant is None:
+        return text_reply(status, HTTP_ERROR_TEXTS[status])
+    tag = args.get('tag', '').lstrip('#').strip().lower() or None
+    with use_tenant(tenant):
+        prepared = response_cache.get(('ics', tenant.name, tag), data_version(tenant, 'events'), lambda: build_calendar(tag))
+    return prepared_reply(prepared, 'text/calendar; charset=utf-8', headers)
+
+@app.route('/calendar.ics')
+def calendar_feed():
+    return flask_reply(calendar_reply(request.args, request.headers))
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    if lifecycle.draining:
+        # Telegram повторит доставку, ее получит новый экземпляр
+        return 'Shutting down', 503
+    if request.headers.get('content-type') == 'application/json':
+        json_string = request.get_data().decode('utf-8')
+        if update_recorder:
+            update_recorder.record(json.loads(json_string))
+        update = telebot.types.Update.de_json(json_string)
+        bot.process_new_updates([update])
+        return ''
+    else:
+        return 'Invalid content type', 403
+
+# Асинхронный режим (BOT_RUNTIME=async): прием обновлений и отправка ответов в цикле asyncio через
+# AsyncTeleBot и aiohttp; в ограниченном пуле потоков выполняется только логика обработчиков (SQLite, резервные копии)
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', 16))
+ASYNC_MAX_PENDING = 1000
+# Методы Bot API, вызовы которых из обработчиков откладываются до отправки в цикле asyncio
+ASYNC_REPLY_METHODS = ('send_message', 'edit_message_text', 'edit_message_reply_markup', 'answer_callback_query')
+
+reply_outbox = threading.local()
+
+class DeferredReply:
+    """Результат отложенного вызова Bot API; обращение к его полям дожидается отправки"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def __getattr__(self, name):
+        if not self.done:
+            self.outbox.flush()
+        if self.error:
+            raise self.error
+        return getattr(self.result, name)
+
+class ReplyOutbox:
+    """Ответы одного обновления: копятся в потоке обработчика, отправляются по порядку через AsyncTeleBot"""
+
+    def __init__(self, async_bot, loop):
+        self.async_bot = async_bot
+        self.loop = loop
+        self.calls = []
+
+    def add(self, method, args, kwargs):
+        reply = DeferredReply(self)
+        self.calls.append((method, args, kwargs, reply))
+        return reply
+
+    async def send(self):
+        calls, self.calls = self.calls, []
+        for method, args, kwargs, reply in calls:
+            try:
+                reply.result = await getattr(self.async_bot, method)(*args, **kwargs)
+            except Exception as e:
+                reply.error = e
+                logger.error(f"Ошибка отправки ответа ({method}): {e}")
+            reply.done = True
+
+    def flush(self):
+        """Отправить накопленное из потока обработчика и дождаться (нужен результат вызова)"""
+        asyncio.run_coroutine_threadsafe(self.send(), self.loop).result()
+
+def defer_replies():
+    """Вызовы ответов внутри обработчиков попадают в очередь обновления, остальные потоки отправляют сами"""
+    for method in ASYNC_REPLY_METHODS:
+        def deferred(*args, _method=method, _send=getattr(bot, method), **kwargs):
+            outbox = getattr(reply_outbox, 'current', None)
+            if outbox is None:
+                return _send(*args, **kwargs)
+            return outbox.add(_method, args, kwargs)
+        setattr(bot, method, deferred)
+
+class AsyncDispatcher:
+    """Передача обновлений общим обработчикам бота в пул потоков с ограничением очереди"""
+
+    def __init__(self, loop, async_bot):
+        self.loop = loop
+        self.async_bot = async_bot
+        self.executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='bot-handler')
+        self.slots = asyncio.Semaphore(ASYNC_MAX_PENDING)
+        self.pending = set()
+        self.offset = None
+
+    async def dispatch(self, update):
+        # При переполнении очереди прием ждет освобождения места
+        await self.slots.acquire()
+        task = self.loop.create_task(self.process(update))
+        self.pending.add(task)
+        task.add_done_callback(self._done)
+
+    async def process(self, update):
+        outbox = ReplyOutbox(self.async_bot, self.loop)
+        try:
+            await self.loop.run_in_executor(self.executor, self.handle, update, outbox)
+        finally:
+            await outbox.send()
+
+    @staticmethod
+    def handle(update, outbox):
+        reply_outbox.current = outbox
+        try:
+            bot.process_new_updates([update])
+        finally:
+            reply_outbox.current = None
+
+    def _done(self, future):
+        self.pending.discard(future)
+        self.slots.release()
+        if not future.cancelled() and future.exception():
+            logger.error(f"Ошибка обработки обновления: {future.exception()}")
+
+    async def drain(self):
+        """Ожидание обработки принятых обновлений; False - не все успели до SHUTDOWN_DEADLINE"""
+        unfinished = ()
+        if self.pending:
+            _, unfinished = await asyncio.wait(list(self.pending), timeout=SHUTDOWN_DEADLINE)
+        await self.loop.run_in_executor(None, self.executor.shutdown, True)
+        return not unfinished
+
+def create_async_web_app(dispatcher):
+    """Прием webhook в цикле asyncio (те же маршруты, что и у Flask-приложения)"""
+    from aiohttp import web
+
+    def shared(build_reply):
+        """Маршрут на общем обработчике; сборка ответа может читать базу, поэтому идет в пуле потоков"""
+        async def handler(request):
+            status, headers, body = await dispatcher.loop.run_in_executor(
+                dispatcher.executor, lambda: build_reply(request.query, request.headers, **request.match_info)
+            )
+            return web.Response(body=body, status=status, headers=headers)
+        return handler
+
+    async def index(request):
+        return web.Response(text="Бот управления инвентарем работает!")
+
+    async def health(request):
+        return web.Response(text="ok")
+
+    async def ready(request):
+        if lifecycle.is_ready():
+            return web.Response(text="ready")
+        return web.Response(text="not ready", status=503)
+
+    async def webhook(request):
+        if lifecycle.draining:
+            return web.Response(text='Shutting down', status=503)
+        if request.content_type != 'application/json':
+            return web.Response(text='Invalid content type', status=403)
+        json_string = await request.text()
+        if update_recorder:
+            update_recorder.record(json.loads(json_string))
+        await dispatcher.dispatch(telebot.types.Update.de_json(json_string))
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_get('/', index)
+    web_app.router.add_get('/health', health)
+    web_app.router.add_get('/ready', ready)
+    web_app.router.add_get('/api/storages', shared(storages_reply))
+    web_app.router.add_get('/api/storages/{storage_id}/items', shared(storage_items_reply))
+    web_app.router.add_get('/api/events', shared(events_reply))
+    web_app.router.add_get('/calendar.ics', shared(calendar_reply))
+    web_app.router.add_post('/webhook', webhook)
+    return web_app
+
+async def async_polling(async_bot, dispatcher):
+    """Длинный опрос getUpdates без блокировки цикла"""
+    while not lifecycle.draining:
+        try:
+            updates = await async_bot.get_updates(
+                offset=dispatcher.offset, timeout=POLLING_TIMEOUT, request_timeout=POLLING_TIMEOUT + 5
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(3)
+            continue
+        for update in updates:
+            dispatcher.offset = update.update_id + 1
+            if update_recorder:
+                update_recorder.record(update_to_dict(update))
+            await dispatcher.dispatch(update)
+
+async def async_main():
+    from telebot import asyncio_helper
+    from telebot.async_telebot import AsyncTeleBot
+    from aiohttp import web
+    
+    if TELEGRAM_API_URL:
+        asyncio_helper.API_URL = TELEGRAM_API_URL
+    loop = asyncio.get_running_loop()
+    async_bot = AsyncTeleBot(TOKEN)
+    dispatcher = AsyncDispatcher(loop, async_bot)
+    # Обработчики вызываются прямо в потоке пула, без собственного пула потоков бота,
+    # а их ответы отправляет AsyncTeleBot
+    bot.threaded = False
+    defer_replies()
+    
+    stopped = asyncio.Event()
+    def on_signal(signum):
+        if lifecycle.draining:
+            return
+        logger.info(f"Получен сигнал {signum}, прекращаем прием обновлений")
+        lifecycle.draining = True
+        stopped.set()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, on_signal, signum)
+    
+    await loop.run_in_executor(dispatcher.executor, warm_up)
+    try:
+        if os.environ.get('RENDER'):
+            runner = web.AppRunner(create_async_web_app(dispatcher))
+            await runner.setup()
+            await web.TCPSite(runner, '0.0.0.0', 10000).start()
+            
+            webhook_url = f"https://{os.environ.get('RENDER_EXTERNAL_HOSTNAME')}/webhook"
+            await async_bot.remove_webhook()
+            await asyncio.sleep(1)
+            await async_bot.set_webhook(url=webhook_url)
+            print(f"Webhook установлен (asyncio): {webhook_url}")
+            
+            lifecycle.ready = True
+            await stopped.wait()
+            await runner.cleanup()
+        else:
+            print("Бот запущен в режиме polling (asyncio)...")
+            await async_bot.remove_webhook()
+            lifecycle.ready = True
+            poller = asyncio.create_task(async_polling(async_bot, dispatcher))
+            await stopped.wait()
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        
+        drained = await dispatcher.drain()
+        if dispatcher.offset and not drained:
+            logger.warning("Обработка не завершена, обновления не подтверждены и будут доставлены повторно")
+        elif dispatcher.offset:
+            # Все полученные обновления обработаны: подтверждаем их, чтобы новый экземпляр их не повторил
+            try:
+                await async_bot.get_updates(offset=dispatcher.offset, limit=1, timeout=0)
+            except Exception as e:
+                logger.error(f"Ошибка подтверждения обновлений: {e}")
+    finally:
+        if asyncio_helper.session_manager.session:
+            await async_bot.close_session()
+
+if __name__ == '__main__':
+    if os.environ.get('BOT_RUNTIME') == 'async':
+        asyncio.run(async_main())
+    else:
+        signal.signal(signal.SIGTERM, handle_shutdown_signal)
+        signal.signal(signal.SIGINT, handle_shutdown_signal)
+        warm_up()
+        
+        if os.environ.get('RENDER'):
+            from werkzeug.serving import make_server
+            web_server = make_server('0.0.0.0', 10000, app, threaded=True)
+            
+            webhook_url = f"https://{os.environ.get('RENDER_EXTERNAL_HOSTNAME')}/webhook"
+            bot.remove_webhook()
+            time.sleep(1)
+            bot.set_webhook(url=webhook_url)
+            print(f"Webhook установлен: {webhook_url}")
+            
+            lifecycle.ready = True
+            web_server.serve_forever()
+        else:
+            print("Бот запущен в режиме polling...")
+            bot.remove_webhook()
+            lifecycle.ready = True
+            bot.polling(non_stop=True, long_polling_timeout=POLLING_TIMEOUT)
+            # Подтверждаем полученные обновления, только когда все они обработаны; иначе новый экземпляр получит их повторно
+            if lifecycle.wait_idle(time.time() + SHUTDOWN_DEADLINE):
+                try:
+                    bot.get_updates(offset=bot.last_update_id + 1, limit=1, timeout=1, long_polling_timeout=0)
+                except Exception as e:
+                    logger.error(f"Ошибка подтверждения обновлений: {e}")
+            else:
+                logger.warning("Обработка не завершена, обновления не подтверждены и будут доставлены повторно")
+    
+    drain_and_flush()
+
@@ -0,0 +1,163 @@
+"""Локальная замена Telegram Bot API для нагрузочного тестирования webhook.
+
+Запуск:
+    python fake_bot_api.py --port 8081 --latency 50 --jitter 20 --error-429 0.01
+
+Бот направляется сюда переменной окружения
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1}
+
+Служебные адреса: GET /_calls - записанные вызовы и сводка, POST /_reset - очистка.
+"""
+import argparse
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# Настройки задержек и ошибок (задаются аргументами командной строки)
+settings = {
+    'latency': 0.0,
+    'jitter': 0.0,
+    'error_429': 0.0,
+    'max_rps': 0,
+    'retry_after': 1
+}
+
+calls_lock = threading.Lock()
+calls = []
+message_ids = itertools.count(1)
+
+class RateWindow:
+    """Число вызовов за последнюю секунду (для имитации глобального лимита Telegram)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.second = 0
+        self.count = 0
+
+    def hit(self):
+        now = int(time.time())
+        with self.lock:
+            if now != self.second:
+                self.second = now
+                self.count = 0
+            self.count += 1
+            return self.count
+
+rate_window = RateWindow()
+
+def get_params():
+    """Параметры вызова: telebot передает их в строке запроса, AsyncTeleBot - формой, можно и JSON"""
+    params = request.values.to_dict()
+    if request.is_json:
+        params.update(request.get_json(silent=True) or {})
+    return params
+
+def fake_message(params):
+    chat_id = int(params.get('chat_id') or 0)
+    return {
+        'message_id': int(params.get('message_id') or next(message_ids)),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+        'text': params.get('text', '')
+    }
+
+def fake_result(method, params):
+    if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+        return fake_message(params)
+    if method == 'getMe':
+        return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+    if method == 'getUpdates':
+        # Обновления приходят только через webhook - длинный опрос просто ждет
+        time.sleep(min(float(params.get('timeout') or 0), 1.0))
+        return []
+    if method == 'getWebhookInfo':
+        return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+    return True
+
+def record_call(method, params, status, started):
+    with calls_lock:
+        calls.append({
+            'ts': started,
+            'duration': round(time.time() - started, 4),
+            'method': method,
+            'chat_id': params.get('chat_id'),
+            'status': status
+        })
+
+@app.route('/bot<token>/<method>', methods=['GET', 'POST'])
+def bot_api(token, method):
+    started = time.time()
+    params = get_params()
+
+    delay = settings['latency'] + random.uniform(0, settings['jitter'])
+    if delay > 0:
+        time.sleep(delay)
+
+    over_limit = settings['max_rps'] and rate_window.hit() > settings['max_rps']
+    if over_limit or random.random() < settings['error_429']:
+        record_call(method, params, 429, started)
+        return jsonify({
+            'ok': False,
+            'error_code': 429,
+            'description': f"Too Many Requests: retry after {settings['retry_after']}",
+            'parameters': {'retry_after': settings['retry_after']}
+        }), 429
+
+    record_call(method, params, 200, started)
+    return jsonify({'ok': True, 'result': fake_result(method, params)})
+
+@app.route('/_calls')
+def get_calls():
+    """Записанные вызовы (since - только после момента времени) и сводка по методам"""
+    since = float(request.args.get('since', 0))
+    with calls_lock:
+        selected = [call for call in calls if call['ts'] >= since]
+    summary = {}
+    for call in selected:
+        counters = summary.setdefault(call['method'], {'total': 0, 'status_429': 0})
+        counters['total'] += 1
+        if call['status'] == 429:
+            counters['status_429'] += 1
+    return jsonify({'summary': summary, 'calls': selected})
+
+@app.route('/_reset', methods=['POST'])
+def reset_calls():
+    with calls_lock:
+        calls.clear()
+    return jsonify({'ok': True})
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0, help="задержка ответа, мс")
+    parser.add_argument('--jitter', type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument('--error-429', type=float, default=0, help="доля ответов 429 (0..1)")
+    parser.add_argument('--max-rps', type=int, default=0, help="лимит вызовов в секунду, сверх него 429 (0 - без лимита)")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after в ответах 429, с")
+    args = parser.parse_args()
+
+    settings.update({
+        'latency': args.latency / 1000,
+        'jitter': args.jitter / 1000,
+        'error_429': args.error_429,
+        'max_rps': args.max_rps,
+        'retry_after': args.retry_after
+    })
+    logger.info(f"Fake Bot API: http://{args.host}:{args.port}/bot{{0}}/{{1}}, настройки: {json.dumps(settings)}")
+
+    from werkzeug.serving import make_server
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
+
+if __name__ == '__main__':
+    main()
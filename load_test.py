@@ -0,0 +1,162 @@
+"""Нагрузочный прогон webhook: отправка обновлений с заданной частотой и отчет.
+
+Порядок запуска:
+    python fake_bot_api.py --port 8081 --latency 50
+    RENDER=1 RENDER_EXTERNAL_HOSTNAME=localhost BOT_TOKEN=123:test \\
+        TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1} python bot.py
+    python load_test.py --rate 50 --duration 30 --chats 200
+
+Сквозная задержка - от отправки обновления до первого вызова Bot API для того же чата
+(вызовы берутся из записи fake_bot_api.py).
+"""
+import argparse
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Сценарий пользователя: каждый чат проходит его по кругу
+SCENARIO = [
+    '/start',
+    '📦 Кладовая',
+    '📍 Гринбокс 11',
+    '🔙 Назад',
+    '🔙 В главное меню',
+    '📅 События',
+    '🔙 В главное меню'
+]
+
+def build_update(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load_{chat_id}'},
+            'text': text
+        }
+    }
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def format_latency(values):
+    return (f"p50 {percentile(values, 0.5) * 1000:.1f} мс, p95 {percentile(values, 0.95) * 1000:.1f} мс, "
+            f"p99 {percentile(values, 0.99) * 1000:.1f} мс, max {max(values, default=0) * 1000:.1f} мс")
+
+class LoadDriver:
+    """Отправка обновлений в webhook с постоянной частотой"""
+
+    def __init__(self, webhook_url, rate, duration, chats, workers):
+        self.webhook_url = webhook_url
+        self.rate = rate
+        self.duration = duration
+        self.chats = chats
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.sent = []
+        self.webhook_latency = []
+        self.errors = {}
+
+    def post(self, update):
+        chat_id = update['message']['chat']['id']
+        started = time.time()
+        try:
+            response = self.session.post(self.webhook_url, json=update, timeout=30)
+            error = None if response.status_code == 200 else f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        with self.lock:
+            self.sent.append((chat_id, started))
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            else:
+                self.webhook_latency.append(time.time() - started)
+
+    def run(self):
+        update_ids = itertools.count(int(time.time()))
+        steps = {}
+        started = time.time()
+        total = int(self.rate * self.duration)
+        for i in range(total):
+            # Равномерный темп: ждем момента отправки очередного обновления
+            delay = started + i / self.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            chat_id = 1_000_000 + i % self.chats
+            step = steps.get(chat_id, 0)
+            steps[chat_id] = step + 1
+            self.executor.submit(self.post, build_update(next(update_ids), chat_id, SCENARIO[step % len(SCENARIO)]))
+        self.executor.shutdown(wait=True)
+        return time.time() - started
+
+def end_to_end_latency(sent, calls):
+    """Для каждого обновления - время до первого вызова API в его чате до следующего обновления этого чата"""
+    calls_by_chat = {}
+    for call in calls:
+        if call.get('chat_id'):
+            calls_by_chat.setdefault(str(call['chat_id']), []).append(call['ts'])
+    sent_by_chat = {}
+    for chat_id, ts in sent:
+        sent_by_chat.setdefault(str(chat_id), []).append(ts)
+
+    latency = []
+    unanswered = 0
+    for chat_id, sent_times in sent_by_chat.items():
+        sent_times.sort()
+        call_times = sorted(calls_by_chat.get(chat_id, []))
+        position = 0
+        for i, ts in enumerate(sent_times):
+            next_ts = sent_times[i + 1] if i + 1 < len(sent_times) else float('inf')
+            while position < len(call_times) and call_times[position] < ts:
+                position += 1
+            if position < len(call_times) and call_times[position] < next_ts:
+                latency.append(call_times[position] - ts)
+            else:
+                unanswered += 1
+    return latency, unanswered
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон webhook бота")
+    parser.add_argument('--webhook-url', default='http://127.0.0.1:10000/webhook')
+    parser.add_argument('--api-url', default='http://127.0.0.1:8081', help="адрес fake_bot_api.py")
+    parser.add_argument('--rate', type=float, default=20, help="обновлений в секунду")
+    parser.add_argument('--duration', type=float, default=10, help="длительность, с")
+    parser.add_argument('--chats', type=int, default=100, help="число разных чатов")
+    parser.add_argument('--workers', type=int, default=64, help="одновременных запросов к webhook")
+    parser.add_argument('--settle', type=float, default=3, help="ожидание хвоста ответов после отправки, с")
+    args = parser.parse_args()
+
+    requests.post(f"{args.api_url}/_reset", timeout=10)
+    started = time.time()
+    driver = LoadDriver(args.webhook_url, args.rate, args.duration, args.chats, args.workers)
+    elapsed = driver.run()
+    time.sleep(args.settle)
+    recorded = requests.get(f"{args.api_url}/_calls", params={'since': started}, timeout=30).json()
+
+    sent = len(driver.sent)
+    errors = sum(driver.errors.values())
+    calls = recorded['calls']
+    if not sent:
+        # Например, --rate или --duration равны нулю: считать проценты и средние не от чего
+        print(f"Не отправлено ни одного обновления (--rate {args.rate}, --duration {args.duration})")
+        return
+    latency, unanswered = end_to_end_latency(driver.sent, [call for call in calls if call['status'] == 200])
+    print(f"Отправлено обновлений: {sent} за {elapsed:.1f} с ({sent / elapsed:.1f}/с)")
+    print(f"Ошибки webhook: {errors} ({errors / sent:.2%})" + (f" {driver.errors}" if errors else ""))
+    print(f"Ответ webhook: {format_latency(driver.webhook_latency)}")
+    print(f"Сквозная задержка: {format_latency(latency)}")
+    print(f"Без ответа: {unanswered}")
+    print(f"Вызовов Bot API: {len(calls)} ({len(calls) / sent:.2f} на обновление)")
+    for method, counters in sorted(recorded['summary'].items()):
+        print(f"  {method}: {counters['total']} (429: {counters['status_429']})")
+
+if __name__ == '__main__':
+    main()
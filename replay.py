@@ -0,0 +1,230 @@
+"""Воспроизведение записанных обновлений на свежем экземпляре бота для сравнения версий.
+
+Запись включается у рабочего бота переменной окружения RECORD_UPDATES_DIR=recordings.
+Порядок воспроизведения:
+    python fake_bot_api.py --port 8081 --latency 50
+    python replay.py recordings/ --speed 10 --report before.json
+    ... (новая версия бота)
+    python replay.py recordings/ --speed 10 --report after.json --compare before.json
+
+Бот запускается в этом же процессе в пустом временном каталоге (новая база и бэкапы),
+вызовы Bot API уходят в fake_bot_api.py. --speed 1 - в темпе записи, 10 - в 10 раз быстрее,
+0 - без пауз. Обновления одного чата обрабатываются по порядку (чат закреплен за потоком),
+разные чаты - параллельно. Задержка - от момента, когда обновление пришло бы по записи,
+до конца его обработки (включая ожидание в очереди своего потока и вызовы Bot API).
+
+Ограничение флуда при ускоренном воспроизведении отбрасывало бы большую часть обновлений, поэтому
+по умолчанию оно отключено; --flood-guard оставляет рабочие лимиты, отброшенные обновления
+считаются в отчете отдельно.
+"""
+import argparse
+import gzip
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from load_test import format_latency, percentile
+
+def recording_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.startswith('updates_') and name.endswith('.jsonl.gz')
+            )
+        else:
+            files.append(path)
+    return sorted(os.path.abspath(path) for path in files)
+
+def iter_recorded(files):
+    for path in files:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except (EOFError, OSError) as e:
+            # Недописанный последний блок после аварийного завершения - берем то, что успело записаться
+            print(f"{os.path.basename(path)}: запись оборвана ({e}), читаем до обрыва")
+
+def update_chat_id(update):
+    if update.get('message'):
+        return update['message']['chat']['id']
+    message = update.get('callback_query', {}).get('message')
+    return message['chat']['id'] if message else None
+
+# Лимиты, при которых ограничение флуда никогда не срабатывает
+UNLIMITED_FLOOD = {'FLOOD_RATE': '1e9', 'FLOOD_BURST': '1e9', 'FLOOD_OVERLOAD_BACKLOG': str(10 ** 9)}
+
+def start_bot(api_url, flood_guard=False):
+    """Импорт бота в пустом каталоге с Bot API, направленным в fake_bot_api.py"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault('BOT_TOKEN', '123:replay')
+    if not flood_guard:
+        os.environ.update(UNLIMITED_FLOOD)
+    os.environ['TELEGRAM_API_URL'] = f"{api_url}/bot{{0}}/{{1}}"
+    os.environ.pop('RECORD_UPDATES_DIR', None)
+    os.environ.pop('RENDER', None)
+    os.chdir(tempfile.mkdtemp(prefix='replay_'))
+    import bot
+    bot.warm_up()
+    return bot
+
+class ChatWorkers:
+    """Потоки обработки: обновления чата всегда попадают в один поток и идут по порядку"""
+
+    def __init__(self, bot, count):
+        self.bot = bot
+        self.lock = threading.Lock()
+        self.latency = []
+        self.queues = [queue.Queue() for _ in range(count)]
+        for updates in self.queues:
+            threading.Thread(target=self._run, args=(updates,), daemon=True).start()
+
+    def _run(self, updates):
+        while True:
+            submitted, update = updates.get()
+            try:
+                self.bot.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                with self.lock:
+                    self.latency.append(time.time() - submitted)
+                updates.task_done()
+
+    def submit(self, chat_id, update):
+        self.queues[hash(chat_id) % len(self.queues)].put((time.time(), update))
+
+    def join(self):
+        for updates in self.queues:
+            updates.join()
+
+def replay(bot, records, speed, workers):
+    from telebot import types
+    # Обработчики вызываются прямо в потоках ChatWorkers
+    bot.bot.threaded = False
+    chat_workers = ChatWorkers(bot, workers)
+    first_ts = records[0]['ts']
+    started = time.time()
+    for record in records:
+        if speed > 0:
+            delay = started + (record['ts'] - first_ts) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        update = record['update']
+        message = update.get('message')
+        if message and message.get('text') == bot.RECORD_SECRET_MARKER:
+            message['text'] = bot.SECRET_WORD
+        chat_workers.submit(update_chat_id(update), types.Update.de_json(update))
+    chat_workers.join()
+    return chat_workers.latency, time.time() - started
+
+def collect_db_stats(bot):
+    top = bot.query_stats.top(limit=None)
+    statements = sum(entry['count'] for sql, entry in top)
+    return {
+        'db_statements': statements,
+        'db_commits': sum(entry['count'] for sql, entry in top if sql == 'COMMIT'),
+        'db_time_ms': round(sum(entry['total'] for sql, entry in top) * 1000, 1),
+        'db_slow': sum(entry['slow'] for sql, entry in top),
+        'db_top': [
+            {'sql': sql[:200], 'count': entry['count'], 'total_ms': round(entry['total'] * 1000, 1)}
+            for sql, entry in top[:5]
+        ]
+    }
+
+def collect_backup_stats(bot):
+    with bot.use_tenant(bot.get_tenant(bot.DEFAULT_TENANT)):
+        manifest = bot.load_backup_manifest()
+        journal_records = bot.current_tenant().journal.seq
+    reasons = [entry.get('reason', '') for entry in manifest.values()]
+    return {
+        'backups': sum(1 for reason in reasons if reason != 'initial'),
+        'journal_records': journal_records
+    }
+
+def print_comparison(report, baseline):
+    print("\nСравнение с прошлым прогоном:")
+    for key, value in report.items():
+        old = baseline.get(key)
+        if isinstance(value, (int, float)) and isinstance(old, (int, float)):
+            change = f" ({(value - old) / old:+.1%})" if old else ""
+            print(f"  {key}: {old} -> {value}{change}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument('paths', nargs='+', help="файлы updates_*.jsonl.gz или каталоги записи")
+    parser.add_argument('--api-url', default='http://127.0.0.1:8081', help="адрес fake_bot_api.py")
+    parser.add_argument('--speed', type=float, default=1, help="ускорение относительно записи (0 - без пауз)")
+    parser.add_argument('--workers', type=int, default=2, help="потоков обработки (как num_threads у TeleBot)")
+    parser.add_argument('--limit', type=int, default=0, help="воспроизвести только первые N обновлений")
+    parser.add_argument('--settle', type=float, default=3, help="ожидание хвоста ответов и бэкапов, с")
+    parser.add_argument('--report', help="сохранить отчет в JSON")
+    parser.add_argument('--compare', help="отчет прошлого прогона для сравнения")
+    parser.add_argument('--flood-guard', action='store_true', help="оставить рабочие лимиты флуда")
+    args = parser.parse_args()
+
+    files = recording_files(args.paths)
+    records = list(iter_recorded(files))
+    records.sort(key=lambda record: record['ts'])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("Нет записанных обновлений")
+        return
+    report_path = os.path.abspath(args.report) if args.report else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    bot = start_bot(args.api_url, args.flood_guard)
+    requests.post(f"{args.api_url}/_reset", timeout=10)
+    started = time.time()
+    latency, elapsed = replay(bot, records, args.speed, args.workers)
+    time.sleep(args.settle)
+    recorded = requests.get(f"{args.api_url}/_calls", params={'since': started}, timeout=30).json()
+
+    calls = recorded['calls']
+    report = {
+        'updates': len(latency),
+        'duration_s': round(elapsed, 2),
+        'recorded_span_s': round(records[-1]['ts'] - records[0]['ts'], 2),
+        'latency_p50_ms': round(percentile(latency, 0.5) * 1000, 1),
+        'latency_p95_ms': round(percentile(latency, 0.95) * 1000, 1),
+        'latency_p99_ms': round(percentile(latency, 0.99) * 1000, 1),
+        'api_calls': len(calls),
+        'api_errors': sum(1 for call in calls if call['status'] != 200),
+        # Отброшены ограничением флуда, а не обработаны ботом
+        'flood_dropped': bot.flood_guard.dropped,
+        'flood_shed': bot.flood_guard.shed,
+        **collect_db_stats(bot),
+        **collect_backup_stats(bot)
+    }
+    print(f"Воспроизведено обновлений: {report['updates']} за {elapsed:.1f} с (в записи {report['recorded_span_s']} с, ускорение {args.speed or 'без пауз'})")
+    print(f"Задержка обработки: {format_latency(latency)}")
+    if report['flood_dropped'] or report['flood_shed']:
+        print(f"Отброшено ограничением флуда: {report['flood_dropped']} (при перегрузке: {report['flood_shed']})")
+    print(f"Вызовов Bot API: {len(calls)} ({len(calls) / len(latency):.2f} на обновление, ошибок: {report['api_errors']})")
+    print(f"Запросов к базе: {report['db_statements']} (фиксаций: {report['db_commits']}, "
+          f"время: {report['db_time_ms']} мс, медленных: {report['db_slow']})")
+    for entry in report['db_top']:
+        print(f"  {entry['count']}× {entry['total_ms']} мс: {entry['sql']}")
+    print(f"Бэкапов: {report['backups']}, записей журнала: {report['journal_records']}")
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if compare_path:
+        with open(compare_path, encoding='utf-8') as f:
+            print_comparison(report, json.load(f))
+
+if __name__ == '__main__':
+    main()
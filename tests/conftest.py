@@ -0,0 +1,9 @@
+"""Импорт bot.py в тестах: модуль при импорте открывает базу и каталоги бэкапов в текущем каталоге,
+поэтому тесты работают во временной папке с токеном-заглушкой"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '0:test')
+os.chdir(tempfile.mkdtemp(prefix='inventory_bot_test_'))
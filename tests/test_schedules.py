@@ -0,0 +1,170 @@
+"""Индекс броней, cron-расписание и повторения правил событий: сверка с полным перебором и граничные даты"""
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import bot
+
+BASE = date(2030, 1, 1)
+
+def day(offset):
+    return (BASE + timedelta(days=offset)).isoformat()
+
+def reservation(reservation_id, start, end):
+    return bot.Reservation(str(reservation_id), 1, 'gb11', 'event', 'Событие', day(start), day(end))
+
+def brute_overlapping(reservations, start, end):
+    found = [r for r in reservations if r.start_date <= end and r.end_date >= start]
+    return [r.id for r in sorted(found, key=lambda r: (r.start_date, r.id))]
+
+# ItemSchedule
+
+def test_overlapping_and_busy_match_brute_force():
+    rng = random.Random(20301)
+    for _ in range(2000):
+        reservations = []
+        for i in range(rng.randint(0, 40)):
+            start = rng.randint(0, 60)
+            reservations.append(reservation(i, start, start + rng.randint(0, 10)))
+        schedule = bot.ItemSchedule(reservations)
+        start = rng.randint(-5, 70)
+        window = (day(start), day(start + rng.randint(0, 10)))
+        assert [r.id for r in schedule.overlapping(*window)] == brute_overlapping(reservations, *window)
+        probe = day(rng.randint(-5, 70))
+        assert schedule.busy(probe) == any(r.start_date <= probe <= r.end_date for r in reservations)
+
+def test_overlapping_boundaries_are_inclusive():
+    schedule = bot.ItemSchedule([reservation('a', 10, 12)])
+    assert [r.id for r in schedule.overlapping(day(12), day(20))] == ['a']
+    assert [r.id for r in schedule.overlapping(day(0), day(10))] == ['a']
+    assert schedule.overlapping(day(13), day(20)) == []
+    assert schedule.overlapping(day(0), day(9)) == []
+    assert bot.ItemSchedule().overlapping(day(0), day(9)) == []
+
+def test_overlapping_skips_long_prefix_of_finished_reservations():
+    # Одна длинная ранняя бронь держит префиксный максимум окончаний: обход все равно логарифмический
+    count = 50000
+    schedule = bot.ItemSchedule([reservation(0, 0, count + 10)] + [reservation(i, i, i) for i in range(1, count)])
+    visited = []
+    collect = bot.ItemSchedule._collect
+    def counting(self, *args):
+        visited.append(args)
+        return collect(self, *args)
+    bot.ItemSchedule._collect = counting
+    try:
+        assert [r.id for r in schedule.overlapping(day(count + 5), day(count + 6))] == ['0']
+    finally:
+        bot.ItemSchedule._collect = collect
+    assert len(visited) < 100
+
+# CronSchedule
+
+@pytest.mark.parametrize('spec, moment, expected', [
+    # Переход через конец месяца и года
+    ('0 0 1 * *', datetime(2026, 1, 31, 12, 0), datetime(2026, 2, 1, 0, 0)),
+    ('30 23 31 12 *', datetime(2026, 12, 31, 23, 30), datetime(2027, 12, 31, 23, 30)),
+    ('0 0 * * *', datetime(2026, 12, 31, 23, 59, 30), datetime(2027, 1, 1, 0, 0)),
+    # 31-е есть не в каждом месяце, 29 февраля - только в високосный год
+    ('0 9 31 * *', datetime(2026, 4, 1, 0, 0), datetime(2026, 5, 31, 9, 0)),
+    ('0 12 29 2 *', datetime(2026, 3, 1, 0, 0), datetime(2028, 2, 29, 12, 0)),
+    # Шаг и строго «после»
+    ('*/15 * * * *', datetime(2026, 5, 1, 10, 7), datetime(2026, 5, 1, 10, 15)),
+    ('*/15 * * * *', datetime(2026, 5, 1, 10, 15), datetime(2026, 5, 1, 10, 30)),
+    ('*/15 * * * *', datetime(2026, 5, 1, 23, 45), datetime(2026, 5, 2, 0, 0)),
+    # День месяца и день недели должны совпасть оба: пятница, 13-е
+    ('0 9 13 * 5', datetime(2026, 10, 19, 0, 0), datetime(2026, 11, 13, 9, 0)),
+    ('0 9 13 * 5', datetime(2026, 11, 13, 9, 0), datetime(2027, 8, 13, 9, 0)),
+    # Воскресенье - 0, рабочие дни диапазоном
+    ('0 10 * * 0', datetime(2026, 10, 19, 0, 0), datetime(2026, 10, 25, 10, 0)),
+    ('0 8 * * 1-5', datetime(2026, 10, 23, 9, 0), datetime(2026, 10, 26, 8, 0)),
+])
+def test_cron_next_after(spec, moment, expected):
+    assert bot.CronSchedule(spec).next_after(moment) == expected
+
+def test_cron_next_after_matches_brute_force():
+    rng = random.Random(20302)
+    for _ in range(200):
+        spec = ' '.join([
+            rng.choice(['*', '0', '*/20', '5,35']),
+            rng.choice(['*', '3', '*/6', '22-23']),
+            rng.choice(['*', '1', '15', '28-31']),
+            rng.choice(['*', '2', '1-3', '12']),
+            rng.choice(['*', '0', '1-5', '6']),
+        ])
+        cron = bot.CronSchedule(spec)
+        moment = datetime(2026, 1, 1) + timedelta(minutes=rng.randint(0, 525600))
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        while True:
+            # Неподходящий день пропускаем целиком, внутри подходящего перебираем минуты
+            if not (candidate.day in cron.days and candidate.month in cron.months
+                    and candidate.isoweekday() % 7 in cron.weekdays):
+                candidate = datetime.combine(candidate.date() + timedelta(days=1), datetime.min.time())
+            elif candidate.minute in cron.minutes and candidate.hour in cron.hours:
+                break
+            else:
+                candidate += timedelta(minutes=1)
+        assert cron.next_after(moment) == candidate, spec
+
+@pytest.mark.parametrize('spec', ['* * * *', '60 * * * *', '* 24 * * *', '* * 0 * *', '* * * 13 *', '* * * * 7', '*/0 * * * *'])
+def test_cron_rejects_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        bot.CronSchedule(spec)
+
+def test_cron_never_matching_spec_raises():
+    with pytest.raises(ValueError):
+        bot.CronSchedule('0 0 30 2 *').next_after(datetime(2026, 1, 1))
+
+# Повторения правил событий
+
+def rule(start_date, freq, until=None, exdates=()):
+    return {'id': 'r', 'event_name': 'Серия', 'start_date': start_date, 'freq': freq, 'until': until,
+            'exdates': frozenset(exdates)}
+
+def brute_occurrences(rule_data, start, end):
+    first = date.fromisoformat(rule_data['start_date'])
+    last = min(end, date.fromisoformat(rule_data['until'])) if rule_data['until'] else end
+    current, found = max(start, first), []
+    while current <= last:
+        matches = {
+            'daily': True,
+            'weekly': (current - first).days % 7 == 0,
+            'monthly': current.day == first.day,
+        }[rule_data['freq']]
+        if matches and current.isoformat() not in rule_data['exdates']:
+            found.append(current.isoformat())
+        current += timedelta(days=1)
+    return found
+
+def test_monthly_rule_from_31st_skips_short_months():
+    occurrences = bot.iter_occurrences(rule('2026-01-31', 'monthly'), date(2026, 1, 1), date(2026, 12, 31))
+    assert list(occurrences) == ['2026-01-31', '2026-03-31', '2026-05-31', '2026-07-31', '2026-08-31',
+                                 '2026-10-31', '2026-12-31']
+
+def test_monthly_rule_on_leap_day():
+    occurrences = bot.iter_occurrences(rule('2024-02-29', 'monthly'), date(2025, 1, 1), date(2025, 4, 30))
+    assert list(occurrences) == ['2025-01-29', '2025-03-29', '2025-04-29']
+
+def test_exdates_and_until_are_respected():
+    weekly = rule('2026-01-05', 'weekly', until='2026-02-02', exdates=['2026-01-19'])
+    assert list(bot.iter_occurrences(weekly, date(2026, 1, 1), date(2026, 12, 31))) == [
+        '2026-01-05', '2026-01-12', '2026-01-26', '2026-02-02']
+    monthly = rule('2026-01-31', 'monthly', exdates=['2026-03-31'])
+    assert list(bot.iter_occurrences(monthly, date(2026, 3, 1), date(2026, 6, 30))) == ['2026-05-31']
+
+def test_window_starting_mid_series():
+    daily = rule('2020-01-01', 'daily')
+    assert list(bot.iter_occurrences(daily, date(2026, 10, 19), date(2026, 10, 21))) == [
+        '2026-10-19', '2026-10-20', '2026-10-21']
+    assert list(bot.iter_occurrences(daily, date(2019, 12, 30), date(2020, 1, 1))) == ['2020-01-01']
+
+def test_occurrences_match_brute_force():
+    rng = random.Random(20303)
+    for _ in range(500):
+        first = date(2026, 1, 1) + timedelta(days=rng.randint(0, 400))
+        until = (first + timedelta(days=rng.randint(0, 500))).isoformat() if rng.random() < 0.5 else None
+        exdates = [(first + timedelta(days=rng.randint(0, 200))).isoformat() for _ in range(rng.randint(0, 5))]
+        rule_data = rule(first.isoformat(), rng.choice(['daily', 'weekly', 'monthly']), until, exdates)
+        start = date(2026, 1, 1) + timedelta(days=rng.randint(0, 600))
+        end = start + timedelta(days=rng.randint(0, 400))
+        assert list(bot.iter_occurrences(rule_data, start, end)) == brute_occurrences(rule_data, start, end), rule_data